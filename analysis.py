@@ -8,6 +8,10 @@ import math
 import numpy as np
 import fractions
 import itertools
+import functools
+import time
+import json
+import atexit
 
 def notes_to_midi(notes):
     # r is rest
@@ -63,72 +67,68 @@ def normalize_parts_with_durations(parts, durations):
     for n in range(len(parts)):
         cumulative_durations[n] = np.concatenate(([0.], cumulative_durations[n]))
 
-    # everything is the same at the start
-    normed_parts = []
-    normed_durations = []
-    for n in range(len(parts)):
-        normed_parts.append([])
-        normed_durations.append([])
-    step_i = [0 for p in parts]
-    held_p_i = [-1 for p in parts]
-    finished = False
     # should divide into .5, .33, .25, .125, .0625 (no support smaller than 64th notes...)
     check_min = min([vd for d in value_durations for vd in d])
     cumulative_max = max([cd for d in cumulative_durations for cd in d])
 
     assert check_min >= .0625
-    time_inc = .005
-    time = 0.
-    prev_event_time = 0.
-
-    n_comb = 3
-    exact_timings = [0., 0.0625, 0.125, .25, 0.5, 1., 2., 4.]
-    all_exact_timings = list(itertools.product(exact_timings[3:], repeat=n_comb))
-    exact_timings = exact_timings[:3] + [sum(et) for et in all_exact_timings]
-
-    while not finished:
-        # move in small increments, but only append when an event triggers
-        # in any channel
-        # check if an event happened
-        is_event = False
-        which_events = []
-        for n in range(len(parts)):
-            if time < cumulative_durations[n][step_i[n]]:
-                pass
-            else:
-                is_event = True
-                which_events.append(n)
-
-        if is_event:
-            for n in range(len(parts)):
-                tt = round(time - prev_event_time, 4)
-                min_i = np.argmin([np.abs(et - tt) for et in exact_timings])
-                tt = exact_timings[min_i]
-                if n in which_events:
-                    normed_parts[n].append(parts[n][step_i[n]])
-                    normed_durations[n].append(tt)
-                    held_p_i[n] = parts[n][step_i[n]]
-                    step_i[n] += 1
-                else:
-                    normed_parts[n].append(held_p_i[n])
-                    normed_durations[n].append(tt)
-            prev_event_time = time
-        time += time_inc
-        if time >= cumulative_max:
-            for n in range(len(parts)):
-                # backfill the final timestep...
-                tt = round(cumulative_durations[n][-1] - prev_event_time, 4)
-                min_i = np.argmin([np.abs(et - tt) for et in exact_timings])
-                tt = exact_timings[min_i]
-                normed_durations[n].append(tt)
-            finished = True
-    normed_durations = [nd[1:] for nd in normed_durations]
+    if any([cd[-1] != cumulative_max for cd in cumulative_durations]):
+        raise ValueError("All parts must have the same total duration to normalize")
+
+    # events used to be found by stepping time forward in .005 increments,
+    # instead merge the onset lists of every part directly
+    # onsets are snapped to the same float tick times as the stepping version,
+    # so the rounded durations (and the exact_timings snapping) stay identical
+    ticks = normalize_tick_times(float(cumulative_max))
+    onset_ticks = [np.searchsorted(ticks, [float(c) for c in cd[:-1]], side="left")
+                   for cd in cumulative_durations]
+    event_ticks = np.unique(np.concatenate(onset_ticks))
+    event_times = [float(t) for t in ticks[event_ticks]]
+
+    # every event shares the time since the previous event as the duration
+    event_durations = [snap_exact_timing(round(event_times[i] - event_times[i - 1], 4))
+                       for i in range(1, len(event_times))]
+
+    normed_parts = []
+    normed_durations = []
+    for n in range(len(parts)):
+        # the note sounding in part n at each event, held if it has no onset there
+        held_i = np.searchsorted(onset_ticks[n], event_ticks, side="right") - 1
+        normed_parts.append([parts[n][i] for i in held_i])
+        # backfill the final timestep...
+        final_duration = snap_exact_timing(round(float(cumulative_durations[n][-1]) - event_times[-1], 4))
+        normed_durations.append(event_durations + [final_duration])
     normed_durations = [[inverse_durations_map[fracf(ndi)] for ndi in nd] for nd in normed_durations]
     assert len(normed_parts) == len(normed_durations)
     assert all([len(n_p) == len(n_d) for n_p, n_d in zip(normed_parts, normed_durations)])
     return normed_parts, normed_durations
 
 
+normalize_time_inc = .005
+normalize_ticks = [np.zeros((1,))]
+
+def normalize_tick_times(max_time):
+    # tick k is .005 added k times, accumulated in sequence like time += .005
+    # cached and grown on demand
+    ticks = normalize_ticks[0]
+    if ticks[-1] < max_time:
+        n_ticks = len(ticks)
+        while n_ticks * normalize_time_inc < max_time + 1.:
+            n_ticks *= 2
+        ticks = np.concatenate(([0.], np.cumsum(np.zeros((n_ticks,)) + normalize_time_inc)))
+        normalize_ticks[0] = ticks
+    return ticks
+
+
+# normalized durations are snapped to the closest of these
+normalize_exact_timings = [0., 0.0625, 0.125] + [sum(et) for et in itertools.product([.25, 0.5, 1., 2., 4.], repeat=3)]
+normalize_exact_timings_arr = np.array(normalize_exact_timings)
+
+def snap_exact_timing(tt):
+    min_i = np.argmin(np.abs(normalize_exact_timings_arr - tt))
+    return normalize_exact_timings[min_i]
+
+
 def fixup_parts_durations(parts, durations):
     if len(parts[0]) != len(parts[1]):
         new_parts, new_durations = normalize_parts_with_durations(parts, durations)
@@ -137,7 +137,23 @@ def fixup_parts_durations(parts, durations):
     return parts, durations
 
 
-def intervals_from_midi(parts, durations):
+def voice_pairs(n_voices):
+    if n_voices == 2:
+        pairs = [(0, 1)]
+    elif n_voices == 3:
+        # for 3 voices, follow the style of Fux (assume the 3 are STB)
+        # soprano and bass
+        # tenor and bass
+        # soprano and tenor
+        pairs = [(0, 2), (1, 2), (0, 1)]
+    else:
+        raise ValueError("Shouldn't get here, voice_pairs")
+    return pairs
+
+
+def interval_codes_from_midi(parts, durations):
+    # integer version of intervals_from_midi, (pairs, T) codes indexing
+    # interval_names and the interval lookup tables
     if len(parts) < 2:
         raise ValueError("Must be at least 2 parts to compare intervals")
     if len(parts) > 3:
@@ -149,42 +165,37 @@ def intervals_from_midi(parts, durations):
     for p, d in zip(parts, durations):
         assert len(p) == len(d)
 
-    if len(parts) == 2:
-        pairs = [(0, 1)]
-    elif len(parts) == 3:
-        # for 3 voices, follow the style of Fux (assume the 3 are STB)
-        # soprano and bass
-        # tenor and bass
-        # soprano and tenor
-        pairs = [(0, 2), (1, 2), (0, 1)]
-    else:
-        raise ValueError("Shouldn't get here, intervals_from_midi")
-
-    intervals = []
-    for pair in pairs:
-        this_intervals = []
-        proposed = np.array(parts[pair[0]]) - np.array(parts[pair[1]])
-        for idx, p in enumerate(proposed):
-            try:
-                this_intervals.append(intervals_map[p])
-            except:
-                if len(parts) != 2:
-                    from IPython import embed; embed(); raise ValueError()
-                    raise ValueError("Intervals from midi, 3 voice - needs fix!")
-                if parts[0][idx] == 0:
-                    # rest in part 0
-                    #print("Possible rest in part0")
-                    this_intervals.append("R" + intervals_map[0])
+    pairs = voice_pairs(len(parts))
+    parts = np.array(parts).astype("int32")
+    upper = parts[[pair[0] for pair in pairs]]
+    lower = parts[[pair[1] for pair in pairs]]
+    proposed = upper - lower
+    out_of_range = (proposed < -interval_offset) | (proposed > interval_offset)
+    # rest in either voice
+    rests = out_of_range & ((upper == 0) | (lower == 0))
+    if np.any(out_of_range & ~rests):
+        bad = np.where(out_of_range & ~rests)
+        raise ValueError("Interval {} at step {} outside known range {} to {}".format(
+                         proposed[bad][0], bad[1][0], -interval_offset, interval_offset))
+    codes = np.where(rests, rest_interval_code, np.where(out_of_range, 0, proposed) + interval_offset)
+    return codes.astype("int32")
 
-                if parts[1][idx] == 0:
-                    # rest in part 1
-                    #print("Possible rest in part1")
-                    this_intervals.append("R" + intervals_map[0])
-        intervals.append(this_intervals)
-    return intervals
 
+def intervals_from_midi(parts, durations):
+    codes = interval_codes_from_midi(parts, durations)
+    return [[interval_names[c] for c in pair_codes] for pair_codes in codes]
 
-def motion_from_midi(parts, durations):
+
+def motion_codes(dp0, dp1):
+    # motion codes between steps from the per step pitch differences of two voices
+    return np.where((dp0 == 0) | (dp1 == 0), inverse_motions_map["OBLIQUE"],
+           np.where(dp0 == dp1, inverse_motions_map["DIRECT"],
+           np.where(np.sign(dp0) != np.sign(dp1), inverse_motions_map["CONTRARY"],
+                    inverse_motions_map["SIMILAR"])))
+
+
+def motion_codes_from_midi(parts, durations):
+    # integer version of motion_from_midi, (pairs, T + 1) codes from motions_map
     if len(parts) < 2:
         raise ValueError("Need at least 2 voices to get motion")
     if len(parts) > 3:
@@ -192,78 +203,28 @@ def motion_from_midi(parts, durations):
 
     parts, durations = fixup_parts_durations(parts, durations)
 
-
-    if len(parts) == 2:
-        pairs = [(0, 1)]
-    elif len(parts) == 3:
-        # for 3 voices, follow the style of Fux (assume the 3 are STB)
-        # soprano and bass
-        # tenor and bass
-        # soprano and tenor
-        pairs = [(0, 2), (1, 2), (0, 1)]
-    else:
-        raise ValueError("Shouldn't get here, intervals_from_midi")
-
-    motions = []
-    for pair in pairs:
-        # similar, oblique, contrary, direct
-        p0 = np.array(parts[pair[0]])
-        p1 = np.array(parts[pair[1]])
-        dp0 = p0[1:] - p0[:-1]
-        dp1 = p1[1:] - p1[:-1]
-        # first motion is always start...
-        this_motions = ["START"]
-        for dip0, dip1 in zip(dp0, dp1):
-            if dip0 == 0 or dip1 == 0:
-                this_motions.append("OBLIQUE")
-            elif dip0 == dip1:
-                this_motions.append("DIRECT")
-            elif dip0 > 0 and dip1 < 0:
-                this_motions.append("CONTRARY")
-            elif dip0 < 0 and dip1 > 0:
-                this_motions.append("CONTRARY")
-            elif dip0 < 0 and dip1 < 0:
-                this_motions.append("SIMILAR")
-            elif dip0 > 0 and dip1 > 0:
-                this_motions.append("SIMILAR")
-            else:
-                raise ValueError("Should never see this case!")
-        this_motions.append("END")
-        motions.append(this_motions)
+    pairs = voice_pairs(len(parts))
+    parts = np.array(parts).astype("int32")
+    # similar, oblique, contrary, direct
+    dp = parts[:, 1:] - parts[:, :-1]
+    dp0 = dp[[pair[0] for pair in pairs]]
+    dp1 = dp[[pair[1] for pair in pairs]]
+    motions = np.zeros((len(pairs), parts.shape[1] + 1), dtype="int32")
+    # first motion is always start...
+    motions[:, 0] = inverse_motions_map["START"]
+    motions[:, -1] = inverse_motions_map["END"]
+    motions[:, 1:-1] = motion_codes(dp0, dp1)
     return motions
 
 
+def motion_from_midi(parts, durations):
+    codes = motion_codes_from_midi(parts, durations)
+    return [[motions_map[c] for c in pair_codes] for pair_codes in codes]
+
+
 def two_voice_rules_from_midi(parts, durations, key_signature):
     parts, durations = fixup_parts_durations(parts, durations)
-    full_intervals = intervals_from_midi(parts, durations)
-    full_motions = motion_from_midi(parts, durations)
-
-    assert len(full_intervals) == len(full_motions)
-    all_rulesets = []
-    i = 0
-    for fi, fm in zip(full_intervals, full_motions):
-        fimi = 0
-        this_ruleset = []
-        while i < len(fi):
-            this_interval = fi[i]
-            this_motion = fm[i]
-            this_notes = tuple([p[i] for p in parts])
-            last_interval = None
-            last_motion = None
-            last_notes = None
-            if i > 0:
-                last_interval = fi[i - 1]
-                last_notes = tuple([p[i - 1] for p in parts])
-                last_motion = fm[i - 1]
-            this_ruleset.append(make_rule(this_interval, this_motion, this_notes,
-                                          key_signature,
-                                          last_interval, last_motion, last_notes))
-            i += 1
-        all_rulesets.append(this_ruleset)
-    assert len(all_rulesets[0]) == len(full_intervals[0])
-    for ar in all_rulesets:
-        assert len(ar) == len(all_rulesets[0])
-    return all_rulesets
+    return RuleSet(parts, durations, key_signature)
 
 # previous movement, previous interval, previous notes
 rule_template = "{}:{}:{},{}->{}:{}:{},{}"
@@ -430,6 +391,31 @@ neg_nonharmonic_intervals = {"-"+str(k): None for k in nonharmonic_intervals.key
 allowed_perfect_motion = {"CONTRARY": None,
                           "OBLIQUE": None}
 
+# integer codes for motion between two timesteps
+motions_map = {0: "START",
+               1: "OBLIQUE",
+               2: "DIRECT",
+               3: "CONTRARY",
+               4: "SIMILAR",
+               5: "END"}
+
+inverse_motions_map = {v: k for k, v in motions_map.items()}
+
+# dense versions of the interval dicts, indexed by interval code
+# interval code is semitone difference + interval_offset, with one extra code for rests ("RP1")
+interval_min = min(intervals_map.keys())
+interval_max = max(intervals_map.keys())
+interval_offset = -interval_min
+rest_interval_code = max(intervals_map.keys()) + interval_offset + 1
+interval_names = [intervals_map[k] for k in sorted(intervals_map.keys())] + ["R" + intervals_map[0]]
+harmonic_table = np.array([n in harmonic_intervals or n in neg_harmonic_intervals for n in interval_names])
+perfect_table = np.array([n in perfect_intervals or n in neg_perfect_intervals for n in interval_names])
+nonharmonic_table = np.array([n in nonharmonic_intervals or n in neg_nonharmonic_intervals for n in interval_names])
+# last digit of the interval name, used for suspension resolution
+interval_degree_table = np.array([int(n[-1]) for n in interval_names])
+# indexed by motion code
+allowed_perfect_motion_table = np.array([motions_map[k] in allowed_perfect_motion for k in sorted(motions_map.keys())])
+
 def midi_to_notes(parts):
     all_parts = []
     for p in parts:
@@ -461,6 +447,75 @@ def make_rule(this_interval, this_motion, this_notes, key_signature,
     return nt
 
 
+class RuleSet(object):
+    # array backed version of the rule strings from make_rule
+    # parts holds midi pitches (voices, T)
+    # intervals holds the semitone difference for each voice pair (pairs, T)
+    # interval_codes holds codes indexing interval_names and the interval tables (pairs, T)
+    # motions holds codes from motions_map (pairs, T), first is always START
+    # the string form is only built when indexing / iterating
+    def __init__(self, parts, durations, key_signature):
+        if len(parts) not in [2, 3]:
+            raise ValueError("RuleSet only supports 2 or 3 voices, got {}".format(len(parts)))
+        pairs = voice_pairs(len(parts))
+        self.parts = np.array(parts).astype("int32")
+        self.pairs = pairs
+        self.key_signature = key_signature
+        self.n_steps = self.parts.shape[1]
+
+        self.interval_codes = interval_codes_from_midi(parts, durations)
+        self.intervals = self.parts[[pair[0] for pair in pairs]] - self.parts[[pair[1] for pair in pairs]]
+        self.motions = motion_codes_from_midi(parts, durations)[:, :-1]
+
+    def interval_code(self, pair_index, i):
+        return self.interval_codes[pair_index, i]
+
+    def interval_name(self, pair_index, i):
+        return interval_names[self.interval_codes[pair_index, i]]
+
+    def motion_name(self, pair_index, i):
+        return motions_map[self.motions[pair_index, i]]
+
+    def rule_string(self, pair_index, i):
+        # notes always come from the first two voices, same as make_rule
+        this_notes = (self.parts[0, i], self.parts[1, i])
+        if i > 0:
+            last_notes = (self.parts[0, i - 1], self.parts[1, i - 1])
+            return make_rule(self.interval_name(pair_index, i), self.motion_name(pair_index, i),
+                             this_notes, self.key_signature,
+                             self.interval_name(pair_index, i - 1), self.motion_name(pair_index, i - 1),
+                             last_notes)
+        return make_rule(self.interval_name(pair_index, i), self.motion_name(pair_index, i),
+                         this_notes, self.key_signature)
+
+    def select_pair(self, pair_index):
+        # two voice view of one pair, shares the already computed arrays
+        pair = self.pairs[pair_index]
+        sub = RuleSet.__new__(RuleSet)
+        sub.parts = self.parts[list(pair)]
+        sub.pairs = [(0, 1)]
+        sub.key_signature = self.key_signature
+        sub.n_steps = self.n_steps
+        sub.interval_codes = self.interval_codes[pair_index:pair_index + 1]
+        sub.intervals = self.intervals[pair_index:pair_index + 1]
+        sub.motions = self.motions[pair_index:pair_index + 1]
+        return sub
+
+    def to_strings(self):
+        return [self[n] for n in range(len(self))]
+
+    def __len__(self):
+        return len(self.pairs)
+
+    def __getitem__(self, pair_index):
+        pair_index = list(range(len(self.pairs)))[pair_index]
+        return [self.rule_string(pair_index, i) for i in range(self.n_steps)]
+
+    def __iter__(self):
+        for n in range(len(self)):
+            yield self[n]
+
+
 def estimate_mode(parts, durations, rules, key_signature):
     parts, durations = fixup_parts_durations(parts, durations)
     first_note = [p[0] for p in parts]
@@ -476,13 +531,13 @@ def estimate_mode(parts, durations, rules, key_signature):
     elif final_notes[-1, -1] == final_notes[0, 0]:
         mode = midi_to_notes([[final_notes[-1, -1]]])[0][0][:-1] # strip octave
         return mode
-    elif rules[0][-1].split("->")[-1].split(":")[1] in ["P8", "P1", "P15"]:
+    elif rules.interval_name(0, -1) in ["P8", "P1", "P15"]:
         mode = midi_to_notes([[final_notes[-1, -1]]])[0][0][:-1] # strip octave
         return mode
-    elif rules[0][0].split("->")[-1].split(":")[1] in ["RP1",]:
+    elif rules.interval_name(0, 0) in ["RP1",]:
         mode = midi_to_notes([[final_notes[-1, -1]]])[0][0][:-1] # strip octave
         return mode
-    elif len(rules) > 1 and rules[1][-1].split("->")[-1].split(":")[1] in ["P8", "P1", "P15"]:
+    elif len(rules) > 1 and rules.interval_name(1, -1) in ["P8", "P1", "P15"]:
         mode = midi_to_notes([[final_notes[-1, -1]]])[0][0][:-1] # strip octave
         return mode
     else:
@@ -498,98 +553,267 @@ def rsp(rule):
     return rule.split("->")
 
 
-def key_start_rule(parts, durations, key_signature, time_signature, mode, timings, ignore_voices, three_voice_relaxation=False, voice_labels=(0, 1)):
-    # ignore voices not used
-    rules = two_voice_rules_from_midi(parts, durations, key_signature)
-    rules = rules[0]
-    key = key_signature_inv_map[key_signature]
-    returns = []
-    for rule in rules:
-        last, this = rsp(rule)
-        if "K" in last:
-            tm, ti, tn = this.split(":")
-            lk, lns, lnb = last.split(",")
-            # get rid of the K in the front
-            lk = lk[1:]
-            # check that note is in key?
-            if three_voice_relaxation:
-                check = (ti == "P12" or ti == "M10" or ti == "m10" or ti == "P8" or ti == "M6" or ti == "m6" or ti == "P5" or ti == "M3" or ti == "m3" or ti == "P1" or ti == "RP1")
-            else:
-                check = (ti == "P12" or ti == "P8" or ti == "P5" or ti == "P1" or ti == "RP1")
-            if check:
-                if lnb[:-1] == mode or lnb == "R":
-                    returns.append((True, "key_start_rule: TRUE, start is in mode"))
-                else:
-                    returns.append((False, "key_start_rule: FALSE, first bass note {} doesn't match estimated mode {}".format(lnb, mode)))
-            else:
-                returns.append((False, "key_start_rule: FALSE, first interval {} is not in ['P1', 'P5', 'P8', 'P12']".format(ti)))
-        else:
-            returns.append((None, "key_start_rule: NONE, not applicable"))
-    return returns
+def rules_from_context(context, parts, durations, key_signature):
+    # rules called without an AnalysisContext compute their own RuleSet
+    if context is not None:
+        return context.rules
+    return two_voice_rules_from_midi(parts, durations, key_signature)
 
 
-def next_step_rule(parts, durations, key_signature, time_signature, mode, timings, ignore_voices, three_voice_relaxation=True, voice_labels=(0, 1)):
-    rules = two_voice_rules_from_midi(parts, durations, key_signature)
-    rules = rules[0]
-    key = key_signature_inv_map[key_signature]
+def rule_steps(rules, max_steps):
+    # rules only evaluate the first max_steps timesteps when it is set
+    if max_steps is None:
+        return rules.n_steps
+    return min(rules.n_steps, max_steps)
+
+
+def rule_results(step_fn, rules, max_steps, *args, **kwargs):
+    # whole piece results from a per timestep rule, steps returning None record nothing
     returns = []
-    for rule in rules:
-        last, this = rsp(rule)
-        tm, ti, tn = this.split(":")
-        tn0, tn1 = tn.split(",")
-        try:
-            lm, li, ln = last.split(":")
-        except ValueError:
-            returns.append((None, "next_step_rule: NONE, not applicable"))
-            continue
-        ln0, ln1 = ln.split(",")
-        dn0 = np.diff(np.array(notes_to_midi([[tn0, ln0]])[0]))
-        dn1 = np.diff(np.array(notes_to_midi([[tn1, ln1]])[0]))
-        note_sets = [[ln0, tn0], [ln1, tn1]]
-        voice_ok = None
-        msg = None
-        for n, voice_step in enumerate([dn0, dn1]):
-            try:
-                this_step = intervals_map[-int(voice_step)]
-            except KeyError:
-                if note_sets[n][0] == "R":
-                    if msg is None:
-                        msg = "next_step_rule: NONE, rest in voice"
-                    continue
-                elif -int(voice_step) < min(intervals_map.keys()) or -int(voice_step) > max(intervals_map.keys()):
-                    mink = min(intervals_map.keys())
-                    maxk = max(intervals_map.keys())
-                    msg = "next_step_rule: FALSE, voice {} stepwise movement {}->{}, jump size {} outside known range {}:{} to {}:{}".format(voice_labels[n], note_sets[n][0], note_sets[n][1], -int(voice_step), mink, intervals_map[mink],
-                       maxk, intervals_map[maxk])
-                    voice_ok = False
-                else:
-                    print("error in next step rule")
-                    print("this step {}".format(this_step))
-                    print("rule {}".format(rule))
-                    from IPython import embed; embed(); raise ValueError()
-                    raise ValueError("error in next step rule")
-                    from IPython import embed; embed(); raise ValueError()
+    for idx in range(rule_steps(rules, max_steps)):
+        r = step_fn(rules, *(args + (idx,)), **kwargs)
+        if r is not None:
+            returns.append(r)
+    return returns
 
-            if ignore_voices is not None and n in ignore_voices:
+
+# rules report (status, message) per timestep, where message is a tuple of a key into rule_messages and
+# numeric arguments, rendered to text only when asked for (render_rule_message)
+# each entry is (rule name, template, argument kinds), rule_message_renderers says how to show each kind
+rule_messages = OrderedDict()
+rule_messages["key_start_in_mode"] = ("key_start_rule", "key_start_rule: TRUE, start is in mode", ())
+rule_messages["key_start_mode_mismatch"] = ("key_start_rule", "key_start_rule: FALSE, first bass note {} doesn't match estimated mode {}", ("note", "mode"))
+rule_messages["key_start_bad_interval"] = ("key_start_rule", "key_start_rule: FALSE, first interval {} is not in ['P1', 'P5', 'P8', 'P12']", ("interval",))
+rule_messages["key_start_none"] = ("key_start_rule", "key_start_rule: NONE, not applicable", ())
+rule_messages["next_step_none"] = ("next_step_rule", "next_step_rule: NONE, not applicable", ())
+rule_messages["next_step_rest"] = ("next_step_rule", "next_step_rule: NONE, rest in voice", ())
+rule_messages["next_step_out_of_range"] = ("next_step_rule", "next_step_rule: FALSE, voice {} stepwise movement {}->{}, jump size {} outside known range " +
+                                           "{}:{} to {}:{}".format(min(intervals_map.keys()), intervals_map[min(intervals_map.keys())],
+                                                                   max(intervals_map.keys()), intervals_map[max(intervals_map.keys())]),
+                                           ("int", "note", "note", "int"))
+rule_messages["next_step_skipped"] = ("next_step_rule", "next_step_rule: NONE, skipped voice", ())
+rule_messages["next_step_a4"] = ("next_step_rule", "next_step_rule: FALSE, voice {} stepwise movement {}->{}, {} not allowed", ("int", "note", "note", "interval"))
+rule_messages["next_step_skip_ok"] = ("next_step_rule", "next_step_rule: TRUE, voice {} skip {}->{}, {} acceptable", ("int", "note", "note", "interval"))
+rule_messages["next_step_skip_too_large"] = ("next_step_rule", "next_step_rule: FALSE, voice {} stepwise skip {}->{}, {} too large", ("int", "note", "note", "interval"))
+rule_messages["next_step_valid"] = ("next_step_rule", "next_step_rule: TRUE, step move valid", ())
+rule_messages["parallel_none"] = ("parallel_rule", "parallel_rule: NONE, not applicable", ())
+rule_messages["parallel_battuta"] = ("parallel_rule", "parallel_rule: FALSE, battuta octave {}->{} disallowed on first beat", ("interval", "interval"))
+rule_messages["parallel_perfect_allowed"] = ("parallel_rule", "parallel_rule: TRUE, movement {} into perfect interval {} allowed", ("motion", "interval"))
+rule_messages["parallel_perfect_disallowed"] = ("parallel_rule", "parallel_rule: FALSE, movement {} into perfect interval {} not allowed", ("motion", "interval"))
+rule_messages["parallel_any_allowed"] = ("parallel_rule", "parallel_rule: TRUE, all movements including {} allowed into interval {}", ("motion", "interval"))
+rule_messages["beat_parallel_none"] = ("beat_parallel_rule", "beat_parallel_rule: NONE, not applicable", ())
+rule_messages["beat_parallel_no_earlier"] = ("beat_parallel_rule", "beat_parallel_rule: TRUE, no earlier parallel move", ())
+rule_messages["beat_parallel_syncopation_allowed"] = ("beat_parallel_rule", "beat_parallel_rule: TRUE, parallel perfect interval {} allowed in syncopation", ("interval",))
+rule_messages["beat_parallel_syncopation_disallowed"] = ("beat_parallel_rule", "beat_parallel_rule: FALSE, parallel perfect interval {} not allowed in syncopation", ("interval",))
+rule_messages["beat_parallel_downbeat"] = ("beat_parallel_rule", "beat_parallel_rule: FALSE, previous downbeat had parallel perfect interval {}", ("interval",))
+rule_messages["beat_parallel_ok"] = ("beat_parallel_rule", "beat_parallel_rule: TRUE, no beat parallel move", ())
+rule_messages["bar_consonance_none"] = ("bar_consonance_rule", "bar_consonance_rule: NONE, rule not applicable on beat {}", ("float",))
+rule_messages["bar_consonance_harmonic"] = ("bar_consonance_rule", "bar_consonance_rule: TRUE, harmonic interval {} allowed on downbeat", ("interval",))
+rule_messages["bar_consonance_suspension_range"] = ("bar_consonance_rule", "bar_consonance_rule: FALSE, suspension outside range", ())
+rule_messages["bar_consonance_resolves_down"] = ("bar_consonance_rule", "bar_consonance_rule: TRUE, non-consonant interval {} resolves downward to {}", ("interval", "interval"))
+rule_messages["bar_consonance_resolves_up"] = ("bar_consonance_rule", "bar_consonance_rule: TRUE, non-consonant interval {} resolves upward to {}", ("interval", "interval"))
+rule_messages["bar_consonance_unresolved"] = ("bar_consonance_rule", "bar_consonance_rule: FALSE, non-consonant interval {} not resolved, goes to {}", ("interval", "interval"))
+rule_messages["bar_consonance_dissonant"] = ("bar_consonance_rule", "bar_consonance_rule: FALSE, non-consonant interval {} disallowed on downbeat", ("interval",))
+rule_messages["passing_tone_none"] = ("passing_tone_rule", "passing_tone_rule: NONE, rule not applicable on beat {}", ("float",))
+rule_messages["passing_tone_harmonic"] = ("passing_tone_rule", "passing_tone_rule: TRUE, harmonic interval {} allowed on downbeat", ("interval",))
+rule_messages["passing_tone_ok"] = ("passing_tone_rule", "passing_tone_rule: TRUE, passing tones allowed on upbeat", ())
+rule_messages["passing_tone_bad"] = ("passing_tone_rule", "passing_tone_rule: FALSE, non-passing tones not allowed on upbeat", ())
+rule_messages["sequence_step_none"] = ("sequence_step_rule", "sequence_step_rule: NONE, not applicable at step {}", ("int",))
+rule_messages["sequence_step_harmonic"] = ("sequence_step_rule", "sequence_step_rule: TRUE, interval {} always allowed", ("interval",))
+rule_messages["sequence_step_continuation"] = ("sequence_step_rule", "sequence_step_rule: TRUE, interval {} is a continuation", ("interval",))
+rule_messages["sequence_step_termination"] = ("sequence_step_rule", "sequence_step_rule: FALSE, interval {} disallowed in termination", ("interval",))
+rule_messages["sequence_step_bar0"] = ("sequence_step_rule", "sequence_step_rule: FALSE, cannot have non-harmonic interval {} on bar part 0.", ("interval",))
+rule_messages["sequence_step_bar1_continuation"] = ("sequence_step_rule", "sequence_step_rule: TRUE, interval {} at bar part 1. allowed as part of continuation", ("interval",))
+rule_messages["sequence_step_bar1_next_dissonant"] = ("sequence_step_rule", "sequence_step_rule: FALSE, interval {} at bar part 1. not allowed, next interval not harmonic", ("interval",))
+rule_messages["sequence_step_cambiata"] = ("sequence_step_rule", "sequence_step_rule: TRUE, cambiata {}->{}->{} in voice {} detected at bar part 1. to 3.", ("note", "note", "note", "int"))
+rule_messages["sequence_step_bar1_bad"] = ("sequence_step_rule", "sequence_step_rule: FALSE, interval {} at bar part 1. not allowed, not a continuation or cambiata", ("interval",))
+rule_messages["sequence_step_bar2_continuation"] = ("sequence_step_rule", "sequence_step_rule: TRUE, interval {} at bar part 2. allowed as part of continuation", ("interval",))
+rule_messages["sequence_step_bar2_bad"] = ("sequence_step_rule", "sequence_step_rule: FALSE, interval {} at bar part 2. not allowed, next interval not harmonic or no continuation", ("interval",))
+rule_messages["sequence_step_bar3_continuation"] = ("sequence_step_rule", "sequence_step_rule: TRUE, interval {} at bar part 3. allowed as part of continuation", ("interval",))
+rule_messages["sequence_step_bar3_bad"] = ("sequence_step_rule", "sequence_step_rule: FALSE, interval {} at bar part 3. not allowed, next interval not harmonic", ("interval",))
+
+rule_message_ids = {k: n for n, k in enumerate(rule_messages.keys())}
+rule_message_max_args = 4
+
+rule_names_map = {0: "key_start_rule",
+                  1: "next_step_rule",
+                  2: "parallel_rule",
+                  3: "beat_parallel_rule",
+                  4: "bar_consonance_rule",
+                  5: "passing_tone_rule",
+                  6: "sequence_step_rule"}
+inverse_rule_names_map = {v: k for k, v in rule_names_map.items()}
+
+rule_status_map = {0: None,
+                   1: True,
+                   2: False}
+
+# estimated modes are note names without octave, "" for a rest
+mode_names = [base_note_map[k] for k in sorted(base_note_map.keys())] + [""]
+
+def mode_code(mode):
+    if mode in mode_names:
+        return mode_names.index(mode)
+    return -1
+
+rule_message_renderers = {"int": lambda a: int(a),
+                          "float": lambda a: float(a),
+                          "note": lambda a: midi_to_notes([[int(a)]])[0][0],
+                          "interval": lambda a: interval_names[int(a)],
+                          "motion": lambda a: motions_map[int(a)],
+                          "mode": lambda a: mode_names[int(a)] if a >= 0 else None}
+
+
+def render_rule_message(msg):
+    # rules outside rule_messages can still report plain strings
+    if isinstance(msg, str):
+        return msg
+    _, template, kinds = rule_messages[msg[0]]
+    return template.format(*[rule_message_renderers[k](a) for k, a in zip(kinds, msg[1:])])
+
+
+# structured per timestep rule results, one record per (pair, rule, timestep)
+# status holds rule_status_map codes, message holds rule_message_ids and args the numeric message arguments
+rule_record_dtype = [("rule", "int16"),
+                     ("pair", "int8"),
+                     ("step", "int32"),
+                     ("status", "int8"),
+                     ("message", "int16"),
+                     ("args", "float64", (rule_message_max_args,))]
+
+
+def rule_records(res, pair=0):
+    # res is the list of per rule results from a check_* function
+    n_records = sum([len(r) for r in res])
+    records = np.zeros((n_records,), dtype=rule_record_dtype)
+    rule = np.zeros((n_records,), dtype="int16")
+    step = np.zeros((n_records,), dtype="int32")
+    status = np.zeros((n_records,), dtype="int8")
+    message = np.zeros((n_records,), dtype="int16")
+    i = 0
+    for r in res:
+        for n in range(len(r)):
+            st, msg = r[n]
+            if isinstance(msg, str):
+                raise ValueError("Structured results need messages from rule_messages, got {}".format(msg))
+            rule[i] = inverse_rule_names_map[rule_messages[msg[0]][0]]
+            step[i] = n
+            status[i] = 0 if st is None else (1 if st else 2)
+            message[i] = rule_message_ids[msg[0]]
+            for j in range(1, len(msg)):
+                records["args"][i, j - 1] = msg[j]
+            i += 1
+    records["rule"] = rule
+    records["pair"] = pair
+    records["step"] = step
+    records["status"] = status
+    records["message"] = message
+    return records
+
+
+def render_rule_records(records):
+    # text for each record, same strings as the analyze_* this_ok entries
+    message_keys = list(rule_messages.keys())
+    msgs = []
+    for rec in records:
+        key = message_keys[rec["message"]]
+        n_args = len(rule_messages[key][2])
+        msgs.append(render_rule_message((key,) + tuple(rec["args"][:n_args])))
+    return msgs
+
+
+def aggregate_rule_violations(all_records, n_steps=None):
+    # all_records is one record array or a list of them (one per piece)
+    # returns violation counts per rule id (n_rules,) and per rule and timestep (n_rules, n_steps)
+    if isinstance(all_records, (list, tuple)):
+        all_records = np.concatenate(all_records)
+    failed = all_records[all_records["status"] == 2]
+    n_rules = len(rule_names_map)
+    per_rule = np.bincount(failed["rule"], minlength=n_rules)
+    if n_steps is None:
+        n_steps = all_records["step"].max() + 1 if len(all_records) > 0 else 0
+    per_step = np.bincount(failed["rule"].astype("int64") * n_steps + failed["step"],
+                           minlength=n_rules * n_steps).reshape((n_rules, n_steps))
+    return per_rule, per_step
+
+
+def key_start_rule_step(rules, key_signature, time_signature, mode, timings, ignore_voices, idx,
+                        three_voice_relaxation=False, voice_labels=(0, 1)):
+    # ignore voices not used
+    notes = rules.parts
+    if idx == 0:
+        ti = rules.interval_name(0, idx)
+        tc = rules.interval_code(0, idx)
+        # check that note is in key?
+        if three_voice_relaxation:
+            check = (ti == "P12" or ti == "M10" or ti == "m10" or ti == "P8" or ti == "M6" or ti == "m6" or ti == "P5" or ti == "M3" or ti == "m3" or ti == "P1" or ti == "RP1")
+        else:
+            check = (ti == "P12" or ti == "P8" or ti == "P5" or ti == "P1" or ti == "RP1")
+        if check:
+            lnb = midi_to_notes([[notes[1, idx]]])[0][0]
+            if lnb[:-1] == mode or lnb == "R":
+                return (True, ("key_start_in_mode",))
+            else:
+                return (False, ("key_start_mode_mismatch", notes[1, idx], mode_code(mode)))
+        else:
+            return (False, ("key_start_bad_interval", tc))
+    else:
+        return (None, ("key_start_none",))
+
+
+def key_start_rule(parts, durations, key_signature, time_signature, mode, timings, ignore_voices, three_voice_relaxation=False, voice_labels=(0, 1), context=None, max_steps=None):
+    rules = rules_from_context(context, parts, durations, key_signature)
+    return rule_results(key_start_rule_step, rules, max_steps, key_signature, time_signature, mode, timings, ignore_voices,
+                        three_voice_relaxation=three_voice_relaxation, voice_labels=voice_labels)
+
+
+def next_step_rule_step(rules, key_signature, time_signature, mode, timings, ignore_voices, idx,
+                        three_voice_relaxation=True, voice_labels=(0, 1)):
+    notes = rules.parts
+    mink = interval_min
+    maxk = interval_max
+    if idx == 0:
+        return (None, ("next_step_none",))
+    voice_ok = None
+    msg = None
+    for n in range(2):
+        voice_step = int(notes[n, idx] - notes[n, idx - 1])
+        if voice_step < mink or voice_step > maxk:
+            if notes[n, idx - 1] == 0:
+                # rest in voice
                 if msg is None:
-                    msg = "next_step_rule: NONE, skipped voice"
-                continue
-            if voice_ok is False:
+                    msg = ("next_step_rest",)
                 continue
-            if this_step in ["a4", "-a4"]:
-                msg = "next_step_rule: FALSE, voice {} stepwise movement {}->{}, {} not allowed".format(voice_labels[n], note_sets[n][0], note_sets[n][1], this_step)
-                voice_ok = False
-            elif this_step in ["P8", "-P8", "m6", "M6", "-m6", "-M6", "-M3", "-m3"]:
-                msg = "next_step_rule: TRUE, voice {} skip {}->{}, {} acceptable".format(voice_labels[n], note_sets[n][0], note_sets[n][1], this_step)
-                voice_ok = True
-            elif abs(int(voice_step)) > 7:
-                msg = "next_step_rule: FALSE, voice {} stepwise skip {}->{}, {} too large".format(voice_labels[n], note_sets[n][0], note_sets[n][1], this_step)
-                voice_ok = False
-            else:
-                msg = "next_step_rule: TRUE, step move valid"
-                voice_ok = True
-        returns.append((voice_ok, msg))
-    return returns
+            msg = ("next_step_out_of_range", voice_labels[n], notes[n, idx - 1], notes[n, idx], voice_step)
+            voice_ok = False
+        else:
+            this_step = intervals_map[voice_step]
+
+        if ignore_voices is not None and n in ignore_voices:
+            if msg is None:
+                msg = ("next_step_skipped",)
+            continue
+        if voice_ok is False:
+            continue
+        if this_step in ["a4", "-a4"]:
+            msg = ("next_step_a4", voice_labels[n], notes[n, idx - 1], notes[n, idx], voice_step + interval_offset)
+            voice_ok = False
+        elif this_step in ["P8", "-P8", "m6", "M6", "-m6", "-M6", "-M3", "-m3"]:
+            msg = ("next_step_skip_ok", voice_labels[n], notes[n, idx - 1], notes[n, idx], voice_step + interval_offset)
+            voice_ok = True
+        elif abs(voice_step) > 7:
+            msg = ("next_step_skip_too_large", voice_labels[n], notes[n, idx - 1], notes[n, idx], voice_step + interval_offset)
+            voice_ok = False
+        else:
+            msg = ("next_step_valid",)
+            voice_ok = True
+    return (voice_ok, msg)
+
+
+def next_step_rule(parts, durations, key_signature, time_signature, mode, timings, ignore_voices, three_voice_relaxation=True, voice_labels=(0, 1), context=None, max_steps=None):
+    rules = rules_from_context(context, parts, durations, key_signature)
+    return rule_results(next_step_rule_step, rules, max_steps, key_signature, time_signature, mode, timings, ignore_voices,
+                        three_voice_relaxation=three_voice_relaxation, voice_labels=voice_labels)
 
 
 def leap_rule(parts, durations, key_signature, time_signature, mode, timings, ignore_voices):
@@ -626,324 +850,460 @@ def leap_rule(parts, durations, key_signature, time_signature, mode, timings, ig
     return returns
 
 
-def parallel_rule(parts, durations, key_signature, time_signature, mode, timings, ignore_voices,
-                  three_voice_relaxation=False, voice_labels=(0, 1)):
+def parallel_rule_step(rules, key_signature, time_signature, mode, timings, ignore_voices, idx,
+                       three_voice_relaxation=False, voice_labels=(0, 1)):
     # ignore voices not used
-    rules = two_voice_rules_from_midi(parts, durations, key_signature)
-    rules = rules[0]
-    key = key_signature_inv_map[key_signature]
-    returns = []
-    for idx, rule in enumerate(rules):
-        last, this = rsp(rule)
-        tm, ti, tn = this.split(":")
-        tn0, tn1 = tn.split(",")
-        try:
-            lm, li, ln = last.split(":")
-        except ValueError:
-            returns.append((None, "parallel_rule: NONE, not applicable"))
-            continue
-        ln0, ln1 = ln.split(",")
-        dn0 = np.diff(np.array(notes_to_midi([[tn0, ln0]])[0]))
-        dn1 = np.diff(np.array(notes_to_midi([[tn1, ln1]])[0]))
-        note_sets = [[ln0, tn0], [ln1, tn1]]
-        if li == "M10" or li == "m10":
-            if not three_voice_relaxation and ti == "P8" and timings[0][idx] == 0.:
-                # battuta octave
-                returns.append((False, "parallel_rule: FALSE, battuta octave {}->{} disallowed on first beat".format(li, ti)))
-                continue
-        if ti in perfect_intervals or ti in neg_perfect_intervals:
-            if three_voice_relaxation:
-                allowed = allowed_perfect_motion
-            else:
-                allowed = allowed_perfect_motion
-            if tm in allowed:
-                returns.append((True, "parallel_rule: TRUE, movement {} into perfect interval {} allowed".format(tm, ti)))
-                continue
-            else:
-                returns.append((False, "parallel_rule: FALSE, movement {} into perfect interval {} not allowed".format(tm, ti)))
-                continue
-        elif ti in harmonic_intervals or ti in neg_harmonic_intervals or ti in nonharmonic_intervals or ti in neg_nonharmonic_intervals:
-            # allowed note check is elsewhere
-            returns.append((True, "parallel_rule: TRUE, all movements including {} allowed into interval {}".format(tm, ti)))
+    if idx == 0:
+        return (None, ("parallel_none",))
+    li = rules.interval_name(0, idx - 1)
+    lc = rules.interval_code(0, idx - 1)
+    ti = rules.interval_name(0, idx)
+    tc = rules.interval_code(0, idx)
+    tmc = rules.motions[0, idx]
+    if li == "M10" or li == "m10":
+        if not three_voice_relaxation and ti == "P8" and timings[0][idx] == 0.:
+            # battuta octave
+            return (False, ("parallel_battuta", lc, tc))
+    if perfect_table[tc]:
+        if three_voice_relaxation:
+            allowed = allowed_perfect_motion_table
         else:
-            print("parallel_rule: shouldn't get here")
-            from IPython import embed; embed(); raise ValueError()
-            raise ValueError("parallel_rule: shouldn't get here")
-    return returns
+            allowed = allowed_perfect_motion_table
+        if allowed[tmc]:
+            return (True, ("parallel_perfect_allowed", tmc, tc))
+        else:
+            return (False, ("parallel_perfect_disallowed", tmc, tc))
+    elif harmonic_table[tc] or nonharmonic_table[tc]:
+        # allowed note check is elsewhere
+        return (True, ("parallel_any_allowed", tmc, tc))
+    else:
+        print("parallel_rule: shouldn't get here")
+        from IPython import embed; embed(); raise ValueError()
+        raise ValueError("parallel_rule: shouldn't get here")
 
 
-def beat_parallel_rule(parts, durations, key_signature, time_signature, mode, timings, ignore_voices):
-    # ignore voices not used
-    rules = two_voice_rules_from_midi(parts, durations, key_signature)
-    rules = rules[0]
-    key = key_signature_inv_map[key_signature]
-    returns = []
-    for idx, rule in enumerate(rules):
-        last, this = rsp(rule)
-        tm, ti, tn = this.split(":")
-        tn0, tn1 = tn.split(",")
-        try:
-            lm, li, ln = last.split(":")
-        except ValueError:
-            returns.append((None, "beat_parallel_rule: NONE, not applicable"))
-            continue
-        ln0, ln1 = ln.split(",")
+def parallel_rule(parts, durations, key_signature, time_signature, mode, timings, ignore_voices,
+                  three_voice_relaxation=False, voice_labels=(0, 1), context=None, max_steps=None):
+    rules = rules_from_context(context, parts, durations, key_signature)
+    return rule_results(parallel_rule_step, rules, max_steps, key_signature, time_signature, mode, timings, ignore_voices,
+                        three_voice_relaxation=three_voice_relaxation, voice_labels=voice_labels)
 
-        dn0 = np.diff(np.array(notes_to_midi([[tn0, ln0]])[0]))
-        dn1 = np.diff(np.array(notes_to_midi([[tn1, ln1]])[0]))
-        note_sets = [[ln0, tn0], [ln1, tn1]]
 
-        # rP1 is rest
-        if ti in ["P8", "P5"]:
-            if idx < 2:
-                returns.append((True, "beat_parallel_rule: TRUE, no earlier parallel move"))
-                continue
-            plast, pthis = rsp(rules[idx - 2])
-            pm, pi, pn = pthis.split(":")
-            if pi in ["P8", "P5"] and pi == ti:
-                # check beats - use the 0th voice?
-                if 0. == timings[0][idx] and 0. == timings[0][idx - 2] and abs(inverse_intervals_map[li]) < 5:
-                    if pi == "P5":
-                        common_notes = {}
-                        for _n in pn.split(",") + ln.split(",") + tn.split(","):
-                            common_notes[_n] = True
-                        # 4 common notes over 3 events with 2 voices means it is syncopated
-                        if len(common_notes) == 4:
-                            returns.append((True, "beat_parallel_rule: TRUE, parallel perfect interval {} allowed in syncopation".format(pi)))
-                        else:
-                            returns.append((False, "beat_parallel_rule: FALSE, parallel perfect interval {} not allowed in syncopation".format(pi)))
+def beat_parallel_rule_step(rules, key_signature, time_signature, mode, timings, ignore_voices, idx):
+    # ignore voices not used
+    notes = rules.parts
+    if idx == 0:
+        return (None, ("beat_parallel_none",))
+    ti = rules.interval_name(0, idx)
+
+    # rP1 is rest
+    if ti in ["P8", "P5"]:
+        if idx < 2:
+            return (True, ("beat_parallel_no_earlier",))
+        pi = rules.interval_name(0, idx - 2)
+        pc = rules.interval_code(0, idx - 2)
+        if pi in ["P8", "P5"] and pi == ti:
+            # check beats - use the 0th voice?
+            if 0. == timings[0][idx] and 0. == timings[0][idx - 2] and abs(rules.intervals[0, idx - 1]) < 5:
+                if pi == "P5":
+                    common_notes = {}
+                    for _n in notes[:, idx - 2:idx + 1].ravel():
+                        common_notes[_n] = True
+                    # 4 common notes over 3 events with 2 voices means it is syncopated
+                    if len(common_notes) == 4:
+                        return (True, ("beat_parallel_syncopation_allowed", pc))
                     else:
-                        returns.append((False, "beat_parallel_rule: FALSE, previous downbeat had parallel perfect interval {}".format(pi)))
-                    continue
-            returns.append((True, "beat_parallel_rule: TRUE, no beat parallel move"))
-        else:
-            returns.append((True, "beat_parallel_rule: TRUE, no beat parallel move"))
-    return returns
+                        return (False, ("beat_parallel_syncopation_disallowed", pc))
+                else:
+                    return (False, ("beat_parallel_downbeat", pc))
+        return (True, ("beat_parallel_ok",))
+    else:
+        return (True, ("beat_parallel_ok",))
 
 
-def bar_consonance_rule(parts, durations, key_signature, time_signature, mode, timings, ignore_voices, three_voice_relaxation=True, voice_labels=(0, 1)):
+def beat_parallel_rule(parts, durations, key_signature, time_signature, mode, timings, ignore_voices, context=None, max_steps=None):
+    rules = rules_from_context(context, parts, durations, key_signature)
+    return rule_results(beat_parallel_rule_step, rules, max_steps, key_signature, time_signature, mode, timings, ignore_voices)
+
+
+def bar_consonance_rule_step(rules, key_signature, time_signature, mode, timings, ignore_voices, idx,
+                             three_voice_relaxation=True, voice_labels=(0, 1)):
     # ignore voices not used
-    rules = two_voice_rules_from_midi(parts, durations, key_signature)
-    rules = rules[0]
-    key = key_signature_inv_map[key_signature]
-    returns = []
-    assert all([len(timings[i]) == len(timings[0]) for i in range(len(timings))])
-    for idx, rule in enumerate(rules):
-        last, this = rsp(rule)
-        tm, ti, tn = this.split(":")
-        tn0, tn1 = tn.split(",")
-
-        timing_i = timings[0][idx]
-        for n in range(len(timings)):
-            assert timings[n][idx] == timing_i
-
-        if timing_i != 0.:
-            returns.append((None, "bar_consonance_rule: NONE, rule not applicable on beat {}".format(timing_i)))
-        elif timing_i == 0.:
-            if ti in harmonic_intervals or ti in neg_harmonic_intervals:
-                returns.append((True, "bar_consonance_rule: TRUE, harmonic interval {} allowed on downbeat".format(ti)))
-            else:
-                if idx < len(rules) - 1:
-                    nthis, nxt = rsp(rules[idx + 1])
-                    nm, ni, nn = nxt.split(":")
-                    if ni in harmonic_intervals or ni in neg_harmonic_intervals:
-                        if int(ni[-1]) == 0 or int(ti[-1]) == 0:
-                            returns.append((False, "bar_consonance_rule: FALSE, suspension outside range"))
-                        else:
-                            if int(ti[-1]) - int(ni[-1]) == 1:
-                                returns.append((True, "bar_consonance_rule: TRUE, non-consonant interval {} resolves downward to {}".format(ti, ni)))
-                            elif int(ti[-1]) - int(ni[-1]) == -1:
-                                returns.append((True, "bar_consonance_rule: TRUE, non-consonant interval {} resolves upward to {}".format(ti, ni)))
-                            else:
-                                returns.append((False, "bar_consonance_rule: FALSE, non-consonant interval {} not resolved, goes to {}".format(ti, ni)))
+    ti = rules.interval_name(0, idx)
+    tc = rules.interval_code(0, idx)
+
+    timing_i = timings[0][idx]
+    for n in range(len(timings)):
+        assert timings[n][idx] == timing_i
+
+    if timing_i != 0.:
+        return (None, ("bar_consonance_none", timing_i))
+    elif timing_i == 0.:
+        if harmonic_table[tc]:
+            return (True, ("bar_consonance_harmonic", tc))
+        else:
+            if idx < rules.n_steps - 1:
+                ni = rules.interval_name(0, idx + 1)
+                nc = rules.interval_code(0, idx + 1)
+                if harmonic_table[nc]:
+                    if interval_degree_table[nc] == 0 or interval_degree_table[tc] == 0:
+                        return (False, ("bar_consonance_suspension_range",))
                     else:
-                        returns.append((False, "bar_consonance_rule: FALSE, non-consonant interval {} disallowed on downbeat".format(ti)))
+                        if interval_degree_table[tc] - interval_degree_table[nc] == 1:
+                            return (True, ("bar_consonance_resolves_down", tc, nc))
+                        elif interval_degree_table[tc] - interval_degree_table[nc] == -1:
+                            return (True, ("bar_consonance_resolves_up", tc, nc))
+                        else:
+                            return (False, ("bar_consonance_unresolved", tc, nc))
                 else:
-                    returns.append((False, "bar_consonance_rule: FALSE, non-consonant interval {} disallowed on downbeat".format(ti)))
-        else:
-            raise ValueError("bar_consonance_rule: shouldn't get here")
-    return returns
+                    return (False, ("bar_consonance_dissonant", tc))
+            else:
+                return (False, ("bar_consonance_dissonant", tc))
+    else:
+        raise ValueError("bar_consonance_rule: shouldn't get here")
 
 
-def passing_tone_rule(parts, durations, key_signature, time_signature, mode, timings, ignore_voices):
-    # ignore voices not used
-    rules = two_voice_rules_from_midi(parts, durations, key_signature)
-    rules = rules[0]
-    key = key_signature_inv_map[key_signature]
-    returns = []
+def bar_consonance_rule(parts, durations, key_signature, time_signature, mode, timings, ignore_voices, three_voice_relaxation=True, voice_labels=(0, 1), context=None, max_steps=None):
+    rules = rules_from_context(context, parts, durations, key_signature)
     assert all([len(timings[i]) == len(timings[0]) for i in range(len(timings))])
-    for idx, rule in enumerate(rules):
-        last, this = rsp(rule)
-        tm, ti, tn = this.split(":")
-        tn0, tn1 = tn.split(",")
-
-        timing_i = timings[0][idx]
-        for n in range(len(timings)):
-            assert timings[n][idx] == timing_i
-
-        if timing_i == 0.:
-            returns.append((None, "passing_tone_rule: NONE, rule not applicable on beat {}".format(timing_i)))
-        elif timing_i != 0.:
-            if ti in harmonic_intervals or ti in neg_harmonic_intervals:
-                returns.append((True, "passing_tone_rule: TRUE, harmonic interval {} allowed on downbeat".format(ti)))
-            else:
-                lm, li, ln = last.split(":")
-                ln0, ln1 = ln.split(",")
-                # passing tone check
-                pitches = np.array(notes_to_midi([[ln0, ln1], [tn0, tn1]]))
-                last_diffs = np.diff(pitches, axis=0)
-
-                this, nxt = rsp(rules[idx + 1])
-                nm, ni, nn = nxt.split(":")
-                nn0, nn1 = nn.split(",")
-                pitches = np.array(notes_to_midi([[tn0, tn1], [nn0, nn1]]))
-                nxt_diffs = np.diff(pitches, axis=0)
-
-                not_skip = [n for n in range(last_diffs.shape[1]) if n not in ignore_voices]
-                last_diffs = last_diffs[:, not_skip]
-                nxt_diffs = nxt_diffs[:, not_skip]
-                last_ok = np.where(np.abs(last_diffs) >= 3)[0]
-                nxt_ok = np.where(np.abs(nxt_diffs) >= 3)[0]
-                if len(last_ok) == 0 and len(nxt_ok) == 0:
-                    returns.append((True, "passing_tone_rule: TRUE, passing tones allowed on upbeat"))
-                else:
-                    returns.append((False, "passing_tone_rule: FALSE, non-passing tones not allowed on upbeat"))
-        else:
-            raise ValueError("passing_tone_rule: shouldn't get here")
-    return returns
+    return rule_results(bar_consonance_rule_step, rules, max_steps, key_signature, time_signature, mode, timings, ignore_voices,
+                        three_voice_relaxation=three_voice_relaxation, voice_labels=voice_labels)
 
 
-def sequence_step_rule(parts, durations, key_signature, time_signature, mode, timings, ignore_voices):
-    rules = two_voice_rules_from_midi(parts, durations, key_signature)
-    rules = rules[0]
-    key = key_signature_inv_map[key_signature]
-    returns = []
-    assert all([len(timings[i]) == len(timings[0]) for i in range(len(timings))])
-    last_timing_i = 0.
-    for idx, rule in enumerate(rules):
-        last, this = rsp(rule)
-        tm, ti, tn = this.split(":")
-        tn0, tn1 = tn.split(",")
-
-        timing_i = timings[0][idx]
-        for n in range(len(timings)):
-            assert timings[n][idx] == timing_i
-
-        time_num = time_signature[0]
-        time_denom = time_signature[1]
-
-        diff_timing_i = timing_i - last_timing_i
-        # diff timing is circular
-        if timing_i == 0. and last_timing_i == 3.:
-            diff_timing_i = 1.
-        last_timing_i = timing_i
-        # force to match quarters
-        if timing_i not in [0., 1., 2., 3.]:
-            raise ValueError("sequence_step_rule: timing not recognized!")
-        if idx < 1 or abs(diff_timing_i) != 1.:
-            returns.append((None, "sequence_step_rule: NONE, not applicable at step {}".format(idx)))
-            continue
-        elif abs(diff_timing_i) == 1.:
-            lm, li, ln = last.split(":")
-            ln0, ln1 = ln.split(",")
+def passing_tone_rule_step(rules, key_signature, time_signature, mode, timings, ignore_voices, idx):
+    # ignore voices not used
+    notes = rules.parts
+    ti = rules.interval_name(0, idx)
+    tc = rules.interval_code(0, idx)
+
+    timing_i = timings[0][idx]
+    for n in range(len(timings)):
+        assert timings[n][idx] == timing_i
+
+    if timing_i == 0.:
+        return (None, ("passing_tone_none", timing_i))
+    elif timing_i != 0.:
+        if harmonic_table[tc]:
+            return (True, ("passing_tone_harmonic", tc))
+        else:
+            # passing tone check
+            last_diffs = (notes[:, idx] - notes[:, idx - 1])[None]
+            nxt_diffs = (notes[:, idx + 1] - notes[:, idx])[None]
 
-            pitches = np.array(notes_to_midi([[ln0, ln1], [tn0, tn1]]))
-            last_diffs = np.diff(pitches, axis=0)
             not_skip = [n for n in range(last_diffs.shape[1]) if n not in ignore_voices]
             last_diffs = last_diffs[:, not_skip]
-            last_ok = np.where(np.abs(last_diffs) >= 3)[0]
-
-            if idx + 1 == len(rules):
-                if ti in harmonic_intervals or ti in neg_harmonic_intervals:
-                    returns.append((True, "sequence_step_rule: TRUE, interval {} always allowed".format(ti)))
-                elif len(last_ok) == 0 and timing_i not in [0., 2.]:
-                    returns.append((True, "sequence_step_rule: TRUE, interval {} is a continuation".format(ti)))
-                else:
-                    returns.append((False, "sequence_step_rule: FALSE, interval {} disallowed in termination".format(ti)))
-                continue
-
-            this, nxt = rsp(rules[idx + 1])
-            nm, ni, nn = nxt.split(":")
-            nn0, nn1 = nn.split(",")
-            pitches = np.array(notes_to_midi([[tn0, tn1], [nn0, nn1]]))
-            nxt_diffs = np.diff(pitches, axis=0)
             nxt_diffs = nxt_diffs[:, not_skip]
+            last_ok = np.where(np.abs(last_diffs) >= 3)[0]
             nxt_ok = np.where(np.abs(nxt_diffs) >= 3)[0]
+            if len(last_ok) == 0 and len(nxt_ok) == 0:
+                return (True, ("passing_tone_ok",))
+            else:
+                return (False, ("passing_tone_bad",))
+    else:
+        raise ValueError("passing_tone_rule: shouldn't get here")
+
 
-            if ti in harmonic_intervals or ti in neg_harmonic_intervals:
-                returns.append((True, "sequence_step_rule: TRUE, interval {} always allowed".format(ti)))
+def passing_tone_rule(parts, durations, key_signature, time_signature, mode, timings, ignore_voices, context=None, max_steps=None):
+    rules = rules_from_context(context, parts, durations, key_signature)
+    assert all([len(timings[i]) == len(timings[0]) for i in range(len(timings))])
+    return rule_results(passing_tone_rule_step, rules, max_steps, key_signature, time_signature, mode, timings, ignore_voices)
+
+
+def sequence_step_rule_step(rules, key_signature, time_signature, mode, timings, ignore_voices, idx):
+    # returns None when no result is recorded for the step
+    notes = rules.parts
+    ti = rules.interval_name(0, idx)
+    tc = rules.interval_code(0, idx)
+
+    timing_i = timings[0][idx]
+    for n in range(len(timings)):
+        assert timings[n][idx] == timing_i
+
+    time_num = time_signature[0]
+    time_denom = time_signature[1]
+
+    last_timing_i = timings[0][idx - 1] if idx > 0 else 0.
+    diff_timing_i = timing_i - last_timing_i
+    # diff timing is circular
+    if timing_i == 0. and last_timing_i == 3.:
+        diff_timing_i = 1.
+    # force to match quarters
+    if timing_i not in [0., 1., 2., 3.]:
+        raise ValueError("sequence_step_rule: timing not recognized!")
+    if idx < 1 or abs(diff_timing_i) != 1.:
+        return (None, ("sequence_step_none", idx))
+    elif abs(diff_timing_i) == 1.:
+        last_diffs = (notes[:, idx] - notes[:, idx - 1])[None]
+        not_skip = [n for n in range(last_diffs.shape[1]) if n not in ignore_voices]
+        last_diffs = last_diffs[:, not_skip]
+        last_ok = np.where(np.abs(last_diffs) >= 3)[0]
+
+        if idx + 1 == rules.n_steps:
+            if harmonic_table[tc]:
+                return (True, ("sequence_step_harmonic", tc))
+            elif len(last_ok) == 0 and timing_i not in [0., 2.]:
+                return (True, ("sequence_step_continuation", tc))
             else:
-                if timing_i == 0.:
-                    returns.append((False, "sequence_step_rule: FALSE, cannot have non-harmonic interval {} on bar part 0.".format(ti)))
-                elif timing_i == 1.:
-                    if len(nxt_ok) == 0 and len(last_ok) == 0:
-                        if ni in harmonic_intervals or ni in neg_harmonic_intervals:
-                            returns.append((True, "sequence_step_rule: TRUE, interval {} at bar part 1. allowed as part of continuation".format(ti)))
-                        else:
-                            returns.append((False, "sequence_step_rule: FALSE, interval {} at bar part 1. not allowed, next interval not harmonic".format(ti)))
+                return (False, ("sequence_step_termination", tc))
+
+        ni = rules.interval_name(0, idx + 1)
+        nc = rules.interval_code(0, idx + 1)
+        nxt_diffs = (notes[:, idx + 1] - notes[:, idx])[None]
+        nxt_diffs = nxt_diffs[:, not_skip]
+        nxt_ok = np.where(np.abs(nxt_diffs) >= 3)[0]
+
+        if harmonic_table[tc]:
+            return (True, ("sequence_step_harmonic", tc))
+        else:
+            if timing_i == 0.:
+                return (False, ("sequence_step_bar0", tc))
+            elif timing_i == 1.:
+                if len(nxt_ok) == 0 and len(last_ok) == 0:
+                    if harmonic_table[nc]:
+                        return (True, ("sequence_step_bar1_continuation", tc))
                     else:
-                        nxt, nxtnxt = rsp(rules[idx + 2])
-                        nnm, nni, nnn = nxtnxt.split(":")
-                        nnn0, nnn1 = nnn.split(",")
-                        pitches = np.array(notes_to_midi([[nn0, nn1], [nnn0, nnn1]]))
-                        nxtnxt_diffs = np.diff(pitches, axis=0)
-                        nxtnxt_diffs = nxtnxt_diffs[:, not_skip]
-                        nxtnxt_ok = np.where(np.abs(nxtnxt_diffs) >= 3)[0]
-                        nxtnxt_resolves = np.where(np.sign(nxtnxt_diffs) != np.sign(nxt_diffs))[0]
-
-                        # check that it resolves in cambiata...
-                        if len(nxt_ok) == 1 and len(nxtnxt_ok) == 0 and nni in harmonic_intervals and sum(nxtnxt_resolves) == 0:
-                            if not_skip == [1]:
-                                info_tup = (tn1, nn1, nnn1)
-                            elif not_skip == [0]:
-                                info_tup = (tn0, nn0, nnn0)
-                            else:
-                                print("sequence_step_rule: other not_skip voices not yet supported...")
-                                from IPython import embed; embed(); raise ValueError()
-
-                            returns.append((True, "sequence_step_rule: TRUE, cambiata {}->{}->{} in voice {} detected at bar part 1. to 3.".format(info_tup[0], info_tup[1], info_tup[2], not_skip[0])))
-                        else:
-                            returns.append((False, "sequence_step_rule: FALSE, interval {} at bar part 1. not allowed, not a continuation or cambiata".format(ti)))
-                elif timing_i == 2.:
-                    # last and next must be harmonic, and must be continuation...
-                    if len(nxt_ok) == 0 and len(last_ok) == 0:
-                        if ni in harmonic_intervals or ni in neg_harmonic_intervals:
-                            returns.append((True, "sequence_step_rule: TRUE, interval {} at bar part 2. allowed as part of continuation".format(ti)))
-                        else:
-                            returns.append((False, "sequence_step_rule: FALSE, interval {} at bar part 2. not allowed, next interval not harmonic or no continuation".format(ti)))
-                elif timing_i == 3.:
-                    if len(nxt_ok) == 0 and len(last_ok) == 0:
-                        if ni in harmonic_intervals or ni in neg_harmonic_intervals:
-                            returns.append((True, "sequence_step_rule: TRUE, interval {} at bar part 3. allowed as part of continuation".format(ti)))
+                        return (False, ("sequence_step_bar1_next_dissonant", tc))
+                else:
+                    nni = rules.interval_name(0, idx + 2)
+                    nxtnxt_diffs = (notes[:, idx + 2] - notes[:, idx + 1])[None]
+                    nxtnxt_diffs = nxtnxt_diffs[:, not_skip]
+                    nxtnxt_ok = np.where(np.abs(nxtnxt_diffs) >= 3)[0]
+                    nxtnxt_resolves = np.where(np.sign(nxtnxt_diffs) != np.sign(nxt_diffs))[0]
+
+                    # check that it resolves in cambiata...
+                    if len(nxt_ok) == 1 and len(nxtnxt_ok) == 0 and nni in harmonic_intervals and sum(nxtnxt_resolves) == 0:
+                        if not_skip == [1] or not_skip == [0]:
+                            info_tup = notes[not_skip[0], idx:idx + 3]
                         else:
-                            returns.append((False, "sequence_step_rule: FALSE, interval {} at bar part 3. not allowed, next interval not harmonic".format(ti)))
+                            print("sequence_step_rule: other not_skip voices not yet supported...")
+                            from IPython import embed; embed(); raise ValueError()
+
+                        return (True, ("sequence_step_cambiata", info_tup[0], info_tup[1], info_tup[2], not_skip[0]))
+                    else:
+                        return (False, ("sequence_step_bar1_bad", tc))
+            elif timing_i == 2.:
+                # last and next must be harmonic, and must be continuation...
+                if len(nxt_ok) == 0 and len(last_ok) == 0:
+                    if harmonic_table[nc]:
+                        return (True, ("sequence_step_bar2_continuation", tc))
                     else:
-                        print("sequence_step_rule, timing 3. edge case")
-                        from IPython import embed; embed(); raise ValueError()
+                        return (False, ("sequence_step_bar2_bad", tc))
+                return None
+            elif timing_i == 3.:
+                if len(nxt_ok) == 0 and len(last_ok) == 0:
+                    if harmonic_table[nc]:
+                        return (True, ("sequence_step_bar3_continuation", tc))
+                    else:
+                        return (False, ("sequence_step_bar3_bad", tc))
                 else:
-                    print("sequence_step_rule: shouldn't get here")
+                    print("sequence_step_rule, timing 3. edge case")
                     from IPython import embed; embed(); raise ValueError()
+            else:
+                print("sequence_step_rule: shouldn't get here")
+                from IPython import embed; embed(); raise ValueError()
+    else:
+        print("sequence_step_rule, shouldn't get here")
+        from IPython import embed; embed(); raise ValueError()
+
+
+def sequence_step_rule(parts, durations, key_signature, time_signature, mode, timings, ignore_voices, context=None, max_steps=None):
+    rules = rules_from_context(context, parts, durations, key_signature)
+    assert all([len(timings[i]) == len(timings[0]) for i in range(len(timings))])
+    return rule_results(sequence_step_rule_step, rules, max_steps, key_signature, time_signature, mode, timings, ignore_voices)
+
+
+# opt-in per rule and per check_* instrumentation
+# rule_stats is None when disabled, which rule_step_functions and instrumented_check test once per call
+# enable with enable_rule_stats() or by setting SPECIES_RULE_STATS to "table" or a .json path before import
+rule_stats = None
+rule_stats_fields = ["calls", "time", "steps", "violations"]
+# timesteps walked by fused_rule_walk while rule stats are on, instrumented_check counts the change over
+# a call so check_* steps are timesteps of the normalized timeline, the same unit as the per rule steps
+rule_walk_steps = [0]
+
+
+def rule_stats_entry(name):
+    if name not in rule_stats:
+        rule_stats[name] = OrderedDict([(k, 0) for k in rule_stats_fields])
+        rule_stats[name]["time"] = 0.
+    return rule_stats[name]
+
+
+def enable_rule_stats(dump_at_exit=None):
+    # dump_at_exit is None, "table" (printed) or a path for a json dump
+    global rule_stats
+    if rule_stats is None:
+        rule_stats = OrderedDict()
+        if dump_at_exit is not None:
+            atexit.register(dump_rule_stats, dump_at_exit)
+    return rule_stats
+
+
+def disable_rule_stats():
+    global rule_stats
+    stats = rule_stats
+    rule_stats = None
+    return stats
+
+
+def reset_rule_stats():
+    if rule_stats is not None:
+        rule_stats.clear()
+
+
+def rule_stats_table(stats=None):
+    # one row per rule / check function, most expensive first
+    if stats is None:
+        stats = rule_stats if rule_stats is not None else {}
+    lines = ["{:<42} {:>10} {:>12} {:>12} {:>10} {:>12}".format("name", "calls", "time (s)", "steps",
+                                                               "violations", "us / step")]
+    for name in sorted(stats.keys(), key=lambda k: -stats[k]["time"]):
+        st = stats[name]
+        per_step = 1E6 * st["time"] / st["steps"] if st["steps"] > 0 else 0.
+        lines.append("{:<42} {:>10} {:>12.6f} {:>12} {:>10} {:>12.3f}".format(name, st["calls"], st["time"],
+                                                                           st["steps"], st["violations"],
+                                                                           per_step))
+    return "\n".join(lines)
+
+
+def dump_rule_stats(dump_to="table", stats=None):
+    if stats is None:
+        stats = rule_stats if rule_stats is not None else {}
+    if dump_to == "table":
+        print(rule_stats_table(stats))
+    else:
+        with open(dump_to, "w") as f:
+            json.dump(stats, f, indent=2)
+
+
+def instrumented_step_fn(name, step_fn):
+    stats = rule_stats_entry(name)
+    stats["calls"] += 1
+    def step(idx):
+        start_time = time.time()
+        r = step_fn(idx)
+        stats["time"] += time.time() - start_time
+        stats["steps"] += 1
+        if r is not None and not (r[0] is True or r[0] is None):
+            stats["violations"] += 1
+        return r
+    return step
+
+
+def instrumented_check(check_fn):
+    # check_* decorator, counts calls, time, timesteps and failed global checks
+    name = check_fn.__name__
+    @functools.wraps(check_fn)
+    def check(parts, *args, **kwargs):
+        if rule_stats is None:
+            return check_fn(parts, *args, **kwargs)
+        stats = rule_stats_entry(name)
+        start_time = time.time()
+        walked = rule_walk_steps[0]
+        r = check_fn(parts, *args, **kwargs)
+        stats["time"] += time.time() - start_time
+        stats["calls"] += 1
+        stats["steps"] += rule_walk_steps[0] - walked
+        if not r[0]:
+            stats["violations"] += 1
+        return r
+    return check
+
+
+if os.environ.get("SPECIES_RULE_STATS", "") != "":
+    enable_rule_stats(os.environ["SPECIES_RULE_STATS"])
+
+
+# per timestep versions of the rules, used by compile_rules_map to walk the piece once
+# rules without an entry here (e.g. user added rules) are run whole and read back per timestep
+rule_step_map = {key_start_rule: key_start_rule_step,
+                 next_step_rule: next_step_rule_step,
+                 parallel_rule: parallel_rule_step,
+                 beat_parallel_rule: beat_parallel_rule_step,
+                 bar_consonance_rule: bar_consonance_rule_step,
+                 passing_tone_rule: passing_tone_rule_step,
+                 sequence_step_rule: sequence_step_rule_step}
+
+
+def rule_step_functions(rules_map, parts, durations, key_signature, time_signature, mode, timings, ignore_voices,
+                        context=None, skip_rules=(), **rule_kwargs):
+    # one callable per rule in rules_map taking a timestep and returning (status, message) or None
+    rules = rules_from_context(context, parts, durations, key_signature)
+    step_fns = []
+    for arm in rules_map.keys():
+        if arm in skip_rules:
+            continue
+        rule_fn = rules_map[arm]
+        if rule_fn in rule_step_map:
+            step_fn = functools.partial(rule_step_map[rule_fn], rules, key_signature, time_signature,
+                                        mode, timings, ignore_voices, **rule_kwargs)
         else:
-            print("sequence_step_rule, shouldn't get here")
-            from IPython import embed; embed(); raise ValueError()
-    return returns
+            start_time = time.time()
+            whole = rule_fn(parts, durations, key_signature, time_signature, mode, timings, ignore_voices,
+                            context=context, **rule_kwargs)
+            if rule_stats is not None:
+                rule_stats_entry(arm)["time"] += time.time() - start_time
+            step_fn = lambda idx, whole=whole: whole[idx] if idx < len(whole) else None
+        if rule_stats is not None:
+            step_fn = instrumented_step_fn(arm, step_fn)
+        step_fns.append(step_fn)
+    return step_fns, rules.n_steps
+
+
+def fused_rule_walk(step_fns, n_steps, early_exit=False, counted=None):
+    # walk the timeline once, running every rule at each timestep and folding in the global check
+    # counted marks which step_fns feed the global check (all by default)
+    # returns (global_check, per rule results) or, with early_exit, (global_check, first failing step or -1)
+    if counted is None:
+        counted = [True] * len(step_fns)
+    res = [[] for k in range(len(step_fns))]
+    global_check = True
+    first_false = -1
+    n_walked = 0
+    for idx in range(n_steps):
+        n_walked += 1
+        for k in range(len(step_fns)):
+            r = step_fns[k](idx)
+            if r is None:
+                continue
+            res[k].append(r)
+            if counted[k] and not (r[0] is True or r[0] is None):
+                global_check = False
+                # failures are reported by result position, same as analyze_*
+                pos = len(res[k]) - 1
+                if first_false < 0 or pos < first_false:
+                    first_false = pos
+        if early_exit and first_false >= 0:
+            # stop once no counted rule can report an earlier position
+            if min([len(res[k]) for k in range(len(step_fns)) if counted[k]]) > first_false:
+                break
+    if rule_stats is not None:
+        rule_walk_steps[0] += n_walked
+    if early_exit:
+        return (global_check, first_false)
+    return (global_check, res)
+
+
+def compile_rules_map(rules_map, skip_rules=(), name=None):
+    # fused checker with the check_* signature for a species rules map, built once per map at import
+    # the map is read on every call, so rules added to it later still take part
+    # name replaces the function name, so rule stats report the check_* it is bound to
+    def fused_check(parts, durations, key_signature, time_signature, mode, timings, ignore_voices,
+                    context=None, early_exit=False, **rule_kwargs):
+        step_fns, n_steps = rule_step_functions(rules_map, parts, durations, key_signature, time_signature,
+                                                mode, timings, ignore_voices, context=context,
+                                                skip_rules=skip_rules, **rule_kwargs)
+        return fused_rule_walk(step_fns, n_steps, early_exit=early_exit)
+    if name is not None:
+        fused_check.__name__ = name
+    return fused_check
 
 two_voice_species1_minimal_rules_map = OrderedDict()
 two_voice_species1_minimal_rules_map["next_step_rule"] = next_step_rule
 two_voice_species1_minimal_rules_map["parallel_rule"] = parallel_rule
 two_voice_species1_minimal_rules_map["bar_consonance_rule"] = bar_consonance_rule
 
-def check_two_voice_species1_minimal_rule(parts, durations, key_signature, time_signature, mode, timings, ignore_voices):
-    res = [two_voice_species1_minimal_rules_map[arm](parts, durations, key_signature, time_signature, mode, timings, ignore_voices) for arm in two_voice_species1_minimal_rules_map.keys()]
-
-    global_check = True
-    for r in res:
-        rr = [True if ri[0] is True or ri[0] is None else False for ri in r]
-        if all(rr):
-            pass
-        else:
-            global_check = False
-    return (global_check, res)
+check_two_voice_species1_minimal_rule = instrumented_check(compile_rules_map(two_voice_species1_minimal_rules_map, name="check_two_voice_species1_minimal_rule"))
 
 two_voice_species1_rules_map = OrderedDict()
 two_voice_species1_rules_map["key_start_rule"] = key_start_rule
@@ -954,17 +1314,7 @@ two_voice_species1_rules_map["parallel_rule"] = parallel_rule
 # leap rule is not a rule :|
 #all_rules_map["leap_rule"] = leap_rule
 
-def check_two_voice_species1_rule(parts, durations, key_signature, time_signature, mode, timings, ignore_voices):
-    res = [two_voice_species1_rules_map[arm](parts, durations, key_signature, time_signature, mode, timings, ignore_voices) for arm in two_voice_species1_rules_map.keys()]
-
-    global_check = True
-    for r in res:
-        rr = [True if ri[0] is True or ri[0] is None else False for ri in r]
-        if all(rr):
-            pass
-        else:
-            global_check = False
-    return (global_check, res)
+check_two_voice_species1_rule = instrumented_check(compile_rules_map(two_voice_species1_rules_map, name="check_two_voice_species1_rule"))
 
 two_voice_species2_rules_map = OrderedDict()
 two_voice_species2_rules_map["key_start_rule"] = key_start_rule
@@ -973,17 +1323,7 @@ two_voice_species2_rules_map["parallel_rule"] = parallel_rule
 two_voice_species2_rules_map["beat_parallel_rule"] = beat_parallel_rule
 two_voice_species2_rules_map["next_step_rule"] = next_step_rule
 two_voice_species2_rules_map["passing_tone_rule"] = passing_tone_rule
-def check_two_voice_species2_rule(parts, durations, key_signature, time_signature, mode, timings, ignore_voices):
-    res = [two_voice_species2_rules_map[arm](parts, durations, key_signature, time_signature, mode, timings, ignore_voices) for arm in two_voice_species2_rules_map.keys()]
-
-    global_check = True
-    for r in res:
-        rr = [True if ri[0] is True or ri[0] is None else False for ri in r]
-        if all(rr):
-            pass
-        else:
-            global_check = False
-    return (global_check, res)
+check_two_voice_species2_rule = instrumented_check(compile_rules_map(two_voice_species2_rules_map, name="check_two_voice_species2_rule"))
 
 two_voice_species3_rules_map = OrderedDict()
 two_voice_species3_rules_map["key_start_rule"] = key_start_rule
@@ -992,17 +1332,7 @@ two_voice_species3_rules_map["parallel_rule"] = parallel_rule
 two_voice_species3_rules_map["beat_parallel_rule"] = beat_parallel_rule
 two_voice_species3_rules_map["next_step_rule"] = next_step_rule
 two_voice_species3_rules_map["sequence_step_rule"] = sequence_step_rule
-def check_two_voice_species3_rule(parts, durations, key_signature, time_signature, mode, timings, ignore_voices):
-    res = [two_voice_species3_rules_map[arm](parts, durations, key_signature, time_signature, mode, timings, ignore_voices) for arm in two_voice_species3_rules_map.keys()]
-
-    global_check = True
-    for r in res:
-        rr = [True if ri[0] is True or ri[0] is None else False for ri in r]
-        if all(rr):
-            pass
-        else:
-            global_check = False
-    return (global_check, res)
+check_two_voice_species3_rule = instrumented_check(compile_rules_map(two_voice_species3_rules_map, name="check_two_voice_species3_rule"))
 
 two_voice_species4_rules_map = OrderedDict()
 two_voice_species4_rules_map["key_start_rule"] = key_start_rule
@@ -1011,17 +1341,7 @@ two_voice_species4_rules_map["parallel_rule"] = parallel_rule
 two_voice_species4_rules_map["beat_parallel_rule"] = beat_parallel_rule
 two_voice_species4_rules_map["next_step_rule"] = next_step_rule
 two_voice_species4_rules_map["sequence_step_rule"] = sequence_step_rule
-def check_two_voice_species4_rule(parts, durations, key_signature, time_signature, mode, timings, ignore_voices):
-    res = [two_voice_species4_rules_map[arm](parts, durations, key_signature, time_signature, mode, timings, ignore_voices) for arm in two_voice_species4_rules_map.keys()]
-
-    global_check = True
-    for r in res:
-        rr = [True if ri[0] is True or ri[0] is None else False for ri in r]
-        if all(rr):
-            pass
-        else:
-            global_check = False
-    return (global_check, res)
+check_two_voice_species4_rule = instrumented_check(compile_rules_map(two_voice_species4_rules_map, name="check_two_voice_species4_rule"))
 
 def make_timings(durations, beats_per_measure, duration_unit):
     # use normalized_durations?
@@ -1063,8 +1383,34 @@ def estimate_timing(parts, durations, time_signature):
     return ud
 
 
+class AnalysisContext(object):
+    # per-piece analysis state, computed once and shared by every rule
+    def __init__(self, parts, durations, key_signature, time_signature):
+        parts, durations = fixup_parts_durations(parts, durations)
+        self.parts = parts
+        self.durations = durations
+        self.key_signature = key_signature
+        self.time_signature = time_signature
+        self.rules = RuleSet(parts, durations, key_signature)
+        self.mode = estimate_mode(parts, durations, self.rules, key_signature)
+        self.timings = estimate_timing(parts, durations, time_signature)
+
+    def pair_context(self, pair_index):
+        # two voice context for one of the three voice pairs
+        pair = self.rules.pairs[pair_index]
+        sub = AnalysisContext.__new__(AnalysisContext)
+        sub.parts = [self.parts[pair[0]], self.parts[pair[1]]]
+        sub.durations = [self.durations[pair[0]], self.durations[pair[1]]]
+        sub.key_signature = self.key_signature
+        sub.time_signature = self.time_signature
+        sub.rules = self.rules.select_pair(pair_index)
+        sub.mode = self.mode
+        sub.timings = [self.timings[pair[0]], self.timings[pair[1]]]
+        return sub
+
+
 def analyze_two_voices(parts, durations, key_signature_str, time_signature_str, species="species1",
-                       cantus_firmus_voices=None):
+                       cantus_firmus_voices=None, early_exit=False, structured=False):
     # not ideal but keeps stuff consistent
     key_signature = key_signature_map[key_signature_str]
     # just check that it parses here
@@ -1072,25 +1418,32 @@ def analyze_two_voices(parts, durations, key_signature_str, time_signature_str,
     beats_per_measure = time_signature[0]
     duration_unit = time_signature[1]
 
-    parts, durations = fixup_parts_durations(parts, durations)
-
-    rules = two_voice_rules_from_midi(parts, durations, key_signature)
-    mode = estimate_mode(parts, durations, rules, key_signature)
-    timings = estimate_timing(parts, durations, time_signature)
+    context = AnalysisContext(parts, durations, key_signature, time_signature)
+    parts = context.parts
+    durations = context.durations
+    rules = context.rules
+    mode = context.mode
+    timings = context.timings
 
     ignore_voices = cantus_firmus_voices
     if species == "species1_minimal":
-        r = check_two_voice_species1_minimal_rule(parts, durations, key_signature, time_signature, mode, timings, ignore_voices)
+        r = check_two_voice_species1_minimal_rule(parts, durations, key_signature, time_signature, mode, timings, ignore_voices, context=context, early_exit=early_exit)
     elif species == "species1":
-        r = check_two_voice_species1_rule(parts, durations, key_signature, time_signature, mode, timings, ignore_voices)
+        r = check_two_voice_species1_rule(parts, durations, key_signature, time_signature, mode, timings, ignore_voices, context=context, early_exit=early_exit)
     elif species == "species2":
-        r = check_two_voice_species2_rule(parts, durations, key_signature, time_signature, mode, timings, ignore_voices)
+        r = check_two_voice_species2_rule(parts, durations, key_signature, time_signature, mode, timings, ignore_voices, context=context, early_exit=early_exit)
     elif species == "species3":
-        r = check_two_voice_species3_rule(parts, durations, key_signature, time_signature, mode, timings, ignore_voices)
+        r = check_two_voice_species3_rule(parts, durations, key_signature, time_signature, mode, timings, ignore_voices, context=context, early_exit=early_exit)
     elif species == "species4":
-        r = check_two_voice_species4_rule(parts, durations, key_signature, time_signature, mode, timings, ignore_voices)
+        r = check_two_voice_species4_rule(parts, durations, key_signature, time_signature, mode, timings, ignore_voices, context=context, early_exit=early_exit)
     else:
         raise ValueError("Unknown species argument {}".format(species))
+    if early_exit:
+        # (all_ok, first failing step or -1), rules stop at the first failure
+        return r
+    if structured:
+        # (all_ok, record array of rule_record_dtype), messages via render_rule_records
+        return (r[0], rule_records(r[1]))
     all_ok = r[0]
     this_ok = []
     true_false = OrderedDict()
@@ -1098,7 +1451,7 @@ def analyze_two_voices(parts, durations, key_signature_str, time_signature_str,
     true_false["False"] = []
     for rr in r[1]:
         for n in range(len(rr)):
-            this_ok.append((n, rr[n][0], rr[n][1]))
+            this_ok.append((n, rr[n][0], render_rule_message(rr[n][1])))
             if rr[n][0] == True or rr[n][0] == None:
                 true_false["True"].append(n)
             else:
@@ -1108,6 +1461,163 @@ def analyze_two_voices(parts, durations, key_signature_str, time_signature_str,
     return (all_ok, true_false, rules, sorted(this_ok))
 
 
+def first_species_failures(upper, lower, lengths, ignored=(False, False), three_voice_relaxation=False,
+                           key_start=None, modes=None, n_pairs=1):
+    # vectorized first species (all whole notes, every step a downbeat) version of
+    # key_start_rule, next_step_rule, parallel_rule and bar_consonance_rule
+    # upper, lower are (M, T) midi for M voice pairs, rows past lengths (M,) are ignored
+    # ignored says if next_step_rule skips the upper / lower voice (cantus firmus)
+    # key_start (M,) marks the rows key_start_rule applies to, modes (M,) holds the estimate_mode names
+    # n_pairs is only used to report piece and pair for bad intervals
+    # returns (M, T) bool, True where any rule fails
+    n_rows, n_steps = upper.shape
+    steps = np.arange(n_steps)[None]
+    valid = steps < lengths[:, None]
+    mink = min(intervals_map.keys())
+    maxk = max(intervals_map.keys())
+
+    # intervals, same conventions as RuleSet
+    intervals = upper - lower
+    out_of_range = (intervals < mink) | (intervals > maxk)
+    rests = out_of_range & ((upper == 0) | (lower == 0))
+    if np.any(out_of_range & ~rests & valid):
+        bad = np.where(out_of_range & ~rests & valid)
+        raise ValueError("Interval {} at piece {} pair {} step {} outside known range {} to {}".format(
+                         intervals[bad][0], bad[0][0] // n_pairs, bad[0][0] % n_pairs, bad[1][0], mink, maxk))
+    codes = np.where(rests, rest_interval_code, np.where(out_of_range, 0, intervals) + interval_offset)
+    harmonic = harmonic_table[codes]
+    perfect = perfect_table[codes]
+    degree = interval_degree_table[codes]
+
+    failed = np.zeros((n_rows, n_steps), dtype="bool")
+
+    # next_step_rule
+    skips = [12, -12, 8, 9, -8, -9, -4, -3]
+    for n, pn in enumerate([upper, lower]):
+        step = pn[:, 1:] - pn[:, :-1]
+        step_oor = (step < mink) | (step > maxk)
+        bad = step_oor & (pn[:, :-1] != 0)
+        if not ignored[n]:
+            abs_step = np.abs(step)
+            bad |= ~step_oor & ((abs_step == 6) | ((abs_step > 7) & ~np.isin(step, skips)))
+        failed[:, 1:] |= bad
+
+    # parallel_rule
+    motions = motion_codes(upper[:, 1:] - upper[:, :-1], lower[:, 1:] - lower[:, :-1])
+    failed[:, 1:] |= perfect[:, 1:] & ~allowed_perfect_motion_table[motions]
+    if not three_voice_relaxation:
+        # battuta octave
+        failed[:, 1:] |= ((intervals[:, :-1] == 15) | (intervals[:, :-1] == 16)) & ~rests[:, :-1] & (intervals[:, 1:] == 12)
+
+    # bar_consonance_rule
+    not_last = steps < (lengths[:, None] - 1)
+    next_harmonic = np.zeros_like(harmonic)
+    next_harmonic[:, :-1] = harmonic[:, 1:]
+    next_degree = np.zeros_like(degree)
+    next_degree[:, :-1] = degree[:, 1:]
+    resolves = (next_degree != 0) & (degree != 0) & (np.abs(degree - next_degree) == 1)
+    failed |= ~harmonic & ~(not_last & next_harmonic & resolves)
+
+    # key_start_rule
+    if key_start is not None and np.any(key_start):
+        if three_voice_relaxation:
+            start_intervals = [19, 16, 15, 12, 9, 8, 7, 4, 3, 0]
+        else:
+            start_intervals = [19, 12, 7, 0]
+        start_ok = rests[:, 0] | np.isin(intervals[:, 0], start_intervals)
+        for n in np.where(key_start)[0]:
+            lnb = midi_to_notes([[lower[n, 0]]])[0][0]
+            if not start_ok[n] or not (lnb[:-1] == modes[n] or lnb == "R"):
+                failed[n, 0] = True
+
+    failed &= valid
+    return failed
+
+
+def analyze_two_voices_batch(parts, key_signature_str="C", time_signature_str="4/4", species="species1",
+                             cantus_firmus_voices=None, lengths=None):
+    # first species only (all whole notes), parts is (N, 2, T) midi
+    # lengths (N,) allows ragged batches, steps past each length are ignored
+    # returns per piece pass flags and first failing step (-1 if none),
+    # matching all_ok and true_false["False"][0] from analyze_two_voices
+    key_signature = key_signature_map[key_signature_str]
+    time_signature = time_signature_map[time_signature_str]
+    if time_signature[0] != 4 or time_signature[1] != 1:
+        raise ValueError("analyze_two_voices_batch only supports 4/4, got {}".format(time_signature_str))
+    if species == "species1_minimal":
+        use_key_start = False
+    elif species == "species1":
+        use_key_start = True
+    else:
+        raise ValueError("Unknown species argument {} for batch analysis".format(species))
+
+    parts = np.asarray(parts).astype("int32")
+    if parts.ndim != 3 or parts.shape[1] != 2:
+        raise ValueError("parts must be (N, 2, T), got shape {}".format(parts.shape))
+    n_pieces, _, n_steps = parts.shape
+    if lengths is None:
+        lengths = np.zeros((n_pieces,), dtype="int32") + n_steps
+    lengths = np.asarray(lengths).astype("int32")
+
+    ignored = [n in cantus_firmus_voices if cantus_firmus_voices is not None else False for n in range(2)]
+    key_start = np.zeros((n_pieces,), dtype="bool") + use_key_start
+    # estimate_mode always ends up on the last bass note
+    last_bass = parts[np.arange(n_pieces), 1, lengths - 1]
+    modes = [midi_to_notes([[b]])[0][0][:-1] for b in last_bass] if use_key_start else None
+    failed = first_species_failures(parts[:, 0], parts[:, 1], lengths, ignored=ignored,
+                                    key_start=key_start, modes=modes)
+    all_ok = ~np.any(failed, axis=1)
+    first_false = np.where(all_ok, -1, np.argmax(failed, axis=1))
+    return all_ok, first_false
+
+
+def analyze_three_voices_batch(parts, key_signature_str="C", time_signature_str="4/4", species="species1",
+                               cantus_firmus_voices=None, lengths=None):
+    # first species only (all whole notes), parts is (N, 3, T) midi
+    # every voice pair of every piece is checked in one vectorized pass over (N * pairs, T)
+    # returns per piece pass flags and first failing step (-1 if none), matching
+    # analyze_three_voices(..., early_exit=True)
+    # for species1 that step is the first failure of the counted (0,2) and (1,2) pairs only, true_false["False"]
+    # from the full analyze_three_voices also lists the uncounted (0,1) pair and can start earlier,
+    # (0,1) failures never fail a piece so they are not reported here (see test_three_voice_first_failure)
+    # cantus_firmus_voices is accepted for symmetry, three voice checks never skip voices
+    key_signature = key_signature_map[key_signature_str]
+    time_signature = time_signature_map[time_signature_str]
+    if time_signature[0] != 4 or time_signature[1] != 1:
+        raise ValueError("analyze_three_voices_batch only supports 4/4, got {}".format(time_signature_str))
+    pairs = voice_pairs(3)
+    if species == "species1_minimal":
+        checked_pairs = len(pairs)
+    elif species == "species1":
+        # only the top 2 voice pairs count toward the global check
+        checked_pairs = len(pairs) - 1
+    else:
+        raise ValueError("Unknown species argument {} for three voice batch analysis".format(species))
+
+    parts = np.asarray(parts).astype("int32")
+    if parts.ndim != 3 or parts.shape[1] != 3:
+        raise ValueError("parts must be (N, 3, T), got shape {}".format(parts.shape))
+    n_pieces, _, n_steps = parts.shape
+    if lengths is None:
+        lengths = np.zeros((n_pieces,), dtype="int32") + n_steps
+    lengths = np.asarray(lengths).astype("int32")
+
+    # (N, pairs, T) flattened to (N * pairs, T)
+    upper = parts[:, [pair[0] for pair in pairs]].reshape((-1, n_steps))
+    lower = parts[:, [pair[1] for pair in pairs]].reshape((-1, n_steps))
+    pair_lengths = np.repeat(lengths, len(pairs))
+    # key start only on the outer voices
+    key_start = np.tile(np.arange(len(pairs)) == 0, n_pieces)
+    last_bass = parts[np.arange(n_pieces), 2, lengths - 1]
+    modes = np.repeat([midi_to_notes([[b]])[0][0][:-1] for b in last_bass], len(pairs))
+    failed = first_species_failures(upper, lower, pair_lengths, three_voice_relaxation=True,
+                                    key_start=key_start, modes=modes, n_pairs=len(pairs))
+    failed = failed.reshape((n_pieces, len(pairs), n_steps))[:, :checked_pairs].any(axis=1)
+    all_ok = ~np.any(failed, axis=1)
+    first_false = np.where(all_ok, -1, np.argmax(failed, axis=1))
+    return all_ok, first_false
+
+
 def test_two_voice_species1():
     print("Running test for species1...")
     all_ex = fetch_two_voice_species1()
@@ -1296,72 +1806,177 @@ def test_two_voice_species4():
             print("Test passed for note sequence {}".format(fig_name))
 
 
+def test_two_voice_species1_batch():
+    print("Running batch test for species1...")
+    all_ex = fetch_two_voice_species1()
+
+    for species in ["species1", "species1_minimal"]:
+        for cf in [0, 1]:
+            this_ex = [ex for ex in all_ex if ex["cantus_firmus_voice"] == cf]
+            all_parts = []
+            for ex in this_ex:
+                nd = ex["notes_and_durations"]
+                notes = [[ndii[0] for ndii in ndi] for ndi in nd]
+                all_parts.append(notes_to_midi(notes))
+            lengths = [len(p[0]) for p in all_parts]
+            batch = np.zeros((len(all_parts), 2, max(lengths)), dtype="int32")
+            for n, p in enumerate(all_parts):
+                batch[n, :, :lengths[n]] = p
+            b_ok, b_first = analyze_two_voices_batch(batch, "C", "4/4", species=species,
+                                                     cantus_firmus_voices=[cf], lengths=lengths)
+            for n, ex in enumerate(this_ex):
+                durations = [["4"] * lengths[n]] * 2
+                aok = analyze_two_voices(all_parts[n], durations, "C", "4/4",
+                                         species=species, cantus_firmus_voices=[cf])
+                first = aok[1]["False"][0] if len(aok[1]["False"]) > 0 else -1
+                if aok[0] != b_ok[n] or first != b_first[n]:
+                    print("Test FAIL for note sequence {}, {}".format(ex["name"], species))
+                else:
+                    print("Test passed for note sequence {}, {}".format(ex["name"], species))
+
+
+def test_two_voice_early_exit():
+    print("Running early exit test for two voices...")
+    for species, fetch in [("species1", fetch_two_voice_species1),
+                           ("species1_minimal", fetch_two_voice_species1),
+                           ("species2", fetch_two_voice_species2),
+                           ("species3", fetch_two_voice_species3),
+                           ("species4", fetch_two_voice_species4)]:
+        for ex in fetch():
+            nd = ex["notes_and_durations"]
+            notes = [[ndii[0] for ndii in ndi] for ndi in nd]
+            durations = [[ndii[1] for ndii in ndi] for ndi in nd]
+            parts = notes_to_midi(notes)
+            cf = ex["cantus_firmus_voice"]
+            aok = analyze_two_voices(parts, durations, "C", "4/4",
+                                     species=species, cantus_firmus_voices=[cf])
+            first = aok[1]["False"][0] if len(aok[1]["False"]) > 0 else -1
+            e_ok, e_first = analyze_two_voices(parts, durations, "C", "4/4",
+                                               species=species, cantus_firmus_voices=[cf],
+                                               early_exit=True)
+            if aok[0] != e_ok or first != e_first:
+                print("Test FAIL for note sequence {}, {}".format(ex["name"], species))
+            else:
+                print("Test passed for note sequence {}, {}".format(ex["name"], species))
+
+
+def test_two_voice_structured():
+    print("Running structured result test for two voices...")
+    for species, fetch in [("species1", fetch_two_voice_species1),
+                           ("species2", fetch_two_voice_species2),
+                           ("species3", fetch_two_voice_species3),
+                           ("species4", fetch_two_voice_species4)]:
+        for ex in fetch():
+            nd = ex["notes_and_durations"]
+            notes = [[ndii[0] for ndii in ndi] for ndi in nd]
+            durations = [[ndii[1] for ndii in ndi] for ndi in nd]
+            parts = notes_to_midi(notes)
+            cf = ex["cantus_firmus_voice"]
+            aok = analyze_two_voices(parts, durations, "C", "4/4",
+                                     species=species, cantus_firmus_voices=[cf])
+            s_ok, records = analyze_two_voices(parts, durations, "C", "4/4",
+                                               species=species, cantus_firmus_voices=[cf],
+                                               structured=True)
+            msgs = render_rule_records(records)
+            this_ok = sorted([(r["step"], rule_status_map[r["status"]], m) for r, m in zip(records, msgs)])
+            if aok[0] != s_ok or aok[-1] != this_ok:
+                print("Test FAIL for note sequence {}, {}".format(ex["name"], species))
+            else:
+                print("Test passed for note sequence {}, {}".format(ex["name"], species))
+
+
+def test_two_voice_rule_stats():
+    print("Running rule stats test for two voices...")
+    for species, fetch, rules_map in [("species1", fetch_two_voice_species1, two_voice_species1_rules_map),
+                                      ("species2", fetch_two_voice_species2, two_voice_species2_rules_map)]:
+        check_name = "check_two_voice_{}_rule".format(species)
+        for ex in fetch():
+            nd = ex["notes_and_durations"]
+            notes = [[ndii[0] for ndii in ndi] for ndi in nd]
+            durations = [[ndii[1] for ndii in ndi] for ndi in nd]
+            parts = notes_to_midi(notes)
+            cf = ex["cantus_firmus_voice"]
+            was_enabled = rule_stats is not None
+            stats = enable_rule_stats()
+            reset_rule_stats()
+            s_ok, records = analyze_two_voices(parts, durations, "C", "4/4",
+                                               species=species, cantus_firmus_voices=[cf],
+                                               structured=True)
+            failed = records[records["status"] == 2]
+            equal = [stats[check_name]["calls"] == 1,
+                     stats[check_name]["violations"] == int(not s_ok)]
+            for name in rules_map.keys():
+                n_failed = (failed["rule"] == inverse_rule_names_map[name]).sum()
+                n_steps = (records["rule"] == inverse_rule_names_map[name]).sum()
+                equal.append(stats[name]["violations"] == n_failed)
+                equal.append(stats[name]["steps"] >= n_steps)
+                # every rule is asked about every walked timestep, so the check and rule steps agree
+                equal.append(stats[check_name]["steps"] == stats[name]["steps"])
+            # early_exit walks only part of the timeline, the check still counts what was walked
+            reset_rule_stats()
+            analyze_two_voices(parts, durations, "C", "4/4", species=species, cantus_firmus_voices=[cf],
+                               early_exit=True)
+            if not was_enabled:
+                disable_rule_stats()
+            for name in rules_map.keys():
+                equal.append(stats[check_name]["steps"] == stats[name]["steps"])
+            if not all(equal):
+                print("Test FAIL for note sequence {}, {}".format(ex["name"], species))
+            else:
+                print("Test passed for note sequence {}, {}".format(ex["name"], species))
+
 def three_voice_rules_from_midi(parts, durations, key_signature):
     parts, durations = fixup_parts_durations(parts, durations)
-    full_intervals = intervals_from_midi(parts, durations)
-    full_motions = motion_from_midi(parts, durations)
-
-    assert len(full_intervals) == len(full_motions)
-    all_rulesets = []
-    for fi, fm in zip(full_intervals, full_motions):
-        i = 0
-        fimi = 0
-        this_ruleset = []
-        while i < len(fi):
-            this_interval = fi[i]
-            this_motion = fm[i]
-            this_notes = tuple([p[i] for p in parts])
-            last_interval = None
-            last_motion = None
-            last_notes = None
-            if i > 0:
-                last_interval = fi[i - 1]
-                last_notes = tuple([p[i - 1] for p in parts])
-                last_motion = fm[i - 1]
-            this_ruleset.append(make_rule(this_interval, this_motion, this_notes,
-                                          key_signature,
-                                          last_interval, last_motion, last_notes))
-            i += 1
-        all_rulesets.append(this_ruleset)
-    assert len(all_rulesets[0]) == len(full_intervals[0])
-    for ar in all_rulesets:
-        assert len(ar) == len(all_rulesets[0])
-    return all_rulesets
+    return RuleSet(parts, durations, key_signature)
 
 three_voice_species1_minimal_rules_map = OrderedDict()
 three_voice_species1_minimal_rules_map["bar_consonance_rule"] = bar_consonance_rule
 three_voice_species1_minimal_rules_map["next_step_rule"] = next_step_rule
 three_voice_species1_minimal_rules_map["parallel_rule"] = parallel_rule
 
-def check_three_voice_species1_minimal_rule(parts, durations, key_signature, time_signature, mode, timings, ignore_voices):
-
-    pairs = [(0, 2), (1, 2), (0, 1)]
-    res = []
+def fused_three_voice_check(rules_map, n_counted_pairs, parts, durations, key_signature, time_signature, mode, timings,
+                            context=None, early_exit=False):
+    # every rule on every voice pair in one walk over the timeline
+    # only the first n_counted_pairs pairs feed the global check
+    pairs = voice_pairs(3)
+    step_fns = []
+    counted = []
+    sizes = []
     for n, pair in enumerate(pairs):
         if n > 0:
             # skip key start rule on inner voices
             skip_rules = ["key_start_rule"]
         else:
             skip_rules = []
-        res_i = [three_voice_species1_rules_map[arm]([parts[pair[0]], parts[pair[1]]],
-                    [durations[pair[0]], durations[pair[1]]], key_signature,
-                    time_signature, mode, [timings[pair[0]], timings[pair[1]]],
-                    ignore_voices=[], three_voice_relaxation=True, voice_labels=pair)
-                for arm in three_voice_species1_rules_map.keys() if arm not in skip_rules]
-        res.append(res_i)
+        if context is not None:
+            pair_context = context.pair_context(n)
+        else:
+            pair_context = None
+        fns, n_steps = rule_step_functions(rules_map, [parts[pair[0]], parts[pair[1]]],
+                                           [durations[pair[0]], durations[pair[1]]], key_signature,
+                                           time_signature, mode, [timings[pair[0]], timings[pair[1]]],
+                                           [], context=pair_context, skip_rules=skip_rules,
+                                           three_voice_relaxation=True, voice_labels=pair)
+        step_fns.extend(fns)
+        counted.extend([n < n_counted_pairs] * len(fns))
+        sizes.append(len(fns))
+    r = fused_rule_walk(step_fns, n_steps, early_exit=early_exit, counted=counted)
+    if early_exit:
+        return r
+    # regroup results per pair
+    res = []
+    start = 0
+    for size in sizes:
+        res.append(r[1][start:start + size])
+        start += size
+    return (r[0], res)
 
-    global_check = True
+
+@instrumented_check
+def check_three_voice_species1_minimal_rule(parts, durations, key_signature, time_signature, mode, timings, ignore_voices, context=None, early_exit=False):
     # better check all 3...
-    for res_i in res:
-    # only check top 2 voices
-    #for res_i in res[:-1]:
-        for r in res_i:
-            rr = [True if ri[0] is True or ri[0] is None else False for ri in r]
-            if all(rr):
-                pass
-            else:
-                global_check = False
-    return (global_check, res)
+    return fused_three_voice_check(three_voice_species1_rules_map, 3, parts, durations, key_signature, time_signature,
+                                   mode, timings, context=context, early_exit=early_exit)
 
 
 three_voice_species1_rules_map = OrderedDict()
@@ -1373,37 +1988,15 @@ three_voice_species1_rules_map["parallel_rule"] = parallel_rule
 # leap rule is not a rule :|
 #all_rules_map["leap_rule"] = leap_rule
 
-def check_three_voice_species1_rule(parts, durations, key_signature, time_signature, mode, timings, ignore_voices):
-
-    pairs = [(0, 2), (1, 2), (0, 1)]
-    res = []
-    for n, pair in enumerate(pairs):
-        if n > 0:
-            # skip key start rule on inner voices
-            skip_rules = ["key_start_rule"]
-        else:
-            skip_rules = []
-        res_i = [three_voice_species1_rules_map[arm]([parts[pair[0]], parts[pair[1]]],
-                    [durations[pair[0]], durations[pair[1]]], key_signature,
-                    time_signature, mode, [timings[pair[0]], timings[pair[1]]],
-                    ignore_voices=[], three_voice_relaxation=True, voice_labels=pair)
-                for arm in three_voice_species1_rules_map.keys() if arm not in skip_rules]
-        res.append(res_i)
-
-    global_check = True
+@instrumented_check
+def check_three_voice_species1_rule(parts, durations, key_signature, time_signature, mode, timings, ignore_voices, context=None, early_exit=False):
     # only check top 2 voices
-    for res_i in res[:-1]:
-        for r in res_i:
-            rr = [True if ri[0] is True or ri[0] is None else False for ri in r]
-            if all(rr):
-                pass
-            else:
-                global_check = False
-    return (global_check, res)
+    return fused_three_voice_check(three_voice_species1_rules_map, 2, parts, durations, key_signature, time_signature,
+                                   mode, timings, context=context, early_exit=early_exit)
 
 
 def analyze_three_voices(parts, durations, key_signature_str, time_signature_str, species="species1",
-                         cantus_firmus_voices=None):
+                         cantus_firmus_voices=None, early_exit=False, structured=False):
     # not ideal but keeps stuff consistent
     key_signature = key_signature_map[key_signature_str]
     # just check that it parses here
@@ -1411,19 +2004,28 @@ def analyze_three_voices(parts, durations, key_signature_str, time_signature_str
     beats_per_measure = time_signature[0]
     duration_unit = time_signature[1]
 
-    parts, durations = fixup_parts_durations(parts, durations)
-
-    rules = three_voice_rules_from_midi(parts, durations, key_signature)
-    mode = estimate_mode(parts, durations, rules, key_signature)
-    timings = estimate_timing(parts, durations, time_signature)
+    context = AnalysisContext(parts, durations, key_signature, time_signature)
+    parts = context.parts
+    durations = context.durations
+    rules = context.rules
+    mode = context.mode
+    timings = context.timings
 
     ignore_voices = cantus_firmus_voices
     if species == "species1_minimal":
-        r = check_three_voice_species1_minimal_rule(parts, durations, key_signature, time_signature, mode, timings, ignore_voices)
+        r = check_three_voice_species1_minimal_rule(parts, durations, key_signature, time_signature, mode, timings, ignore_voices, context=context, early_exit=early_exit)
     elif species == "species1":
-        r = check_three_voice_species1_rule(parts, durations, key_signature, time_signature, mode, timings, ignore_voices)
+        r = check_three_voice_species1_rule(parts, durations, key_signature, time_signature, mode, timings, ignore_voices, context=context, early_exit=early_exit)
     else:
         raise ValueError("Unknown species argument {}".format(species))
+    if early_exit:
+        # (all_ok, first failing step or -1), rules stop at the first failure
+        # only counted pairs give the step, so for species1 it is the first (0,2) / (1,2) failure and
+        # can be later than true_false["False"][0], which also lists the (0,1) pair
+        return r
+    if structured:
+        # (all_ok, record array of rule_record_dtype), messages via render_rule_records
+        return (r[0], np.concatenate([rule_records(res_i, pair=n) for n, res_i in enumerate(r[1])]))
     all_ok = r[0]
     true_false = OrderedDict()
     true_false["True"] = []
@@ -1434,7 +2036,7 @@ def analyze_three_voices(parts, durations, key_signature_str, time_signature_str
     for res_i in r[1]:
         for rr in res_i:
             for n in range(len(rr)):
-                this_ok.append((n, rr[n][0], rr[n][1]))
+                this_ok.append((n, rr[n][0], render_rule_message(rr[n][1])))
                 if rr[n][0] == True or rr[n][0] == None:
                     true_false["True"].append(n)
                 else:
@@ -1444,6 +2046,195 @@ def analyze_three_voices(parts, durations, key_signature_str, time_signature_str
     return (all_ok, true_false, rules, sorted(this_ok))
 
 
+class WindowLegalityTable(object):
+    # lazily filled memo of single step first species checks, keyed on the local window of notes
+    # rules at step j only see steps j - 1, j and j + 1, so the result for step j is fully
+    # determined by (window, position of j in the window)
+    # a window is a tuple of per step note tuples, all voices with the bass last
+    # mode is the estimate_mode result for the full piece (only key_start_rule uses it)
+    # max_entries bounds the memo for long runs, it is emptied once full rather than evicted entry by entry,
+    # so lookups stay plain dict reads
+    def __init__(self, n_voices=2, key_signature_str="C", time_signature_str="4/4",
+                 species="species1_minimal", cantus_firmus_voices=None, mode=None, max_entries=200000):
+        self.n_voices = n_voices
+        self.key_signature = key_signature_map[key_signature_str]
+        self.time_signature = time_signature_map[time_signature_str]
+        if n_voices == 2:
+            if species == "species1_minimal":
+                self.check_fn = check_two_voice_species1_minimal_rule
+            elif species == "species1":
+                self.check_fn = check_two_voice_species1_rule
+            else:
+                raise ValueError("Unknown species argument {} for WindowLegalityTable".format(species))
+        elif n_voices == 3:
+            if species == "species1_minimal":
+                self.check_fn = check_three_voice_species1_minimal_rule
+            else:
+                raise ValueError("Unknown species argument {} for three voice WindowLegalityTable".format(species))
+        else:
+            raise ValueError("WindowLegalityTable only supports 2 or 3 voices, got {}".format(n_voices))
+        self.ignore_voices = cantus_firmus_voices
+        self.mode = mode
+        self.max_entries = max_entries
+        # (window, pos) -> True if the step at pos fails any rule
+        self.table_ = {}
+
+    def _evaluate(self, window, pos):
+        parts = [[s[n] for s in window] for n in range(self.n_voices)]
+        durations = [["4"] * len(window) for n in range(self.n_voices)]
+        context = AnalysisContext(parts, durations, self.key_signature, self.time_signature)
+        context.mode = self.mode
+        r = self.check_fn(context.parts, context.durations, self.key_signature, self.time_signature,
+                          self.mode, context.timings, self.ignore_voices, context=context)
+        if self.n_voices == 2:
+            res = r[1]
+        else:
+            res = [rr for res_i in r[1] for rr in res_i]
+        for rr in res:
+            if not (rr[pos][0] is True or rr[pos][0] is None):
+                return True
+        return False
+
+    def step_fails(self, window, pos):
+        key = (window, pos)
+        if key not in self.table_:
+            if len(self.table_) >= self.max_entries:
+                self.table_ = {}
+            self.table_[key] = self._evaluate(window, pos)
+        return self.table_[key]
+
+    def is_legal_next(self, steps, next_step):
+        # can next_step follow steps without breaking a rule at the previous step
+        # the new step itself is only decided once its own next step is known
+        # (bar_consonance_rule allows a dissonance that resolves), same as IncrementalChecker
+        if len(steps) == 0:
+            return True
+        window = tuple(steps[-2:]) + (tuple(next_step),)
+        return not self.step_fails(window, len(window) - 2)
+
+
+# shared WindowLegalityTable per configuration, so every checker over the same settings reuses windows
+window_legality_tables = {}
+
+def get_window_legality_table(n_voices=2, key_signature_str="C", time_signature_str="4/4",
+                              species="species1_minimal", cantus_firmus_voices=None, mode=None):
+    ignore_key = tuple(cantus_firmus_voices) if cantus_firmus_voices is not None else None
+    key = (n_voices, key_signature_str, time_signature_str, species, ignore_key, mode)
+    if key not in window_legality_tables:
+        window_legality_tables[key] = WindowLegalityTable(n_voices, key_signature_str, time_signature_str,
+                                                          species, cantus_firmus_voices, mode)
+    return window_legality_tables[key]
+
+
+def clear_window_legality_tables():
+    # drop every shared table, e.g. between long runs over unrelated guides
+    # checkers created before keep the table they already hold
+    window_legality_tables.clear()
+
+
+class IncrementalChecker(object):
+    # first species checker for pieces built one timestep at a time over a fixed guide (bottom voice)
+    # matches analyzing the prefix zero padded to the guide length (upper voices == guide),
+    # as done in the mcts state managers
+    # results for every prefix seen are cached, so branching searches reuse shared prefixes
+    # step j only depends on steps j - 1, j and j + 1, so each new step re-checks a 3 step window
+    # through a shared WindowLegalityTable
+    # max_prefixes bounds the prefix cache, it is emptied once full, later prefixes rebuild it from the start
+    def __init__(self, guide, n_voices=2, key_signature_str="C", time_signature_str="4/4",
+                 species="species1_minimal", cantus_firmus_voices=None, max_prefixes=100000):
+        self.guide = [int(g) for g in guide]
+        self.n_voices = n_voices
+        # estimate_mode always uses the last bass note, and the bass is the guide
+        self.mode = midi_to_notes([[self.guide[-1]]])[0][0][:-1]
+        self.table = get_window_legality_table(n_voices, key_signature_str, time_signature_str,
+                                               species, cantus_firmus_voices, self.mode)
+        # prefix (tuple of per step note tuples) -> first failing step whose window is complete
+        self.max_prefixes = max_prefixes
+        self.closed_ = {(): None}
+
+    def _step_fails(self, j, steps):
+        # check step j using steps[j - 1], steps[j], steps[j + 1] when present
+        lo = max(0, j - 1)
+        return self.table.step_fails(tuple(steps[lo:j + 2]), j - lo)
+
+    def _closed_error(self, key):
+        # walk back to the longest cached prefix, then extend one step at a time
+        if len(self.closed_) > self.max_prefixes:
+            self.closed_ = {(): None}
+        n = len(key)
+        while key[:n] not in self.closed_:
+            n -= 1
+        err = self.closed_[key[:n]]
+        while n < len(key):
+            n += 1
+            if err is None and n >= 2:
+                steps = [s + (self.guide[i],) for i, s in enumerate(key[:n])]
+                if self._step_fails(n - 2, steps):
+                    err = n - 2
+            self.closed_[key[:n]] = err
+        return err
+
+    def first_error(self, upper_parts):
+        # upper_parts is a list of midi pitches for each non-guide voice, all the same length
+        key = tuple(zip(*[[int(p) for p in up] for up in upper_parts]))
+        length = len(key)
+        if length == 0:
+            return None
+        err = self._closed_error(key)
+        if err is not None:
+            return err
+        # the last step is checked against the padding, or as the end of the piece
+        steps = [s + (self.guide[i],) for i, s in enumerate(key)]
+        if length < len(self.guide):
+            steps.append(tuple([self.guide[length]] * self.n_voices))
+        if self._step_fails(length - 1, steps):
+            return length - 1
+        return None
+
+    def step_fails_batch(self, j, upper):
+        # _step_fails for step j over a batch of pieces sharing the guide, e.g. lock step rollouts
+        # upper is an (n_pieces, length, n_voices - 1) int array of midi pitches for the non-guide voices
+        # step j + 1 is the padding (or the end of the piece) when j is the last step, as in first_error
+        # each distinct window goes through the WindowLegalityTable once
+        upper = np.asarray(upper)
+        n_pieces, length = upper.shape[:2]
+        if n_pieces == 0:
+            return np.zeros((0,), dtype=bool)
+        lo = max(0, j - 1)
+        hi = min(j + 2, length)
+        bass = np.array(self.guide[lo:hi])
+        window = np.concatenate([upper[:, lo:hi], np.tile(bass[None, :, None], (n_pieces, 1, 1))], axis=2)
+        if hi == length and j + 1 == length and length < len(self.guide):
+            pad = np.zeros((n_pieces, 1, self.n_voices), dtype=window.dtype) + self.guide[length]
+            window = np.concatenate([window, pad], axis=1)
+        shape = window.shape[1:]
+        uniq, inverse = np.unique(window.reshape(n_pieces, -1), axis=0, return_inverse=True)
+        fails = np.array([self.table.step_fails(tuple([tuple([int(n) for n in s]) for s in u.reshape(shape)]), j - lo)
+                          for u in uniq], dtype=bool)
+        return fails[inverse]
+
+    def is_legal_next(self, upper_parts, next_notes):
+        # next_notes holds one midi pitch per non-guide voice for the step after upper_parts
+        length = len(upper_parts[0])
+        steps = [tuple([int(up[i]) for up in upper_parts]) + (self.guide[i],) for i in range(max(0, length - 2), length)]
+        return self.table.is_legal_next(steps, tuple([int(n) for n in next_notes]) + (self.guide[length],))
+
+    def status(self, upper_parts):
+        # same (winner, score, end) convention as the state managers is_finished
+        length = len(upper_parts[0])
+        first_error = self.first_error(upper_parts)
+        if length < len(self.guide):
+            if first_error is None:
+                return 0, 0., False
+            else:
+                # made a mistake
+                return 0, -1. + length / float(len(self.guide)), True
+        elif first_error is None:
+            return 1, 1., True
+        else:
+            return -1, -1., True
+
+
 def test_three_voice_species1():
     print("Running test for three voice species1...")
     all_ex = fetch_three_voice_species1()
@@ -1491,6 +2282,68 @@ def test_three_voice_species1():
             print("Test passed for note sequence {}".format(fig_name))
 
 
+def test_three_voice_species1_batch():
+    print("Running batch test for three voice species1...")
+    all_ex = fetch_three_voice_species1()
+
+    for species in ["species1", "species1_minimal"]:
+        all_parts = []
+        for ex in all_ex:
+            nd = ex["notes_and_durations"]
+            notes = [[ndii[0] for ndii in ndi] for ndi in nd]
+            all_parts.append(notes_to_midi(notes))
+        lengths = [len(p[0]) for p in all_parts]
+        batch = np.zeros((len(all_parts), 3, max(lengths)), dtype="int32")
+        for n, p in enumerate(all_parts):
+            batch[n, :, :lengths[n]] = p
+        b_ok, b_first = analyze_three_voices_batch(batch, "C", "4/4", species=species, lengths=lengths)
+        for n, ex in enumerate(all_ex):
+            durations = [["4"] * lengths[n]] * 3
+            aok = analyze_three_voices(all_parts[n], durations, "C", "4/4",
+                                       species=species, cantus_firmus_voices=[ex["cantus_firmus_voice"]],
+                                       early_exit=True)
+            if aok[0] != b_ok[n] or aok[1] != b_first[n]:
+                print("Test FAIL for note sequence {}, {}".format(ex["name"], species))
+            else:
+                print("Test passed for note sequence {}, {}".format(ex["name"], species))
+
+
+def test_three_voice_first_failure():
+    # early_exit and analyze_three_voices_batch report the first failure of the counted pairs,
+    # for species1 the (0,1) pair is in true_false["False"] but not in that step
+    print("Running first failure test for three voices...")
+    all_ex = fetch_three_voice_species1()
+    for species, n_counted_pairs in [("species1", 2), ("species1_minimal", 3)]:
+        all_parts = []
+        for ex in all_ex:
+            nd = ex["notes_and_durations"]
+            notes = [[ndii[0] for ndii in ndi] for ndi in nd]
+            all_parts.append(notes_to_midi(notes))
+        lengths = [len(p[0]) for p in all_parts]
+        batch = np.zeros((len(all_parts), 3, max(lengths)), dtype="int32")
+        for n, p in enumerate(all_parts):
+            batch[n, :, :lengths[n]] = p
+        b_ok, b_first = analyze_three_voices_batch(batch, "C", "4/4", species=species, lengths=lengths)
+        for n, ex in enumerate(all_ex):
+            durations = [["4"] * lengths[n]] * 3
+            cf = [ex["cantus_firmus_voice"]]
+            aok = analyze_three_voices(all_parts[n], durations, "C", "4/4", species=species, cantus_firmus_voices=cf)
+            e_ok, e_first = analyze_three_voices(all_parts[n], durations, "C", "4/4", species=species,
+                                                 cantus_firmus_voices=cf, early_exit=True)
+            s_ok, records = analyze_three_voices(all_parts[n], durations, "C", "4/4", species=species,
+                                                 cantus_firmus_voices=cf, structured=True)
+            failed = records[records["status"] == 2]
+            counted = failed[failed["pair"] < n_counted_pairs]
+            counted_first = int(counted["step"].min()) if len(counted) > 0 else -1
+            all_first = int(failed["step"].min()) if len(failed) > 0 else -1
+            full_first = aok[1]["False"][0] if len(aok[1]["False"]) > 0 else -1
+            if (e_first != counted_first or b_first[n] != counted_first or full_first != all_first
+                or e_ok != (counted_first < 0) or b_ok[n] != e_ok):
+                print("Test FAIL for note sequence {}, {}".format(ex["name"], species))
+            else:
+                print("Test passed for note sequence {}, {}".format(ex["name"], species))
+
+
 def test_three_voice_mcts_species1_counterexample():
     print("Running test for three voice species1...")
     all_ex = fetch_three_voice_mcts_species1_counterexample()
@@ -1538,6 +2391,77 @@ def test_three_voice_mcts_species1_counterexample():
             print("Test passed for note sequence {}".format(fig_name))
 
 
+def test_incremental_checker():
+    print("Running test for incremental checker...")
+    all_ex = [(ex, analyze_two_voices) for ex in fetch_two_voice_species1()]
+    all_ex += [(ex, analyze_three_voices) for ex in fetch_three_voice_species1()]
+
+    for ex, analyze_fn in all_ex:
+        nd = ex["notes_and_durations"]
+        notes = [[ndii[0] for ndii in ndi] for ndi in nd]
+        fig_name = ex["name"]
+        ig = [ex["cantus_firmus_voice"],]
+        parts = notes_to_midi(notes)
+        guide = parts[-1]
+        checker = IncrementalChecker(guide, n_voices=len(parts), species="species1_minimal",
+                                     cantus_firmus_voices=ig)
+        # emptied every few prefixes, must not change any answer
+        small_checker = IncrementalChecker(guide, n_voices=len(parts), species="species1_minimal",
+                                           cantus_firmus_voices=ig, max_prefixes=3)
+        equal = []
+        for length in range(1, len(guide) + 1):
+            # zero padded upper voices, as in the mcts state managers
+            padded = [p[:length] + guide[length:] for p in parts[:-1]] + [guide]
+            durations = [["4"] * len(guide)] * len(parts)
+            aok = analyze_fn(padded, durations, "C", "4/4",
+                             species="species1_minimal", cantus_firmus_voices=ig)
+            first_error = aok[1]["False"][0] if len(aok[1]["False"]) > 0 else np.inf
+            if length < len(guide):
+                if first_error > (length - 1):
+                    expected = (0, 0., False)
+                else:
+                    expected = (0, -1. + length / float(len(guide)), True)
+            elif aok[0]:
+                expected = (1, 1., True)
+            else:
+                expected = (-1, -1., True)
+            equal.append(checker.status([p[:length] for p in parts[:-1]]) == expected)
+            equal.append(small_checker.status([p[:length] for p in parts[:-1]]) == expected)
+        if not all(equal):
+            print("Test FAIL for note sequence {}".format(fig_name))
+        else:
+            print("Test passed for note sequence {}".format(fig_name))
+
+
+def test_incremental_checker_batch():
+    print("Running test for incremental checker batch...")
+    all_ex = fetch_two_voice_species1() + fetch_three_voice_species1()
+
+    for ex in all_ex:
+        nd = ex["notes_and_durations"]
+        notes = [[ndii[0] for ndii in ndi] for ndi in nd]
+        fig_name = ex["name"]
+        parts = notes_to_midi(notes)
+        guide = parts[-1]
+        checker = IncrementalChecker(guide, n_voices=len(parts), species="species1_minimal",
+                                     cantus_firmus_voices=[ex["cantus_firmus_voice"],])
+        equal = []
+        for length in range(1, len(guide) + 1):
+            # the piece and copies with the newest upper notes moved, as in lock step rollouts
+            upper = np.array([[p[:length] for p in parts[:-1]]] * 5).transpose(0, 2, 1)
+            upper[:, -1] -= np.arange(5)[:, None]
+            for j in range(max(0, length - 2), length):
+                batch = checker.step_fails_batch(j, upper)
+                for n in range(len(upper)):
+                    steps = [tuple(upper[n, i]) + (guide[i],) for i in range(length)]
+                    if length < len(guide):
+                        steps.append(tuple([guide[length]] * len(parts)))
+                    equal.append(batch[n] == checker._step_fails(j, steps))
+        if not all(equal):
+            print("Test FAIL for note sequence {}".format(fig_name))
+        else:
+            print("Test passed for note sequence {}".format(fig_name))
+
 
 if __name__ == "__main__":
     import argparse
@@ -1551,11 +2475,19 @@ if __name__ == "__main__":
 
 
     #test_two_voice_species1()
+    #test_two_voice_species1_batch()
+    #test_two_voice_early_exit()
+    #test_two_voice_structured()
+    #test_two_voice_rule_stats()
     #test_two_voice_species2()
     #test_two_voice_species3()
     #test_two_voice_species4()
     #test_three_voice_species1()
+    #test_three_voice_species1_batch()
+    #test_three_voice_first_failure()
     test_three_voice_mcts_species1_counterexample()
+    #test_incremental_checker()
+    #test_incremental_checker_batch()
 
     """
     # fig 5, gradus ad parnassum
@@ -0,0 +1,223 @@
+# Author: Kyle Kastner
+# License: BSD 3-Clause
+# microbenchmarks for the analysis entry points and rules
+# dataset examples from fetch_two_voice_species1..4 / fetch_three_voice_species1,
+# plus synthetic pieces tiled from the first example of each set to 8 - 256 cantus firmus notes
+# example:
+# python analysis_benchmark.py --save_baseline analysis_baseline.json
+# python analysis_benchmark.py --baseline analysis_baseline.json --threshold .2
+from __future__ import print_function
+import sys
+import json
+import time
+import math
+
+import analysis
+from analysis import analyze_two_voices
+from analysis import analyze_three_voices
+from analysis import normalize_parts_with_durations
+from analysis import two_voice_rules_from_midi
+from analysis import notes_to_midi
+from analysis import durations_map
+from analysis import inverse_durations_map
+from analysis import fracf
+from datasets import fetch_two_voice_species1
+from datasets import fetch_two_voice_species2
+from datasets import fetch_two_voice_species3
+from datasets import fetch_two_voice_species4
+from datasets import fetch_three_voice_species1
+
+benchmark_lengths = [8, 16, 32, 64, 128, 256]
+
+benchmark_sets = [("two_voice_species1", "species1", fetch_two_voice_species1),
+                  ("two_voice_species2", "species2", fetch_two_voice_species2),
+                  ("two_voice_species3", "species3", fetch_two_voice_species3),
+                  ("two_voice_species4", "species4", fetch_two_voice_species4),
+                  ("three_voice_species1", "species1", fetch_three_voice_species1)]
+
+
+def example_to_piece(ex):
+    nd = ex["notes_and_durations"]
+    notes = [[ndii[0] for ndii in ndi] for ndi in nd]
+    durations = [[ndii[1] for ndii in ndi] for ndi in nd]
+    return {"parts": notes_to_midi(notes),
+            "durations": durations,
+            "cantus_firmus_voices": [ex["cantus_firmus_voice"],]}
+
+
+def tile_piece(piece, length):
+    # repeat the piece until the cantus firmus has length notes, then cut every voice at the same time
+    cf = piece["cantus_firmus_voices"][0]
+    cf_durations = [durations_map[d] for d in piece["durations"][cf]]
+    n_repeats = int(math.ceil(length / float(len(cf_durations))))
+    end_time = sum((cf_durations * n_repeats)[:length])
+    parts = []
+    durations = []
+    for p, d in zip(piece["parts"], piece["durations"]):
+        tiled_p = []
+        tiled_d = []
+        t = 0.
+        for pi, di in zip(p * n_repeats, d * n_repeats):
+            if t >= end_time:
+                break
+            remaining = end_time - t
+            if durations_map[di] > remaining:
+                # the cut lands inside this note, shorten it
+                di = inverse_durations_map[fracf(remaining)]
+            tiled_p.append(pi)
+            tiled_d.append(di)
+            t += durations_map[di]
+        parts.append(tiled_p)
+        durations.append(tiled_d)
+    return {"parts": parts,
+            "durations": durations,
+            "cantus_firmus_voices": piece["cantus_firmus_voices"]}
+
+
+def benchmark_groups(lengths=benchmark_lengths):
+    # (set name, species, group name, pieces)
+    groups = []
+    for set_name, species, fetch in benchmark_sets:
+        pieces = [example_to_piece(ex) for ex in fetch()]
+        groups.append((set_name, species, "dataset", pieces))
+        for length in lengths:
+            groups.append((set_name, species, "L{}".format(length), [tile_piece(pieces[0], length)]))
+    return groups
+
+
+def count_notes(pieces):
+    return sum([len(p) for piece in pieces for p in piece["parts"]])
+
+
+def analyze_fn(set_name, species, **kwargs):
+    if set_name.startswith("two_voice"):
+        analyze = analyze_two_voices
+    else:
+        analyze = analyze_three_voices
+    def run(pieces):
+        for piece in pieces:
+            analyze(piece["parts"], piece["durations"], "C", "4/4", species=species,
+                    cantus_firmus_voices=piece["cantus_firmus_voices"], **kwargs)
+    return analyze.__name__, run
+
+
+def normalize_fn(pieces):
+    for piece in pieces:
+        normalize_parts_with_durations(piece["parts"], piece["durations"])
+
+
+def rules_from_midi_fn(pieces):
+    for piece in pieces:
+        two_voice_rules_from_midi(piece["parts"], piece["durations"], analysis.key_signature_map["C"])
+
+
+def time_op(fn, arg, min_time=.2, n_rounds=3):
+    # best ops/sec over n_rounds, each round repeats fn(arg) for at least min_time seconds
+    best = 0.
+    for r in range(n_rounds):
+        n_ops = 0
+        start_time = time.time()
+        while True:
+            fn(arg)
+            n_ops += 1
+            elapsed = time.time() - start_time
+            if elapsed >= min_time:
+                break
+        best = max(best, n_ops / elapsed)
+    return best
+
+
+def run_benchmarks(lengths=benchmark_lengths, min_time=.2, n_rounds=3, verbose=True):
+    # returns OrderedDict name -> {"ops_per_sec", "per_note", "notes"}
+    # per_note is seconds per note, summed over all voices of all pieces in one op
+    results = analysis.OrderedDict()
+    def record(name, ops_per_sec, n_notes):
+        results[name] = {"ops_per_sec": ops_per_sec,
+                         "per_note": 1. / (ops_per_sec * n_notes) if ops_per_sec > 0 else 0.,
+                         "notes": n_notes}
+        if verbose:
+            print("{:<60} {:>12.2f} ops/sec {:>10.3f} us/note".format(name, ops_per_sec,
+                                                                     1E6 * results[name]["per_note"]))
+
+    # entry points are timed with rule stats disabled, rules get a separate instrumented pass
+    stats_state = analysis.disable_rule_stats()
+    try:
+        groups = benchmark_groups(lengths)
+        for set_name, species, group, pieces in groups:
+            n_notes = count_notes(pieces)
+            fns = [analyze_fn(set_name, species),
+                   (None, analyze_fn(set_name, species, early_exit=True)[1])]
+            fns[1] = (fns[0][0] + "_early_exit", fns[1][1])
+            if set_name.startswith("two_voice"):
+                if species != "species1":
+                    # first species parts are already aligned, normalizing is a no-op there
+                    fns.append(("normalize_parts_with_durations", normalize_fn))
+                fns.append(("two_voice_rules_from_midi", rules_from_midi_fn))
+            for fn_name, fn in fns:
+                ops_per_sec = time_op(fn, pieces, min_time=min_time, n_rounds=n_rounds)
+                record("{}/{}/{}".format(fn_name, set_name, group), ops_per_sec, n_notes)
+
+            # per rule timing, one op is one rule timestep
+            stats = analysis.enable_rule_stats()
+            analysis.reset_rule_stats()
+            analyze_fn(set_name, species)[1](pieces)
+            analysis.disable_rule_stats()
+            for name in stats.keys():
+                if name.startswith("check_") or stats[name]["time"] <= 0:
+                    continue
+                record("rule/{}/{}/{}".format(name, set_name, group),
+                       stats[name]["steps"] / stats[name]["time"], 1)
+    finally:
+        if stats_state is not None:
+            analysis.rule_stats = stats_state
+    return results
+
+
+def compare_to_baseline(results, baseline, threshold=.2, verbose=True):
+    # a benchmark regresses when its per note cost grows by more than threshold (fractional)
+    regressions = []
+    for name in results.keys():
+        if name not in baseline:
+            continue
+        old = baseline[name]["per_note"]
+        new = results[name]["per_note"]
+        if old <= 0:
+            continue
+        change = (new - old) / old
+        if change > threshold:
+            regressions.append((name, old, new, change))
+    if verbose:
+        missing = [k for k in baseline.keys() if k not in results]
+        print("Compared {} benchmarks against baseline, {} missing, {} regressed more than {:.1f}%".format(
+              len([k for k in results.keys() if k in baseline]), len(missing), len(regressions), 100 * threshold))
+        for name, old, new, change in sorted(regressions, key=lambda x: -x[3]):
+            print("REGRESSION {:<60} {:>10.3f} -> {:>10.3f} us/note ({:+.1f}%)".format(name, 1E6 * old, 1E6 * new,
+                                                                                      100 * change))
+    return regressions
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark the analysis entry points and rules")
+    parser.add_argument("--lengths", type=int, nargs="*", default=benchmark_lengths,
+                        help="synthetic piece lengths, in cantus firmus notes")
+    parser.add_argument("--min_time", type=float, default=.2, help="minimum seconds per timing round")
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--save_baseline", default=None, help="write results as a json baseline")
+    parser.add_argument("--baseline", default=None, help="json baseline to compare against")
+    parser.add_argument("--threshold", type=float, default=.2,
+                        help="fractional per note slowdown counted as a regression")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.lengths, min_time=args.min_time, n_rounds=args.rounds)
+    if args.save_baseline is not None:
+        with open(args.save_baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print("Wrote baseline of {} benchmarks to {}".format(len(results), args.save_baseline))
+    if args.baseline is not None:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        regressions = compare_to_baseline(results, baseline, threshold=args.threshold)
+        if len(regressions) > 0:
+            sys.exit(1)
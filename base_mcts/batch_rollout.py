@@ -0,0 +1 @@
+../batch_rollout.py
\ No newline at end of file
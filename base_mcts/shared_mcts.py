@@ -1,5 +1,9 @@
 import numpy as np
 import copy
+import heapq
+import sys
+import time
+from batch_rollout import BatchRollout
 
 def softmax(x):
     assert len(x.shape) == 1
@@ -8,7 +12,29 @@ def softmax(x):
     return probs
 
 
+def uct_scores(W, n_visits, parent_visits, c_uct):
+    # TreeNode.get_value for every child in one expression, unvisited children get np.inf
+    # same operation order as the scalar version, so the scores (and argmax ties) match exactly
+    with np.errstate(divide="ignore", invalid="ignore"):
+        scores = W / n_visits + c_uct * np.sqrt(2 * np.log(parent_visits) / n_visits)
+    scores[n_visits == 0] = np.inf
+    return scores
+
+
 class TreeNode(object):
+    # set on nodes whose unchosen children were dropped by MCTS.release_siblings
+    # class level default, so ordinary nodes pay nothing for it
+    released_ = False
+    # MCTS-Solver status, 1 proven win, -1 proven loss, 0 unknown, set only when MCTS solver is on
+    # proven_value_ is the exact value backed up in place of a rollout
+    proven_ = 0
+    proven_value_ = None
+    # action -> (proven_, proven_value_, proven_children_) of children dropped by MCTS.prune_tree or
+    # MCTS.release_siblings, handed back to the new children when the node is expanded again
+    proven_children_ = None
+    # parents holding this node in their children_, above 1 only for nodes shared through a transposition table
+    n_parents_ = 1
+
     def __init__(self, parent):
         self.parent = parent
         self.W_ = 0
@@ -20,9 +46,18 @@ class TreeNode(object):
         for action, prob in actions_and_probs:
             if action not in self.children_:
                 self.children_[action] = TreeNode(self)
+        if self.released_:
+            self.released_ = False
+        if self.proven_children_ is not None:
+            for action, proof in self.proven_children_.items():
+                if action in self.children_:
+                    child = self.children_[action]
+                    child.proven_, child.proven_value_, child.proven_children_ = proof
+            self.proven_children_ = None
 
     def is_leaf(self):
-        return self.children_ == {}
+        # a released node still holds the child on the reconstruction path, but is expanded again like a leaf
+        return self.children_ == {} or self.released_
 
     def is_root(self):
         return self.parent is None
@@ -32,10 +67,12 @@ class TreeNode(object):
         self.W_ += value
 
     def update(self, value):
-        if self.parent != None:
-            # negative in the original code due to being the opposing player
-            self.parent.update(value)
-        self._update(value)
+        # this node and every ancestor, walked iteratively (no recursion limit on deep trees)
+        # negative in the original code due to being the opposing player
+        node = self
+        while node is not None:
+            node._update(value)
+            node = node.parent
 
     def get_value(self, c_uct):
         if self.n_visits_ == 0:
@@ -49,13 +86,62 @@ class TreeNode(object):
             rp = c_uct * np.sqrt(2 * np.log(self.parent.n_visits_) / float(self.n_visits_))
         return lp + rp
 
-    def get_best(self, c_uct):
-        best = max(self.children_.iteritems(), key=lambda x: x[1].get_value(c_uct))
+    def get_best(self, c_uct, skip_lost=False):
+        # first child with the highest value, in children_ order like max()
+        # skip_lost passes over proven lost children, unless every child is lost
+        children = list(self.children_.items())
+        W = np.array([c.W_ for a, c in children], dtype="float64")
+        n_visits = np.array([c.n_visits_ for a, c in children], dtype="float64")
+        scores = uct_scores(W, n_visits, self.n_visits_, c_uct)
+        if skip_lost:
+            lost = np.array([c.proven_ == -1 for a, c in children])
+            if not lost.all():
+                scores[lost] = -np.inf
+        best = children[np.argmax(scores)]
         return best
 
 
+class SearchBudget(object):
+    # whole piece budget (seconds and / or playouts), split evenly over the moves still to play
+    # time and playouts left over by early stops and forced moves carry over to later moves
+    # budget = SearchBudget(total_time=30.)
+    # a, ap = mcts.get_action(state, **budget.next_move(len(guide) - len(state[0])))
+    # budget.charge(mcts.last_search_)
+    def __init__(self, total_time=None, total_playouts=None):
+        self.total_time = total_time
+        self.total_playouts = total_playouts
+        self.used_time = 0.
+        self.used_playouts = 0
+
+    def remaining_time(self):
+        if self.total_time is None:
+            return None
+        return max(0., self.total_time - self.used_time)
+
+    def remaining_playouts(self):
+        if self.total_playouts is None:
+            return None
+        return max(0, self.total_playouts - self.used_playouts)
+
+    def next_move(self, moves_left):
+        # keyword arguments for get_action / sample_action / get_action_probs
+        moves_left = max(1, moves_left)
+        budget = {}
+        if self.total_playouts is not None:
+            budget["n_playout"] = max(1, self.remaining_playouts() // moves_left)
+        if self.total_time is not None:
+            budget["time_budget"] = self.remaining_time() / float(moves_left)
+        return budget
+
+    def charge(self, search_stats):
+        self.used_time += search_stats["time"]
+        self.used_playouts += search_stats["playouts"]
+
+
 class MCTS(object):
-    def __init__(self, state_manager, c_uct=1.4, n_playout=1000, random_state=None):
+    def __init__(self, state_manager, c_uct=1.4, n_playout=1000, random_state=None,
+                 transposition_table=None, max_nodes=None, release_subtrees=None, n_rollouts=1,
+                 time_budget=None, early_stop=False, solver=False):
         if random_state is None:
             raise ValueError("Must pass random_state object")
         self.random_state = random_state
@@ -67,15 +153,74 @@ class MCTS(object):
         self.n_playout = n_playout
         self.tree_subs_ = []
         self.warn_at_ = 10000
+        # optional TranspositionTable, shares nodes between paths reaching the same state
+        # states are keyed by state_manager.hash_state, a summary of what their future depends on
+        if transposition_table is not None and not hasattr(state_manager, "hash_state"):
+            raise ValueError("transposition_table needs a state_manager with a hash_state method")
+        self.transpositions = transposition_table
+        # memory bounded mode, for long runs over many guides in one process
+        # release_subtrees drops the unchosen siblings at every root advance (see release_siblings),
+        # so only the O(depth) path for reconstruct_tree is kept above the root
+        # max_nodes is a global node budget, enforced by prune_tree after each playout
+        # release_subtrees defaults to on whenever max_nodes is set
+        self.max_nodes = max_nodes
+        if release_subtrees is None:
+            release_subtrees = max_nodes is not None
+        self.release_subtrees = release_subtrees
+        # prune_tree goes down to this fraction of max_nodes, so it does not run on every playout
+        self.prune_fraction = .8
+        # nodes reachable from the top of the tree, including the path above the root
+        self.n_nodes_ = 1
+        # n_rollouts > 1 backs up the mean of a vectorized batch of rollouts from each leaf
+        self.n_rollouts = n_rollouts
+        self.batch_rollout = BatchRollout(state_manager) if n_rollouts > 1 else None
+        # anytime mode, on when either is set (see search)
+        # time_budget is wall clock seconds per move, early_stop ends a move once the leader is safe
+        self.time_budget = time_budget
+        self.early_stop = early_stop
+        # accounting for the latest move and summed over all moves
+        self.last_search_ = None
+        self.budget_used_ = {"moves": 0, "playouts": 0, "time": 0., "stops": {}}
+        # MCTS-Solver, terminal leaves become proven wins / losses and proofs propagate up the tree
+        # proven nodes back up their exact value instead of being checked and rolled out again,
+        # selection skips proven lost children and the subtrees of proven lost nodes are freed
+        self.solver = solver
+        # playouts that ended on a proven node
+        self.proven_hits_ = 0
 
     def playout(self, state):
         node = self.root
+        # selection path from the root to the leaf, the value is backed up along it
+        path = [node]
+        tt = self.transpositions
         while True:
             if node.is_leaf():
                 break
-            action, node = node.get_best(self.c_uct)
+            if self.solver and node.proven_ == -1:
+                break
+            parent = node
+            action, node = node.get_best(self.c_uct, self.solver)
             state = self.state_manager.get_next_state(state, action)
+            if tt is not None:
+                shared = tt.resolve(parent.children_, action, node, self.state_manager.hash_state(state))
+                if shared is not node:
+                    # the fresh child was dropped for the stored node, which gains a parent
+                    shared.n_parents_ += 1
+                    self.n_nodes_ -= 1
+                    node = shared
+            path.append(node)
+        if self.solver and node.proven_ != 0:
+            # proven loss, or a proven terminal win, nothing left to check or roll out
+            self.proven_hits_ += 1
+            self.update_path(path, node.proven_value_)
+            return None
         winner, score, end = self.state_manager.is_finished(state)
+        if self.solver and end:
+            node.proven_ = 1 if winner == 1 else -1
+            node.proven_value_ = self.terminal_value(winner, score, state)
+            self.update_path(path, node.proven_value_)
+            self.update_proven(path)
+            return None
         if not end:
             # uniform prior probs
             actions = self.state_manager.get_valid_actions(state)
@@ -84,29 +229,172 @@ class MCTS(object):
             probs = np.ones((len(actions))) / float(len(actions))
             actions_and_probs = list(zip(actions, probs))
             # in UCT, probs is never used but leave it for compatibility
+            n_children = len(node.children_)
             node.expand(actions_and_probs)
+            self.n_nodes_ += len(node.children_) - n_children
 
-        value = self.state_manager.rollout_from_state(state)
-        node.update(value)
+        value = self.rollout_value(state)
+        self.update_path(path, value)
+        if self.max_nodes is not None and self.n_nodes_ > self.max_nodes:
+            self.prune_tree()
         return None
 
-    def get_action_probs(self, state, temp=1E-3):
-        # low temp -> nearly argmax
-        for n in range(self.n_playout):
+    def terminal_value(self, winner, score, state):
+        # value of a finished state, same convention as rollout_from_state
+        if winner == -1:
+            return -1.
+        elif winner == 0:
+            return score
+        else:
+            return self.state_manager._score(state)
+
+    def update_proven(self, path):
+        # propagate a new proof from the end of path towards the root
+        # a node is a proven win once any child is, and a proven loss once every child is
+        for node in path[-2::-1]:
+            children = list(node.children_.values())
+            proven = [child.proven_ for child in children]
+            if 1 in proven:
+                if node.proven_ == 1:
+                    break
+                node.proven_ = 1
+                node.proven_value_ = max([child.proven_value_ for child in children if child.proven_ == 1])
+            elif len(children) > 0 and min(proven) == -1 and max(proven) == -1:
+                node.proven_ = -1
+                # best dead end below, backed up whenever selection reaches this node
+                node.proven_value_ = max([child.proven_value_ for child in children])
+                if node is not self.root:
+                    # dead subtree, the root keeps its children so get_action can still answer
+                    node.children_ = {}
+                    for child in children:
+                        self.free_subtree(child)
+            else:
+                break
+
+    def rollout_value(self, state):
+        if self.batch_rollout is None:
+            return self.state_manager.rollout_from_state(state)
+        # rollouts draw from the state manager random_state, like rollout_from_state
+        values = self.batch_rollout.rollout(state, self.n_rollouts, self.state_manager.random_state)
+        return float(np.mean(values))
+
+    def update_path(self, path, value):
+        # same updates as node.update(value) on the leaf, the root has no parent
+        for node in path:
+            node._update(value)
+
+    def search(self, state, n_playout=None, time_budget=None):
+        # playouts from state, until n_playout are done or time_budget seconds have passed
+        # defaults are self.n_playout and self.time_budget (None, no time limit)
+        # in anytime mode (time_budget or early_stop set)
+        # roots with no action or a single action are decided without searching, and
+        # with early_stop the search ends once the most visited root child can't be overtaken
+        # returns the accounting for this move, also kept in last_search_ and summed in budget_used_
+        if n_playout is None:
+            n_playout = self.n_playout
+        if time_budget is None:
+            time_budget = self.time_budget
+        start_time = time.time()
+        n_done = 0
+        stop = None
+        if self.early_stop or time_budget is not None:
+            if self.root_is_leaf():
+                winner, score, end = self.state_manager.is_finished(state)
+                n_actions = 0 if end else len(self.state_manager.get_valid_actions(state))
+            else:
+                n_actions = len(self.root_visits())
+            if n_actions == 0:
+                stop = "no_action"
+            elif n_actions == 1:
+                stop = "single_action"
+                if self.root_is_leaf():
+                    # one playout expands the root, so update_tree_root can follow the move
+                    self.playout(state)
+                    n_done = 1
+        if stop is None:
+            n_done, stop = self.run_playouts(state, n_playout, time_budget, start_time)
+        stats = {"playouts": n_done,
+                 "time": time.time() - start_time,
+                 "stop": stop,
+                 "n_playout": n_playout,
+                 "time_budget": time_budget}
+        self.last_search_ = stats
+        self.budget_used_["moves"] += 1
+        self.budget_used_["playouts"] += n_done
+        self.budget_used_["time"] += stats["time"]
+        self.budget_used_["stops"][stop] = self.budget_used_["stops"].get(stop, 0) + 1
+        return stats
+
+    def run_playouts(self, state, n_playout, time_budget, start_time):
+        # returns (playouts done, reason for stopping)
+        n_done = 0
+        while n_done < n_playout:
             self.playout(state)
+            n_done += 1
+            if self.solver and self.root.proven_ == -1:
+                # every line from the root is a dead end, more playouts can't change that
+                return n_done, "proven"
+            if time_budget is None and not self.early_stop:
+                continue
+            elapsed = time.time() - start_time
+            if time_budget is not None and elapsed >= time_budget:
+                return n_done, "time"
+            if self.early_stop and n_done < n_playout:
+                remaining = n_playout - n_done
+                if time_budget is not None and elapsed > 0:
+                    # playouts that still fit in the time left, at the rate so far
+                    remaining = min(remaining, int((time_budget - elapsed) * n_done / elapsed) + 1)
+                if self.visit_margin() > remaining:
+                    return n_done, "early"
+        return n_done, "playouts"
+
+    def visit_margin(self):
+        # visits separating the most visited root child from the runner up
+        visits = sorted([n_visits for act, n_visits in self.root_visits()])
+        if len(visits) < 2:
+            return np.inf
+        return visits[-1] - visits[-2]
+
+    def get_action_probs(self, state, temp=1E-3, n_playout=None, time_budget=None):
+        # low temp -> nearly argmax
+        self.search(state, n_playout, time_budget)
 
-        act_visits = [(act, node.n_visits_) for act, node in self.root.children_.items()]
+        act_visits = self.root_visits()
         if len(act_visits) == 0:
             return None, None
+        if self.solver:
+            act_visits = self.solver_visits(act_visits)
         actions, visits = zip(*act_visits)
+        if len(actions) == 1:
+            # forced move, possibly decided before the child was visited
+            return actions, np.ones((1,))
         action_probs = softmax(1. / temp * np.log(visits))
         return actions, action_probs
 
+    def solver_visits(self, act_visits):
+        # restrict the choice to proven wins if there are any, else drop proven losses
+        # falls back to every child when nothing visited is left
+        proven = dict([(act, node.proven_) for act, node in self.root.children_.items()])
+        if 1 in proven.values():
+            keep = [(act, n_visits) for act, n_visits in act_visits if proven[act] == 1 and n_visits > 0]
+        else:
+            keep = [(act, n_visits) for act, n_visits in act_visits if proven[act] != -1 and n_visits > 0]
+        if len(keep) == 0:
+            return act_visits
+        return keep
+
+    def root_is_leaf(self):
+        return self.root.is_leaf()
+
+    def root_visits(self):
+        # [(action, n_visits)] for the root children, in children_ order
+        return [(act, node.n_visits_) for act, node in self.root.children_.items()]
+
     def sample_action(self, state, temp=1E-3, add_noise=True,
-                      dirichlet_coeff1=0.25, dirichlet_coeff2=0.3):
+                      dirichlet_coeff1=0.25, dirichlet_coeff2=0.3, n_playout=None, time_budget=None):
         vsz = len(self.state_manager.get_action_space())
         act_probs = np.zeros((vsz,))
-        acts, probs = self.get_action_probs(state, temp)
+        acts, probs = self.get_action_probs(state, temp, n_playout, time_budget)
         if acts == None:
             return acts, probs
         act_probs[list(acts)] = probs
@@ -116,11 +404,11 @@ class MCTS(object):
             act = self.random_state.choice(acts, p=probs)
         return act, act_probs
 
-    def get_action(self, state):
+    def get_action(self, state, n_playout=None, time_budget=None):
         vsz = len(self.state_manager.get_action_space())
         act_probs = np.zeros((vsz,))
         # temp doesn't matter for argmax
-        acts, probs = self.get_action_probs(state, temp=1.)
+        acts, probs = self.get_action_probs(state, temp=1., n_playout=n_playout, time_budget=time_budget)
         if acts == None:
             return acts, probs
         act_probs[list(acts)] = probs
@@ -135,6 +423,8 @@ class MCTS(object):
 
     def update_tree_root(self, action):
         if action in self.root.children_:
+            if self.release_subtrees:
+                self.release_siblings(self.root, action)
             self.tree_subs_.append((self.root, self.root.children_[action]))
             if len(self.tree_subs_) > self.warn_at_:
                 print("WARNING: Over {} tree_subs_ detected, watch memory".format(self.warn_at_))
@@ -145,6 +435,108 @@ class MCTS(object):
         else:
             raise ValueError("Action argument {} neither in root.children_ {} and not == -1 (reset)".format(self.root.children_.keys()))
 
+    def free_subtree(self, node):
+        # node was cut from one of its parents, returns the number of nodes freed
+        # nodes still held by another parent (shared through a transposition table) survive,
+        # freed nodes also leave the table, which would otherwise keep them alive
+        freed = []
+        stack = [(node, None)]
+        while len(stack) > 0:
+            node, parent = stack.pop()
+            if node.n_parents_ > 1:
+                node.n_parents_ -= 1
+                if parent is not None and node.parent is parent:
+                    # the parent it was created under is gone
+                    node.parent = None
+                continue
+            freed.append(node)
+            stack.extend([(child, node) for child in node.children_.values()])
+        self.n_nodes_ -= len(freed)
+        if self.transpositions is not None:
+            self.transpositions.discard(freed)
+        return len(freed)
+
+    def release_siblings(self, node, action):
+        # keep only children_[action] below node, the other subtrees are freed
+        # node keeps its own statistics, and is expanded again (fresh siblings) if selection reaches it
+        # after reconstruct_tree
+        kept = node.children_[action]
+        dropped = [(a, child) for a, child in node.children_.items() if child is not kept]
+        if self.solver:
+            self.stash_proofs(node, dropped)
+        node.children_ = {action: kept}
+        node.released_ = True
+        for a, child in dropped:
+            self.free_subtree(child)
+
+    def stash_proofs(self, node, dropped):
+        # dropped is [(action, child)] about to be cut from node, the solver proofs anywhere in their
+        # subtrees stay on node, nested by action, and come back level by level as the nodes are expanded again
+        for action, child in dropped:
+            proof = self.subtree_proofs(child)
+            if proof is not None:
+                if node.proven_children_ is None:
+                    node.proven_children_ = {}
+                node.proven_children_[action] = proof
+
+    def subtree_proofs(self, node):
+        # (proven_, proven_value_, proven_children_) of node including the proofs below it, None if there are none
+        below = dict(node.proven_children_) if node.proven_children_ is not None else {}
+        for action, child in node.children_.items():
+            proof = self.subtree_proofs(child)
+            if proof is not None:
+                below[action] = proof
+        if node.proven_ == 0 and len(below) == 0:
+            return None
+        return (node.proven_, node.proven_value_, below if len(below) > 0 else None)
+
+    def prune_tree(self, max_nodes=None):
+        # collapse the least visited subtrees below the root until at most max_nodes remain
+        # only nodes whose children are all leaves are collapsed, so the tree shrinks from the fringe inwards
+        # a collapsed node keeps its own statistics and is expanded again if selection reaches it
+        # solver proofs of the dropped children are kept on the collapsed node (see stash_proofs)
+        # the root and the reconstruction path above it are never pruned
+        if max_nodes is None:
+            max_nodes = int(self.prune_fraction * self.max_nodes)
+
+        def is_fringe(node):
+            if node is self.root or len(node.children_) == 0:
+                return False
+            for child in node.children_.values():
+                if len(child.children_) > 0:
+                    return False
+            return True
+
+        # (n_visits, insertion count, node), the count keeps heap order stable and avoids comparing nodes
+        heap = []
+        seen = set()
+        stack = [self.root]
+        while len(stack) > 0:
+            node = stack.pop()
+            if id(node) in seen:
+                continue
+            seen.add(id(node))
+            if is_fringe(node):
+                heap.append((node.n_visits_, len(heap), node))
+            stack.extend(node.children_.values())
+        heapq.heapify(heap)
+        count = len(heap)
+        n_pruned = 0
+        while self.n_nodes_ > max_nodes and len(heap) > 0:
+            n_visits, _, node = heapq.heappop(heap)
+            if not is_fringe(node):
+                continue
+            if self.solver:
+                self.stash_proofs(node, list(node.children_.items()))
+            children = list(node.children_.values())
+            node.children_ = {}
+            for child in children:
+                n_pruned += self.free_subtree(child)
+            if node.parent is not None and is_fringe(node.parent):
+                heapq.heappush(heap, (node.parent.n_visits_, count, node.parent))
+                count += 1
+        return n_pruned
+
     def reconstruct_tree(self):
         # walk the list back to front, putting parents back in place
         # should reconstruct tree while still preserving counts...
@@ -156,5 +548,217 @@ class MCTS(object):
 
     def reset_tree(self):
         print("Resetting tree")
-        self.root = TreeNode(1., None)
+        self.root = TreeNode(None)
         self.tree_subs_ = []
+        self.n_nodes_ = 1
+        if self.transpositions is not None:
+            self.transpositions.clear()
+
+    def memory_footprint(self):
+        # approximate, counts the node objects, their __dict__ and children_ dicts
+        # starts from the top of the tree, so nodes kept for reconstruct_tree are included
+        top = self.tree_subs_[0][0] if len(self.tree_subs_) > 0 else self.root
+        n_nodes = 0
+        n_bytes = 0
+        stack = [top]
+        # nodes shared through a transposition table are counted once
+        seen = set()
+        while len(stack) > 0:
+            node = stack.pop()
+            if id(node) in seen:
+                continue
+            seen.add(id(node))
+            n_nodes += 1
+            n_bytes += sys.getsizeof(node) + sys.getsizeof(node.__dict__) + sys.getsizeof(node.children_)
+            stack.extend(node.children_.values())
+        return {"nodes": n_nodes, "bytes": n_bytes}
+
+
+class ArrayTree(object):
+    # struct of arrays tree storage, every node is an integer id into growable numpy arrays
+    # the children of a node are allocated together, so they occupy the contiguous id range
+    # child_start_[node] to child_start_[node] + n_children_[node]
+    # children are laid out in the iteration order of TreeNode.children_, so ties break the same way
+    array_names = ["n_visits_", "W_", "parent_", "action_", "child_start_", "n_children_"]
+
+    def __init__(self, capacity=1024):
+        self.capacity_ = capacity
+        self.size_ = 0
+        self.n_visits_ = np.zeros((capacity,), dtype="int64")
+        self.W_ = np.zeros((capacity,), dtype="float64")
+        self.parent_ = np.zeros((capacity,), dtype="int32")
+        self.action_ = np.zeros((capacity,), dtype="int32")
+        self.child_start_ = np.zeros((capacity,), dtype="int32")
+        self.n_children_ = np.zeros((capacity,), dtype="int32")
+
+    def _grow(self, min_capacity):
+        capacity = self.capacity_
+        while capacity < min_capacity:
+            capacity *= 2
+        for name in self.array_names:
+            old = getattr(self, name)
+            new = np.zeros((capacity,), dtype=old.dtype)
+            new[:self.size_] = old[:self.size_]
+            setattr(self, name, new)
+        self.capacity_ = capacity
+
+    def add_nodes(self, parent, actions):
+        # returns the id of the first new node
+        start = self.size_
+        end = start + len(actions)
+        if end > self.capacity_:
+            self._grow(end)
+        self.n_visits_[start:end] = 0
+        self.W_[start:end] = 0.
+        self.parent_[start:end] = parent
+        self.action_[start:end] = actions
+        self.child_start_[start:end] = 0
+        self.n_children_[start:end] = 0
+        self.size_ = end
+        return start
+
+    def new_root(self):
+        return self.add_nodes(-1, [-1])
+
+    def expand(self, node, actions_and_probs):
+        # children are fixed once a node is expanded, MCTS only expands leaves
+        if self.n_children_[node] > 0:
+            return
+        order = {}
+        for action, prob in actions_and_probs:
+            if action not in order:
+                order[action] = prob
+        actions = list(order.keys())
+        self.child_start_[node] = self.add_nodes(node, actions)
+        self.n_children_[node] = len(actions)
+
+    def is_leaf(self, node):
+        return self.n_children_[node] == 0
+
+    def children(self, node):
+        start = self.child_start_[node]
+        return range(start, start + self.n_children_[node])
+
+    def child_for_action(self, node, action):
+        # node id of the child reached by action, or -1
+        for c in self.children(node):
+            if self.action_[c] == action:
+                return c
+        return -1
+
+    def get_value(self, node, c_uct):
+        # same expression as TreeNode.get_value
+        n_visits = self.n_visits_[node]
+        if n_visits == 0:
+            return np.inf
+        lp = self.W_[node] / float(n_visits)
+        rp = c_uct * np.sqrt(2 * np.log(self.n_visits_[self.parent_[node]]) / float(n_visits))
+        return lp + rp
+
+    def get_best(self, node, c_uct):
+        # (action, child id) of the first child with the highest value
+        start = self.child_start_[node]
+        end = start + self.n_children_[node]
+        scores = uct_scores(self.W_[start:end], self.n_visits_[start:end].astype("float64"),
+                            self.n_visits_[node], c_uct)
+        best = start + np.argmax(scores)
+        return self.action_[best], best
+
+    def update(self, node, value, root):
+        # node and its ancestors up to and including root
+        while True:
+            self.n_visits_[node] += 1
+            self.W_[node] += value
+            if node == root:
+                break
+            node = self.parent_[node]
+
+    def update_path(self, path, value):
+        # path is an array of distinct node ids, e.g. a selection path
+        self.n_visits_[path] += 1
+        self.W_[path] += value
+
+    def memory_footprint(self):
+        bytes_used = sum([getattr(self, name).itemsize for name in self.array_names]) * self.size_
+        bytes_allocated = sum([getattr(self, name).nbytes for name in self.array_names])
+        return {"nodes": self.size_, "capacity": self.capacity_,
+                "bytes": bytes_used, "bytes_allocated": bytes_allocated}
+
+
+class ArrayMCTS(MCTS):
+    # drop in for MCTS backed by an ArrayTree, root is a node id instead of a TreeNode
+    # the options built on per node objects are not supported, transposition_table (children shared
+    # between parents), max_nodes / release_subtrees (freeing subtrees out of the id ranges) and solver
+    # (proof marks), passing any of them raises a ValueError rather than being silently ignored
+    def __init__(self, state_manager, c_uct=1.4, n_playout=1000, random_state=None, capacity=1024,
+                 n_rollouts=1, time_budget=None, early_stop=False,
+                 transposition_table=None, max_nodes=None, release_subtrees=None, solver=False):
+        self.reject_options(transposition_table=transposition_table, max_nodes=max_nodes,
+                            release_subtrees=release_subtrees, solver=solver)
+        MCTS.__init__(self, state_manager, c_uct=c_uct, n_playout=n_playout, random_state=random_state,
+                      n_rollouts=n_rollouts, time_budget=time_budget, early_stop=early_stop)
+        self.capacity = capacity
+        self.tree = ArrayTree(capacity)
+        self.root = self.tree.new_root()
+
+    def reject_options(self, **options):
+        used = sorted([name for name, value in options.items() if value is not None and value is not False])
+        if len(used) > 0:
+            raise ValueError("{} does not support {}, use MCTS for these".format(type(self).__name__, ", ".join(used)))
+
+    def playout(self, state):
+        tree = self.tree
+        node = self.root
+        path = [node]
+        while True:
+            if tree.is_leaf(node):
+                break
+            action, node = tree.get_best(node, self.c_uct)
+            path.append(node)
+            state = self.state_manager.get_next_state(state, action)
+        winner, score, end = self.state_manager.is_finished(state)
+        if not end:
+            # uniform prior probs
+            actions = self.state_manager.get_valid_actions(state)
+            probs = np.ones((len(actions))) / float(len(actions))
+            actions_and_probs = list(zip(actions, probs))
+            tree.expand(node, actions_and_probs)
+
+        value = self.rollout_value(state)
+        self.update_path(path, value)
+        return None
+
+    def update_path(self, path, value):
+        self.tree.update_path(np.array(path), value)
+
+    def root_is_leaf(self):
+        return self.tree.is_leaf(self.root)
+
+    def root_visits(self):
+        return [(int(self.tree.action_[c]), int(self.tree.n_visits_[c])) for c in self.tree.children(self.root)]
+
+    def update_tree_root(self, action):
+        child = self.tree.child_for_action(self.root, action)
+        if child < 0:
+            raise ValueError("Action argument {} not in root children {}".format(action, [int(self.tree.action_[c]) for c in self.tree.children(self.root)]))
+        self.tree_subs_.append((self.root, child))
+        if len(self.tree_subs_) > self.warn_at_:
+            print("WARNING: Over {} tree_subs_ detected, watch memory".format(self.warn_at_))
+            # only print the warning a few times
+            self.warn_at_ = 10 * self.warn_at_
+        # parent_ links are kept, update() stops at the current root instead
+        self.root = child
+
+    def reconstruct_tree(self):
+        if len(self.tree_subs_) > 0:
+            self.root = self.tree_subs_[0][0]
+        self.tree_subs_ = []
+
+    def reset_tree(self):
+        print("Resetting tree")
+        self.tree = ArrayTree(self.capacity)
+        self.root = self.tree.new_root()
+        self.tree_subs_ = []
+
+    def memory_footprint(self):
+        return self.tree.memory_footprint()
@@ -13,7 +13,7 @@ import numpy as np
 import copy
 from shared_mcts import MCTS
 from dataset_wrap import three_voice_species1_wrap
-from analysis import analyze_three_voices
+from analysis import IncrementalChecker
 
 all_l, all_c_set, u_map, m_map, um_map, l_map, all_i = three_voice_species1_wrap()
 u_inv_map = {v: k for k, v in u_map.items()}
@@ -46,12 +46,18 @@ class ThreeVoiceSpecies1Manager(object):
 
         self.random_state = np.random.RandomState(1999)
         self.rollout_limit = rollout_limit
+        self.checker = IncrementalChecker(np.array(self.guide_trace) + self.offset_value, n_voices=3,
+                                          species="species1_minimal", cantus_firmus_voices=[2])
 
     def get_next_state(self, state, action):
         tup_act = j_acts_map[action]
         new_state = [state[0] + [tup_act[0]], state[1] + [tup_act[1]], state[2]]
         return new_state
 
+    def hash_state(self, state):
+        # step and last 3 steps of the upper voices, see transposition_table.py for why that is enough
+        return hash((len(state[0]),) + tuple([tuple(s[-3:]) for s in state[:-1]]))
+
     def get_action_space(self):
         return list(range(len(j_acts_map.keys())))
 
@@ -179,40 +185,13 @@ class ThreeVoiceSpecies1Manager(object):
         #if len(state[0]) != len(state[2]):
         #    return -1, False
 
-        ns0 = state[0] + [0] * (len(state[2]) - len(state[0]))
-        ns1 = state[1] + [0] * (len(state[2]) - len(state[1]))
-        # the state to check
-        s_l = [ns0, ns1, state[2]]
-
-        s = np.array(s_l)
-        s[2, :] += self.offset_value
-        s[0, :] += s[2, :]
-        s[1, :] += s[2, :]
-
-        parts = s
-        durations = [['4'] * len(p) for p in parts]
-        key_signature = "C"
-        time_signature = "4/4"
         # minimal check during rollout
-        aok = analyze_three_voices(parts, durations, key_signature, time_signature,
-                                   species="species1_minimal", cantus_firmus_voices=[2])
-
-        if len(aok[1]["False"]) > 0:
-            first_error = aok[1]["False"][0]
-        else:
-            first_error = np.inf
-
-        if len(state[0]) < len(state[2]):
-            # error is out of our control (in the padded notes)
-            if first_error > (len(state[0]) - 1):
-                return 0, 0., False
-            else:
-                # made a mistake
-                return 0, -1. + len(state[0]) / float(len(state[2])), True
-        elif aok[0]:
-            return 1, 1., True
-        else:
-            return -1, -1., True
+        # same result as checking the zero padded state,
+        # but only the steps touched by the newest notes are analyzed
+        bot = np.array(state[2]) + self.offset_value
+        top = bot[:len(state[0])] + np.array(state[0])
+        mid = bot[:len(state[1])] + np.array(state[1])
+        return self.checker.status([top, mid])
 
 
 if __name__ == "__main__":
@@ -0,0 +1 @@
+../transposition_table.py
\ No newline at end of file
@@ -0,0 +1,109 @@
+# Author: Kyle Kastner
+# License: BSD 3-Clause
+# vectorized random rollouts for the first species state managers in base_mcts and puct_mcts
+# symlinked into base_mcts and puct_mcts like analysis.py
+# n_rollouts continuations of one leaf advance in lock step as numpy arrays
+# valid actions come from boolean masks cached per (step, previous action), the next action of every
+# rollout is drawn in one call, and rollouts retire as soon as they finish
+# same value convention and distribution as rollout_from_state (uniform over valid actions),
+# but not draw for draw
+# assumes get_valid_actions only looks at the position and the previous step, true for these managers
+import numpy as np
+
+
+class BatchRollout(object):
+    def __init__(self, state_manager):
+        self.state_manager = state_manager
+        self.action_space = state_manager.get_action_space()
+        init = state_manager.get_init_state()
+        # state is [upper voice intervals ..., guide]
+        self.n_upper = len(init) - 1
+        self.guide = [int(g) for g in init[-1]]
+        # action -> interval above the guide, one column per upper voice
+        next_states = [state_manager.get_next_state(init, a) for a in self.action_space]
+        self.intervals_ = np.array([[s[v][-1] for v in range(self.n_upper)] for s in next_states])
+        self.actions_inv_ = {tuple(self.intervals_[a]): a for a in self.action_space}
+        # (step, previous action) -> boolean mask over the action space, -1 for no previous action
+        self.masks_ = {}
+
+    def _mask(self, step, last):
+        key = (step, last)
+        if key not in self.masks_:
+            # any state of this length ending in last gives the same valid actions
+            state = self.state_manager.get_init_state()
+            if last >= 0:
+                for i in range(step):
+                    state = self.state_manager.get_next_state(state, last)
+            mask = np.zeros((len(self.action_space),), dtype=bool)
+            mask[self.state_manager.get_valid_actions(state)] = True
+            self.masks_[key] = mask
+        return self.masks_[key]
+
+    def valid_masks(self, step, lasts):
+        # (len(lasts), n_actions) valid action masks for rollouts of length step
+        uniq, inverse = np.unique(lasts, return_inverse=True)
+        return np.array([self._mask(step, int(u)) for u in uniq])[inverse]
+
+    def _terminal_value(self, w, sc, state):
+        # rollout_from_state convention
+        if w == -1:
+            return -1.
+        elif w == 0:
+            return sc
+        else:
+            return self.state_manager._score(state)
+
+    def rollout(self, state, n_rollouts, random_state):
+        # returns the n_rollouts values, each as rollout_from_state would give
+        mgr = self.state_manager
+        w, sc, e = mgr.is_finished(state)
+        if e:
+            return np.zeros((n_rollouts,)) + self._terminal_value(w, sc, state)
+
+        checker = mgr.checker
+        n_steps = len(self.guide)
+        bass = np.array(self.guide) + mgr.offset_value
+        length = len(state[0])
+        # midi pitches of the upper voices for every rollout
+        upper = np.zeros((n_rollouts, n_steps, self.n_upper), dtype="int64")
+        last = -1
+        if length > 0:
+            prefix = np.array([state[v] for v in range(self.n_upper)]).T
+            upper[:, :length] = prefix + bass[:length, None]
+            last = self.actions_inv_[tuple(prefix[-1])]
+        lasts = np.zeros((n_rollouts,), dtype="int64") + last
+        values = np.zeros((n_rollouts,))
+        active = np.arange(n_rollouts)
+        c = 0
+        while len(active) > 0:
+            if c > mgr.rollout_limit:
+                values[active] = 0.
+                break
+            # uniform choice among the valid actions of each rollout, one draw for the whole batch
+            u = random_state.rand(len(active), len(self.action_space))
+            u[~self.valid_masks(length, lasts[active])] = -1.
+            a = np.argmax(u, axis=1)
+            upper[active, length] = self.intervals_[a] + bass[length]
+            lasts[active] = a
+            length += 1
+            c += 1
+
+            # same checks, in the same order, as is_finished on the new states
+            no_moves = ~self.valid_masks(length, a).any(axis=1)
+            fails = checker.step_fails_batch(length - 1, upper[active, :length])
+            if length >= 2:
+                # the previous step is now closed by the new one
+                fails |= checker.step_fails_batch(length - 2, upper[active, :length])
+            if length < n_steps:
+                # made a mistake, partial credit for the length reached
+                finished = no_moves | fails
+                values[active[fails]] = -1. + length / float(n_steps)
+            else:
+                finished = np.ones((len(active),), dtype=bool)
+                values[active[fails]] = -1.
+                for i in active[~fails & ~no_moves]:
+                    s = [list(upper[i, :, v] - bass) for v in range(self.n_upper)] + [self.guide]
+                    values[i] = mgr._score(s)
+            values[active[no_moves]] = -1.
+            active = active[~finished]
+        return values
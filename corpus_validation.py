@@ -0,0 +1,276 @@
+# Author: Kyle Kastner
+# License: BSD 3-Clause
+# validate a corpus of pieces against the species rules over a process pool
+# results stream to a JSONL file, one line per piece, in completion order
+# example:
+# python corpus_validation.py samples/ Jos2721-La_Bernardina.krn --species species1 --out report.jsonl
+# python corpus_validation.py --dataset two_voice_species1 --dataset three_voice_species1
+# built in datasets are checked against their own species, --species only applies to file inputs
+import os
+import sys
+import json
+import time
+import types
+import multiprocessing
+
+from analysis import analyze_two_voices
+from analysis import analyze_three_voices
+from analysis import notes_to_midi
+from analysis import rule_names_map
+from analysis import rule_messages
+
+corpus_extensions = (".mid", ".midi", ".krn")
+
+corpus_datasets = ["two_voice_species1",
+                   "two_voice_species2",
+                   "two_voice_species3",
+                   "two_voice_species4",
+                   "three_voice_species1",
+                   "three_voice_mcts_species1_counterexample"]
+
+
+class EmbedBranchError(Exception):
+    pass
+
+
+def _raising_embed(*args, **kwargs):
+    # the analysis code drops into IPython on unexpected states
+    # in a worker that would wait on stdin forever, so report where it happened instead
+    caller = sys._getframe(1)
+    raise EmbedBranchError("IPython.embed reached at {}:{} ({})".format(os.path.basename(caller.f_code.co_filename),
+                                                                        caller.f_lineno,
+                                                                        caller.f_code.co_name))
+
+
+def install_embed_guard():
+    # every later "from IPython import embed" resolves to _raising_embed
+    # returns the module it replaced, None if IPython was not imported
+    guard = types.ModuleType("IPython")
+    guard.embed = _raising_embed
+    previous = sys.modules.get("IPython")
+    sys.modules["IPython"] = guard
+    return previous
+
+
+def remove_embed_guard(previous):
+    if previous is None:
+        sys.modules.pop("IPython", None)
+    else:
+        sys.modules["IPython"] = previous
+
+
+def init_worker():
+    # pool workers only, the guard and the closed stdin last for the life of the worker process
+    install_embed_guard()
+    try:
+        sys.stdin.close()
+    except Exception:
+        pass
+    sys.stdin = open(os.devnull)
+
+
+def find_corpus_files(paths):
+    found = []
+    for p in paths:
+        if os.path.isdir(p):
+            for root, dirs, files in os.walk(p):
+                dirs.sort()
+                for f in sorted(files):
+                    if f.lower().endswith(corpus_extensions):
+                        found.append(os.path.join(root, f))
+        elif p.lower().endswith(corpus_extensions):
+            found.append(p)
+        else:
+            raise ValueError("Unknown corpus file type {}, expected one of {}".format(p, corpus_extensions))
+    return found
+
+
+def dataset_species(name):
+    # two_voice_species2 -> species2, the three voice datasets are all first species
+    if name.startswith("two_voice_"):
+        return name[len("two_voice_"):]
+    return "species1"
+
+
+def dataset_tasks(name):
+    import datasets
+    if name not in corpus_datasets:
+        raise ValueError("Unknown dataset {}, expected one of {}".format(name, corpus_datasets))
+    species = dataset_species(name)
+    all_ex = getattr(datasets, "fetch_" + name)()
+    tasks = []
+    for ex in all_ex:
+        nd = ex["notes_and_durations"]
+        notes = [[ndii[0] for ndii in ndi] for ndi in nd]
+        durations = [[ndii[1] for ndii in ndi] for ndi in nd]
+        parts = notes_to_midi(notes)
+        tasks.append({"piece": "{}/{}".format(name, ex["name"]),
+                      "parts": parts,
+                      "durations": durations,
+                      "species": species,
+                      "cantus_firmus_voices": [ex["cantus_firmus_voice"],]})
+    return tasks
+
+
+def file_tasks(files, cantus_firmus_voices, species="species1"):
+    return [{"piece": f, "path": f, "species": species, "cantus_firmus_voices": cantus_firmus_voices} for f in files]
+
+
+def load_parts(path):
+    # MIDI from pitches_and_durations_to_pretty_midi or kern, durations in quarter lengths
+    from music21 import converter
+    from datasets import music21_extract
+    p = converter.parse(path)
+    r = music21_extract(p)
+    parts = r["parts"]
+    durations = [[float(d) for d in pd] for pd in r["parts_delta_times"]]
+    return parts, durations
+
+
+def validate_piece(task, key_signature="C", time_signature="4/4"):
+    species = task["species"]
+    result = {"piece": task["piece"],
+              "species": species,
+              "pass": False,
+              "n_voices": None,
+              "n_steps": None,
+              "failures": [],
+              "first_failure": -1,
+              "error": None}
+    start_time = time.time()
+    try:
+        if "path" in task:
+            parts, durations = load_parts(task["path"])
+        else:
+            parts = task["parts"]
+            durations = task["durations"]
+        result["n_voices"] = len(parts)
+        result["n_steps"] = max([len(p) for p in parts])
+        if len(parts) == 2:
+            analyze = analyze_two_voices
+        elif len(parts) == 3:
+            analyze = analyze_three_voices
+        else:
+            raise ValueError("Only two and three voice pieces are supported, got {} voices".format(len(parts)))
+        all_ok, records = analyze(parts, durations, key_signature, time_signature,
+                                  species=species,
+                                  cantus_firmus_voices=task["cantus_firmus_voices"],
+                                  structured=True)
+        message_keys = list(rule_messages.keys())
+        failed = records[records["status"] == 2]
+        result["pass"] = bool(all_ok)
+        result["failures"] = [{"rule": rule_names_map[int(rec["rule"])],
+                               "message": message_keys[int(rec["message"])],
+                               "pair": int(rec["pair"]),
+                               "step": int(rec["step"])} for rec in failed]
+        if len(failed) > 0:
+            result["first_failure"] = int(failed["step"].min())
+    except Exception as e:
+        result["error"] = "{}: {}".format(type(e).__name__, e)
+    result["time"] = time.time() - start_time
+    return result
+
+
+def _validate_piece_star(args):
+    return validate_piece(*args)
+
+
+def validate_corpus(tasks, out_file, key_signature="C", time_signature="4/4",
+                    n_workers=None, chunksize=None, verbose=True):
+    # returns summary dict, per piece results go to out_file (path or file object) as they complete
+    # every task carries its own species, see file_tasks / dataset_tasks
+    if n_workers is None:
+        n_workers = multiprocessing.cpu_count()
+    if chunksize is None:
+        # a few chunks per worker keeps the pool busy without per piece dispatch overhead
+        chunksize = max(1, len(tasks) // (4 * n_workers))
+    args = [(t, key_signature, time_signature) for t in tasks]
+
+    if isinstance(out_file, str):
+        f = open(out_file, "w")
+    else:
+        f = out_file
+
+    summary = {"n_pieces": 0,
+               "n_passed": 0,
+               "n_failed": 0,
+               "n_errors": 0,
+               "n_steps": 0,
+               "piece_time": 0.}
+    start_time = time.time()
+    if n_workers > 1:
+        pool = multiprocessing.Pool(n_workers, initializer=init_worker)
+        results = pool.imap_unordered(_validate_piece_star, args, chunksize)
+    else:
+        pool = None
+        # this is the caller's process (maybe an IPython session), so the guard only lasts for this call
+        # and stdin is left alone
+        previous_ipython = install_embed_guard()
+        results = (_validate_piece_star(a) for a in args)
+    try:
+        for r in results:
+            f.write(json.dumps(r) + "\n")
+            f.flush()
+            summary["n_pieces"] += 1
+            summary["piece_time"] += r["time"]
+            if r["error"] is not None:
+                summary["n_errors"] += 1
+            elif r["pass"]:
+                summary["n_passed"] += 1
+            else:
+                summary["n_failed"] += 1
+            if r["n_steps"] is not None:
+                summary["n_steps"] += r["n_steps"]
+            if verbose and r["error"] is not None:
+                print("Error in {}: {}".format(r["piece"], r["error"]))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        else:
+            remove_embed_guard(previous_ipython)
+        if f is not out_file:
+            f.close()
+    wall_time = time.time() - start_time
+    summary["wall_time"] = wall_time
+    summary["n_workers"] = n_workers
+    summary["chunksize"] = chunksize
+    summary["pieces_per_sec"] = summary["n_pieces"] / wall_time if wall_time > 0 else 0.
+    summary["steps_per_sec"] = summary["n_steps"] / wall_time if wall_time > 0 else 0.
+    if verbose:
+        print("Validated {} pieces ({} passed, {} failed, {} errors) in {:.3f} seconds with {} workers".format(
+              summary["n_pieces"], summary["n_passed"], summary["n_failed"], summary["n_errors"],
+              wall_time, n_workers))
+        print("Throughput {:.2f} pieces/sec, {:.2f} timesteps/sec, {:.4f} summed piece seconds".format(
+              summary["pieces_per_sec"], summary["steps_per_sec"], summary["piece_time"]))
+    return summary
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Validate a corpus of pieces against the species rules")
+    parser.add_argument("paths", nargs="*", help="MIDI / kern files or folders to search")
+    parser.add_argument("--dataset", action="append", default=[], choices=corpus_datasets,
+                        help="include a built in dataset, can be repeated")
+    parser.add_argument("--species", default="species1",
+                        help="species for file inputs, datasets use their own")
+    parser.add_argument("--key_signature", default="C")
+    parser.add_argument("--time_signature", default="4/4")
+    parser.add_argument("--cantus_firmus_voice", type=int, action="append", default=[],
+                        help="voice index to treat as cantus firmus for file inputs, can be repeated")
+    parser.add_argument("--out", default="corpus_validation.jsonl")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--chunksize", type=int, default=None)
+    args = parser.parse_args()
+
+    tasks = file_tasks(find_corpus_files(args.paths), args.cantus_firmus_voice, species=args.species)
+    for d in args.dataset:
+        tasks.extend(dataset_tasks(d))
+    if len(tasks) == 0:
+        parser.error("No pieces found, pass files / folders or --dataset")
+    validate_corpus(tasks, args.out,
+                    key_signature=args.key_signature,
+                    time_signature=args.time_signature,
+                    n_workers=args.workers,
+                    chunksize=args.chunksize)
@@ -0,0 +1,326 @@
+# Author: Kyle Kastner
+# License: BSD 3-Clause
+# scaling benchmark for MCTS generation versus cantus firmus length and playout budget
+# runs the base_mcts / puct_mcts managers and MCTS on synthetic cantus firmi,
+# built as random walks over the dataset_wrap guide vocabularies
+# example:
+# python mcts_benchmark.py --variants two_voice_uct two_voice_puct --lengths 8 12 16 --n_playouts 50 100
+# python mcts_benchmark.py --variants three_voice_puct --out three_voice_scaling.json
+# python mcts_benchmark.py --variants three_voice_puct --lengths 12 --n_playouts 400 --workers 0 1 2 4
+from __future__ import print_function
+import os
+import sys
+import json
+import time
+
+import numpy as np
+
+base_dir = os.path.dirname(os.path.abspath(__file__))
+for d in ["base_mcts", "puct_mcts"]:
+    if os.path.join(base_dir, d) not in sys.path:
+        sys.path.append(os.path.join(base_dir, d))
+
+# variant -> (module, manager class name, n_voices, shared mcts module)
+mcts_variants = {"two_voice_uct": ("two_voice_uct_mcts", "TwoVoiceSpecies1Manager", 2, "shared_mcts"),
+                 "two_voice_puct": ("two_voice_puct_mcts", "TwoVoiceSpecies1Manager", 2, "shared_puct_mcts"),
+                 "three_voice_puct": ("three_voice_puct_mcts", "ThreeVoiceSpecies1Manager", 3, "shared_puct_mcts")}
+
+# tree storage -> MCTS class name in the shared mcts module
+mcts_trees = {"object": "MCTS",
+              "array": "ArrayMCTS",
+              "tree_parallel": "TreeParallelMCTS"}
+
+benchmark_lengths = [8, 12, 16, 24]
+benchmark_n_playouts = [50, 100, 200]
+# 0 is the serial baseline, same playout code in one process
+benchmark_workers = [0, 1, 2, 4]
+
+
+def synthetic_guide(vocabulary, length, random_state, max_step=4):
+    # stepwise random walk over the guide vocabulary (offsets from the final note),
+    # starting and ending on the final note, like the dataset cantus firmi
+    vocabulary = sorted(vocabulary)
+    guide = [0]
+    while len(guide) < length - 2:
+        options = [v for v in vocabulary if 0 < abs(v - guide[-1]) <= max_step]
+        guide.append(random_state.choice(options))
+    # approach the final note by step
+    options = [v for v in [2, -1, 1, -2] if v in vocabulary and abs(v - guide[-1]) <= max_step + 1]
+    if len(options) == 0:
+        options = [2]
+    guide.append(options[0])
+    guide.append(0)
+    return [int(g) for g in guide[:length]]
+
+
+def load_variant(variant):
+    if variant not in mcts_variants:
+        raise ValueError("Unknown variant {}, expected one of {}".format(variant, sorted(mcts_variants.keys())))
+    module_name, manager_name, n_voices, shared_name = mcts_variants[variant]
+    module = __import__(module_name)
+    return module, getattr(module, manager_name), n_voices
+
+
+def has_mcts_tree(variant, tree):
+    if tree not in mcts_trees:
+        raise ValueError("Unknown tree {}, expected one of {}".format(tree, sorted(mcts_trees.keys())))
+    return hasattr(__import__(mcts_variants[variant][3]), mcts_trees[tree])
+
+
+def load_mcts_class(variant, tree="object"):
+    if not has_mcts_tree(variant, tree):
+        raise ValueError("Tree {} is not available for variant {}".format(tree, variant))
+    return getattr(__import__(mcts_variants[variant][3]), mcts_trees[tree])
+
+
+def guide_vocabulary(variant):
+    module, _, n_voices = load_variant(variant)
+    return sorted(module.l_map.keys())
+
+
+def counted(fn, counts, key):
+    def wrapped(*args, **kwargs):
+        counts[key] += 1
+        return fn(*args, **kwargs)
+    return wrapped
+
+
+def run_generation(variant, guide, n_playout, max_resets=3, seed=1110, tree="object", max_nodes=None,
+                   n_workers=None, n_rollouts=1, time_budget=None, early_stop=False, solver=False):
+    # one generation run, following the __main__ loops of the variant scripts (argmax actions)
+    # returns a dict of wall time, playout, rollout and reset statistics
+    # rollouts are only counted in this process, so they read 0 for tree_parallel with workers
+    # batched rollouts (n_rollouts > 1) count n_rollouts each, their steps are not counted
+    module, manager_cls, n_voices = load_variant(variant)
+    if n_voices == 2:
+        manager = manager_cls(0, guide_trace=guide)
+    else:
+        manager = manager_cls(0, guide_trace=guide, verbose=False)
+    # the managers call self._rollout_fn once per rollout step
+    counts = {"rollouts": 0, "rollout_steps": 0, "moves": 0}
+    manager._rollout_fn = counted(manager._rollout_fn, counts, "rollout_steps")
+    manager.rollout_from_state = counted(manager.rollout_from_state, counts, "rollouts")
+    mcts_cls = load_mcts_class(variant, tree)
+    mcts_kwargs = {}
+    if max_nodes is not None:
+        # memory bounded mode, object trees only
+        mcts_kwargs["max_nodes"] = max_nodes
+    if n_workers is not None:
+        mcts_kwargs["n_workers"] = n_workers
+    if n_rollouts > 1:
+        mcts_kwargs["n_rollouts"] = n_rollouts
+    if time_budget is not None or early_stop:
+        # anytime mode, playouts per move vary
+        mcts_kwargs["time_budget"] = time_budget
+        mcts_kwargs["early_stop"] = early_stop
+    if solver:
+        # MCTS-Solver, object trees only
+        mcts_kwargs["solver"] = solver
+    mcts = mcts_cls(manager, n_playout=n_playout, random_state=np.random.RandomState(seed), **mcts_kwargs)
+    if mcts.batch_rollout is not None:
+        batch_fn = mcts.batch_rollout.rollout
+        def counted_batch(state, n, random_state):
+            counts["rollouts"] += n
+            return batch_fn(state, n, random_state)
+        mcts.batch_rollout.rollout = counted_batch
+
+    # three voice scripts write the final chord by hand, so search stops one step early
+    target_length = len(guide) if n_voices == 2 else len(guide) - 1
+    success = False
+    resets = 0
+    final_length = 0
+    start_time = time.time()
+    while resets < max_resets and not success:
+        resets += 1
+        state = manager.get_init_state()
+        winner, score, end = manager.is_finished(state)
+        while not end:
+            a, ap = mcts.get_action(state)
+            counts["moves"] += 1
+            if a is None:
+                break
+            mcts.update_tree_root(a)
+            state = manager.get_next_state(state, a)
+            winner, score, end = manager.is_finished(state)
+            if len(state[0]) >= target_length:
+                break
+        mcts.reconstruct_tree()
+        final_length = len(state[0])
+        success = final_length >= target_length
+    wall_time = time.time() - start_time
+    footprint = mcts.memory_footprint()
+    if hasattr(mcts, "close"):
+        mcts.close()
+    n_playouts = mcts.budget_used_["playouts"]
+    return {"variant": variant,
+            "length": len(guide),
+            "n_playout": n_playout,
+            "wall_time": wall_time,
+            "moves": counts["moves"],
+            "playouts": n_playouts,
+            "playouts_per_sec": n_playouts / wall_time if wall_time > 0 else 0.,
+            "rollouts": counts["rollouts"],
+            "mean_rollout_length": counts["rollout_steps"] / float(max(1, counts["rollouts"])),
+            "resets": resets,
+            "final_length": final_length,
+            "success": success,
+            "tree": tree,
+            "tree_nodes": footprint["nodes"],
+            "tree_bytes": footprint["bytes"],
+            # tree_parallel only, expansions skipped because the shared tree was full
+            "full_skips": footprint.get("full_skips", 0),
+            "n_workers": n_workers,
+            "n_rollouts": n_rollouts,
+            "stops": mcts.budget_used_["stops"],
+            "proven_hits": mcts.proven_hits_}
+
+
+def run_scaling(variants, lengths=benchmark_lengths, n_playouts=benchmark_n_playouts, n_guides=2,
+                max_resets=3, seed=2017, tree="object", max_nodes=None, n_rollouts=1, time_budget=None,
+                early_stop=False, solver=False, verbose=True):
+    # every variant x length x n_playout, over n_guides synthetic guides per length
+    # guides depend only on (seed, variant vocabulary, length, guide number), so runs are comparable across versions
+    rows = []
+    for variant in variants:
+        vocabulary = guide_vocabulary(variant)
+        for length in lengths:
+            guides = [synthetic_guide(vocabulary, length, np.random.RandomState(seed + 1000 * length + g))
+                      for g in range(n_guides)]
+            for n_playout in n_playouts:
+                runs = [run_generation(variant, guide, n_playout, max_resets=max_resets, seed=seed + g, tree=tree,
+                                       max_nodes=max_nodes, n_rollouts=n_rollouts,
+                                       time_budget=time_budget, early_stop=early_stop, solver=solver)
+                        for g, guide in enumerate(guides)]
+                row = {"variant": variant,
+                       "length": length,
+                       "n_playout": n_playout,
+                       "n_guides": n_guides,
+                       "wall_time": np.mean([r["wall_time"] for r in runs]),
+                       "playouts_per_sec": sum([r["playouts"] for r in runs]) / sum([r["wall_time"] for r in runs]),
+                       "mean_rollout_length": np.mean([r["mean_rollout_length"] for r in runs]),
+                       "resets": np.mean([r["resets"] for r in runs]),
+                       "success_rate": np.mean([r["success"] for r in runs]),
+                       "tree_nodes": np.mean([r["tree_nodes"] for r in runs]),
+                       "tree_bytes": np.mean([r["tree_bytes"] for r in runs]),
+                       "runs": runs}
+                rows.append(row)
+                if verbose:
+                    print(format_row(row))
+    return rows
+
+
+def run_worker_scaling(variants, lengths=benchmark_lengths, n_playouts=benchmark_n_playouts,
+                       worker_counts=benchmark_workers, n_guides=2, max_resets=3, seed=2017, verbose=True):
+    # tree_parallel playout throughput versus worker count, same guides as run_scaling
+    # speedup is relative to the serial (n_workers=0) run when present, else the first worker count
+    # efficiency is speedup / n_workers, 1.0 is perfect scaling
+    # variants without a TreeParallelMCTS (the uct ones) are skipped
+    rows = []
+    for variant in variants:
+        if not has_mcts_tree(variant, "tree_parallel"):
+            if verbose:
+                print("Skipping {}, {} has no {}".format(variant, mcts_variants[variant][3],
+                                                         mcts_trees["tree_parallel"]))
+            continue
+        vocabulary = guide_vocabulary(variant)
+        for length in lengths:
+            guides = [synthetic_guide(vocabulary, length, np.random.RandomState(seed + 1000 * length + g))
+                      for g in range(n_guides)]
+            for n_playout in n_playouts:
+                base_rate = None
+                for n_workers in worker_counts:
+                    runs = [run_generation(variant, guide, n_playout, max_resets=max_resets, seed=seed + g,
+                                           tree="tree_parallel", n_workers=n_workers)
+                            for g, guide in enumerate(guides)]
+                    rate = sum([r["playouts"] for r in runs]) / sum([r["wall_time"] for r in runs])
+                    if base_rate is None:
+                        base_rate = rate
+                    speedup = rate / base_rate
+                    row = {"variant": variant,
+                           "length": length,
+                           "n_playout": n_playout,
+                           "n_workers": n_workers,
+                           "wall_time": np.mean([r["wall_time"] for r in runs]),
+                           "playouts_per_sec": rate,
+                           "speedup": speedup,
+                           "efficiency": speedup / max(1, n_workers),
+                           "success_rate": np.mean([r["success"] for r in runs]),
+                           "runs": runs}
+                    rows.append(row)
+                    if verbose:
+                        print(format_worker_row(row))
+    return rows
+
+
+worker_table_header = "{:<18} {:>6} {:>9} {:>8} {:>12} {:>14} {:>8} {:>10} {:>9}".format(
+    "variant", "length", "n_playout", "workers", "wall (s)", "playouts/sec", "speedup", "efficiency", "success")
+
+
+def format_worker_row(row):
+    return "{:<18} {:>6} {:>9} {:>8} {:>12.3f} {:>14.1f} {:>8.2f} {:>10.2f} {:>9.2f}".format(
+        row["variant"], row["length"], row["n_playout"], row["n_workers"], row["wall_time"],
+        row["playouts_per_sec"], row["speedup"], row["efficiency"], row["success_rate"])
+
+
+table_header = "{:<18} {:>6} {:>9} {:>12} {:>14} {:>14} {:>8} {:>9} {:>10} {:>10}".format(
+    "variant", "length", "n_playout", "wall (s)", "playouts/sec", "rollout len", "resets", "success",
+    "nodes", "tree MB")
+
+
+def format_row(row):
+    return "{:<18} {:>6} {:>9} {:>12.3f} {:>14.1f} {:>14.2f} {:>8.2f} {:>9.2f} {:>10.0f} {:>10.3f}".format(
+        row["variant"], row["length"], row["n_playout"], row["wall_time"], row["playouts_per_sec"],
+        row["mean_rollout_length"], row["resets"], row["success_rate"], row["tree_nodes"],
+        row["tree_bytes"] / 1E6)
+
+
+def format_table(rows):
+    return "\n".join([table_header] + [format_row(r) for r in rows])
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="MCTS generation scaling versus guide length and playout budget")
+    parser.add_argument("--variants", nargs="*", default=sorted(mcts_variants.keys()),
+                        choices=sorted(mcts_variants.keys()))
+    parser.add_argument("--lengths", type=int, nargs="*", default=benchmark_lengths)
+    parser.add_argument("--n_playouts", type=int, nargs="*", default=benchmark_n_playouts)
+    parser.add_argument("--n_guides", type=int, default=2, help="synthetic guides per length")
+    parser.add_argument("--max_resets", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=2017)
+    parser.add_argument("--tree", default="object", choices=sorted(mcts_trees.keys()),
+                        help="MCTS tree storage")
+    parser.add_argument("--max_nodes", type=int, default=None,
+                        help="node budget for the object tree, unchosen subtrees are released on root advance")
+    parser.add_argument("--n_rollouts", type=int, default=1,
+                        help="vectorized rollouts averaged per playout")
+    parser.add_argument("--time_budget", type=float, default=None, help="wall clock seconds per move")
+    parser.add_argument("--early_stop", action="store_true",
+                        help="end a move once the leading action can't be overtaken")
+    parser.add_argument("--solver", action="store_true",
+                        help="MCTS-Solver, proven wins / losses skip rollouts and prune dead subtrees")
+    parser.add_argument("--workers", type=int, nargs="*", default=None,
+                        help="report tree_parallel scaling over these worker counts instead, 0 is serial, "
+                             "variants without tree_parallel are skipped")
+    parser.add_argument("--out", default=None, help="json file for the per run results")
+    args = parser.parse_args()
+
+    if args.workers is not None:
+        print(worker_table_header)
+        rows = run_worker_scaling(args.variants, args.lengths, args.n_playouts, args.workers,
+                                  n_guides=args.n_guides, max_resets=args.max_resets, seed=args.seed)
+        print("")
+        print("\n".join([worker_table_header] + [format_worker_row(r) for r in rows]))
+    else:
+        print(table_header)
+        rows = run_scaling(args.variants, args.lengths, args.n_playouts, n_guides=args.n_guides,
+                           max_resets=args.max_resets, seed=args.seed, tree=args.tree,
+                           max_nodes=args.max_nodes, n_rollouts=args.n_rollouts,
+                           time_budget=args.time_budget, early_stop=args.early_stop, solver=args.solver)
+        print("")
+        print(format_table(rows))
+    if args.out is not None:
+        with open(args.out, "w") as f:
+            json.dump({"args": vars(args), "rows": rows}, f, indent=2)
+        print("Wrote {} rows to {}".format(len(rows), args.out))
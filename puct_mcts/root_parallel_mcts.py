@@ -0,0 +1 @@
+../root_parallel_mcts.py
\ No newline at end of file
@@ -13,7 +13,7 @@ import numpy as np
 import copy
 from shared_puct_mcts import MCTS, MemoizeMutable
 from dataset_wrap import three_voice_species1_wrap
-from analysis import analyze_three_voices, midi_to_notes
+from analysis import midi_to_notes, IncrementalChecker
 
 all_l, all_c_set, u_map, m_map, um_map, l_map, all_i = three_voice_species1_wrap()
 u_inv_map = {v: k for k, v in u_map.items()}
@@ -37,9 +37,12 @@ j_acts_map = {k: v for k, v in enumerate(sorted(j_map.keys()))}
 j_acts_inv_map = {v: k for k, v in j_acts_map.items()}
 
 class ThreeVoiceSpecies1Manager(object):
-    def __init__(self, guide_index, offset_value=None, tonality=None, rollout_limit=1000):
+    def __init__(self, guide_index, offset_value=None, tonality=None, rollout_limit=1000, guide_trace=None, verbose=True):
         self.tonality = tonality
-        self.guide_trace = all_l[guide_index]
+        # guide_trace overrides the dataset guide, e.g. for synthetic cantus firmi
+        if guide_trace is None:
+            guide_trace = all_l[guide_index]
+        self.guide_trace = guide_trace
 
         if offset_value is None:
             # [A - A)
@@ -90,7 +93,8 @@ class ThreeVoiceSpecies1Manager(object):
                     least_index = i
             self.offset_value = least_accidentals
             self.offset_name = offset_names[least_index]
-            print("Setting base note {}".format(self.offset_name))
+            if verbose:
+                print("Setting base note {}".format(self.offset_name))
             min_set_diff = np.inf
             min_set = []
             for n in range(len(all_scale_steps)):
@@ -103,7 +107,8 @@ class ThreeVoiceSpecies1Manager(object):
                         min_set.append(n)
             # use our "preferred" min set / mode
             m = min_set[0]
-            print("Auto-setting mode to {}".format(all_scale_names[m]))
+            if verbose:
+                print("Auto-setting mode to {}".format(all_scale_names[m]))
             self.mode = all_scale_names[m]
             self.scale_steps = all_scale_steps[m]
             base_scale = all_scale_steps[m] + self.offset_value
@@ -114,6 +119,8 @@ class ThreeVoiceSpecies1Manager(object):
         self.notes_in_scale = np.array(sorted(list(set([si for s in [base_scale + o for o in [-24, -12, 0, 12, 24]] for si in s]))))
         self.random_state = np.random.RandomState(1999)
         self.rollout_limit = rollout_limit
+        self.checker = IncrementalChecker(np.array(self.guide_trace) + self.offset_value, n_voices=3,
+                                          species="species1_minimal", cantus_firmus_voices=[2])
         self.is_finished = MemoizeMutable(self._is_finished)
 
     def get_next_state(self, state, action):
@@ -121,6 +128,10 @@ class ThreeVoiceSpecies1Manager(object):
         new_state = [state[0] + [tup_act[0]], state[1] + [tup_act[1]], state[2]]
         return new_state
 
+    def hash_state(self, state):
+        # step and last 3 steps of the upper voices, see transposition_table.py for why that is enough
+        return hash((len(state[0]),) + tuple([tuple(s[-3:]) for s in state[:-1]]))
+
     def get_action_space(self):
         return list(range(len(j_acts_map.keys())))
 
@@ -267,40 +278,13 @@ class ThreeVoiceSpecies1Manager(object):
         #if len(state[0]) != len(state[2]):
         #    return -1, False
 
-        ns0 = state[0] + [0] * (len(state[2]) - len(state[0]))
-        ns1 = state[1] + [0] * (len(state[2]) - len(state[1]))
-        # the state to check
-        s_l = [ns0, ns1, state[2]]
-
-        s = np.array(s_l)
-        s[2, :] += self.offset_value
-        s[0, :] += s[2, :]
-        s[1, :] += s[2, :]
-
-        parts = s
-        durations = [['4'] * len(p) for p in parts]
-        key_signature = "C"
-        time_signature = "4/4"
         # minimal check during rollout
-        aok = analyze_three_voices(parts, durations, key_signature, time_signature,
-                                   species="species1_minimal", cantus_firmus_voices=[2])
-
-        if len(aok[1]["False"]) > 0:
-            first_error = aok[1]["False"][0]
-        else:
-            first_error = np.inf
-
-        if len(state[0]) < len(state[2]):
-            # error is out of our control (in the padded notes)
-            if first_error > (len(state[0]) - 1):
-                return 0, 0., False
-            else:
-                # made a mistake
-                return 0, -1. + len(state[0]) / float(len(state[2])), True
-        elif aok[0]:
-            return 1, 1., True
-        else:
-            return -1, -1., True
+        # same result as checking the zero padded state,
+        # but only the steps touched by the newest notes are analyzed
+        bot = np.array(state[2]) + self.offset_value
+        top = bot[:len(state[0])] + np.array(state[0])
+        mid = bot[:len(state[1])] + np.array(state[1])
+        return self.checker.status([top, mid])
 
 
 if __name__ == "__main__":
@@ -13,7 +13,7 @@ import numpy as np
 import copy
 from shared_puct_mcts import MCTS, MemoizeMutable
 from dataset_wrap import two_voice_species1_wrap
-from analysis import analyze_two_voices
+from analysis import IncrementalChecker
 
 all_l, l_map, p_map, all_i = two_voice_species1_wrap()
 l_inv_map = {v: k for k, v in l_map.items()}
@@ -28,15 +28,20 @@ j_acts_map = {k: v for k, v in enumerate(sorted(j_map.keys()))}
 j_acts_inv_map = {v: k for k, v in j_acts_map.items()}
 
 class TwoVoiceSpecies1Manager(object):
-    def __init__(self, guide_index, default_mode="C", offset_value=60, tonality="-", rollout_limit=1000):
+    def __init__(self, guide_index, default_mode="C", offset_value=60, tonality="-", rollout_limit=1000, guide_trace=None):
         self.default_mode = default_mode
         self.offset_value = offset_value
         # M or m or - major or minor or any tonality
         self.tonality = tonality
-        self.guide_trace = all_l[guide_index]
+        # guide_trace overrides the dataset guide, e.g. for synthetic cantus firmi
+        if guide_trace is None:
+            guide_trace = all_l[guide_index]
+        self.guide_trace = guide_trace
 
         self.random_state = np.random.RandomState(1999)
         self.rollout_limit = rollout_limit
+        self.checker = IncrementalChecker(np.array(self.guide_trace) + self.offset_value, n_voices=2,
+                                          species="species1_minimal", cantus_firmus_voices=[1])
         self.is_finished = MemoizeMutable(self._is_finished)
 
     def get_next_state(self, state, action):
@@ -44,6 +49,10 @@ class TwoVoiceSpecies1Manager(object):
         new_state = [state[0] + [act], state[1]]
         return new_state
 
+    def hash_state(self, state):
+        # step and last 3 steps of the upper voices, see transposition_table.py for why that is enough
+        return hash((len(state[0]),) + tuple([tuple(s[-3:]) for s in state[:-1]]))
+
     def get_action_space(self):
         return list(range(len(j_acts_map.keys())))
 
@@ -148,37 +157,11 @@ class TwoVoiceSpecies1Manager(object):
             # nothing has happened yet
             return 0, 0., False
 
-        ns0 = state[0] + [0] * (len(state[1]) - len(state[0]))
-        s_l = [ns0, state[1]]
-
-        s = np.array(s_l)
-        s[1, :] += self.offset_value
-        s[0, :] += s[1, :]
-
-        parts = s
-        durations = [['4'] * len(p) for p in parts]
-        key_signature = "C"
-        time_signature = "4/4"
-        # add caching here?
-        aok = analyze_two_voices(parts, durations, key_signature, time_signature,
-                                 species="species1_minimal", cantus_firmus_voices=[1])
-
-        if len(aok[1]["False"]) > 0:
-            first_error = aok[1]["False"][0]
-        else:
-            first_error = np.inf
-
-        if len(state[0]) < len(state[1]):
-            # error is out of our control (in the padded notes)
-            if first_error > (len(state[0]) - 1):
-                return 0, 0., False
-            else:
-                # made a mistake
-                return 0, -1. + len(state[0]) / float(len(state[1])), True
-        elif aok[0]:
-            return 1, 1., True
-        else:
-            return -1, -1., True
+        # same result as a minimal check of the zero padded state,
+        # but only the steps touched by the newest note are analyzed
+        bot = np.array(state[1]) + self.offset_value
+        top = bot[:len(state[0])] + np.array(state[0])
+        return self.checker.status([top])
 
 
 if __name__ == "__main__":
@@ -12,6 +12,13 @@
 
 import numpy as np
 
+
+def puct_scores(Q, P, n_visits, parent_visits, c_puct):
+    # TreeNode.get_value for every child in one expression
+    # same operation order as the scalar version, so the scores (and argmax ties) match exactly
+    return Q + c_puct * P * np.sqrt(parent_visits) / (n_visits + 1)
+
+
 class TreeNode(object):
     def __init__(self, parent, prior_prob):
         self.parent = parent
@@ -55,16 +62,23 @@ class TreeNode(object):
         self.Q_ += (value - self.Q_) / float(self.n_visits_)
 
     def update(self, value):
-        if self.parent != None:
-            # negative in the original code due to being the opposing player?
-            #self.parent.update(-value)
-            self.parent.update(value)
-        self._update(value)
+        # this node and every ancestor, walked iteratively (no recursion limit on deep trees)
+        # negative in the original code due to being the opposing player?
+        #self.parent.update(-value)
+        node = self
+        while node is not None:
+            node._update(value)
+            node = node.parent
 
     def get_value(self, c_puct):
         U = c_puct * self.P * np.sqrt(self.parent.n_visits_) / (self.n_visits_ + 1)
         return self.Q_ + U
 
     def get_best(self, c_puct):
-        best = max(self.children_.iteritems(), key=lambda x: x[1].get_value(c_puct))
+        # first child with the highest value, in children_ order like max()
+        children = list(self.children_.items())
+        Q = np.array([c.Q_ for a, c in children], dtype="float64")
+        P = np.array([c.P for a, c in children], dtype="float64")
+        n_visits = np.array([c.n_visits_ for a, c in children], dtype="float64")
+        best = children[np.argmax(puct_scores(Q, P, n_visits, self.n_visits_, c_puct))]
         return best
@@ -98,16 +98,19 @@ class MusicStateManager(object):
         midi = [[um for um in upper_midi], [lm for lm in lower_midi]]
         return midi
 
-    def evaluate_sequence(self, midi_sequence, minimal=False):
+    def evaluate_sequence(self, midi_sequence, minimal=False, early_exit=False):
         parts = midi_sequence
         durations = [['4'] * len(p) for p in parts]
         key_signature = "C"
         time_signature = "4/4"
         # minimal check is during rollout/playout, avoid checking start / end of sequence rules among others
+        # early_exit only returns (all_ok, first failing step or -1)
         if minimal:
             aok = analyze_two_voices(parts, durations, key_signature, time_signature,
-                                     species="species1_minimal", cantus_firmus_voices=[1])
+                                     species="species1_minimal", cantus_firmus_voices=[1],
+                                     early_exit=early_exit)
         else:
             aok = analyze_two_voices(parts, durations, key_signature, time_signature,
-                                     species="species1", cantus_firmus_voices=[1])
+                                     species="species1", cantus_firmus_voices=[1],
+                                     early_exit=early_exit)
         return aok
@@ -56,6 +56,8 @@ class NetMCTS(object):
 
     def playout(self, state):
         node = self.root
+        # selection path from the root to the leaf, the value is backed up along it
+        path = [node]
         states = []
         while True:
             if node.is_leaf():
@@ -67,20 +69,26 @@ class NetMCTS(object):
                 if end:
                     full_seq = self.make_full_sequence(list(states))
                     midi = self.state_manager.reconstruct_sequence(full_seq)
-                    local_musical_check = self.state_manager.evaluate_sequence(midi, minimal=True)
+                    local_musical_check = self.state_manager.evaluate_sequence(midi, minimal=True, early_exit=True)
 
                     if local_musical_check[0]:
                         value = 1.
                     else:
                         value = -1.
-                node.update(value)
+                self.update_path(path, value)
                 return value
             else:
                 # greedy select
                 action, node = node.get_best(self.c_puct)
+                path.append(node)
                 state = self.state_manager.next_state(state, action)
                 states.append(state)
 
+    def update_path(self, path, value):
+        # same updates as node.update(value) on the leaf, the root has no parent
+        for node in path:
+            node._update(value)
+
     def get_move_probs(self, state, temp=1E-3):
         mgr = copy.deepcopy(self.state_manager)
         for n in range(self.n_playout):
@@ -0,0 +1,247 @@
+# Author: Kyle Kastner
+# License: BSD 3-Clause
+# root parallel MCTS, n_workers processes each search the same state with their own tree and seeds
+# root child visit counts are summed over workers before an action is picked
+# workers run mcts_cls.search, so time_budget / early_stop / solver in mcts_kwargs and SearchBudget work as with MCTS
+# symlinked into base_mcts and puct_mcts like analysis.py, works with MCTS / ArrayMCTS from either shared module
+# example, replacing the MCTS in the __main__ loops of the variant scripts:
+# from shared_mcts import MCTS
+# from root_parallel_mcts import RootParallelMCTS
+# mcts = RootParallelMCTS(MCTS, tvsp1m, n_workers=4, n_playout=1000, random_state=mcts_random)
+import time
+import traceback
+import multiprocessing
+
+import numpy as np
+
+
+def softmax(x):
+    assert len(x.shape) == 1
+    probs = np.exp(x - np.max(x))
+    probs /= np.sum(probs)
+    return probs
+
+
+def _worker_loop(conn, mcts_cls, state_manager, seed, n_playout, mcts_kwargs):
+    # the worker owns one tree for its whole life, so its subtree stays warm across update_tree_root
+    random_state = np.random.RandomState(seed)
+    if hasattr(state_manager, "random_state"):
+        # managers draw rollouts from their own RandomState, every worker gets a distinct one
+        state_manager.random_state = np.random.RandomState(random_state.randint(0, 2 ** 31 - 1))
+    try:
+        mcts = mcts_cls(state_manager, n_playout=n_playout, random_state=random_state, **mcts_kwargs)
+    except Exception:
+        # e.g. options mcts_cls does not support, reported to RootParallelMCTS.__init__
+        conn.send(("error", traceback.format_exc()))
+        conn.close()
+        return
+    conn.send(("ok", None))
+    while True:
+        cmd, arg = conn.recv()
+        if cmd == "close":
+            conn.close()
+            break
+        try:
+            if cmd == "search":
+                # arg is (state, this worker's n_playout, time_budget), search applies the
+                # time budget, early_stop, forced moves and solver stops of mcts_kwargs
+                state, worker_playout, time_budget = arg
+                stats = mcts.search(state, worker_playout, time_budget)
+                act_visits = mcts.root_visits()
+                if getattr(mcts, "solver", False) and len(act_visits) > 0:
+                    # proofs stay per worker, each one only votes for the children it has not ruled out
+                    act_visits = mcts.solver_visits(act_visits)
+                r = (act_visits, stats)
+            elif cmd == "update_tree_root":
+                r = mcts.update_tree_root(arg)
+            elif cmd == "reconstruct_tree":
+                r = mcts.reconstruct_tree()
+            elif cmd == "reset_tree":
+                r = mcts.reset_tree()
+            elif cmd == "memory_footprint":
+                r = mcts.memory_footprint()
+            else:
+                raise ValueError("Unknown worker command {}".format(cmd))
+            conn.send(("ok", r))
+        except Exception:
+            conn.send(("error", traceback.format_exc()))
+
+
+class RootParallelMCTS(object):
+    def __init__(self, mcts_cls, state_manager, n_workers=2, n_playout=1000, random_state=None, **mcts_kwargs):
+        # mcts_kwargs (c_uct / c_puct, max_nodes, ...) go to mcts_cls in every worker
+        # n_playout is the total per move, split as evenly as possible over the workers
+        # results depend only on random_state and n_workers, workers are always read back in order
+        if random_state is None:
+            raise ValueError("Must pass random_state object")
+        if n_workers < 1:
+            raise ValueError("n_workers must be >= 1, got {}".format(n_workers))
+        if n_playout < n_workers:
+            raise ValueError("n_playout {} must be >= n_workers {}, every worker expands its root".format(n_playout, n_workers))
+        self.random_state = random_state
+        self.state_manager = state_manager
+        self.n_workers = n_workers
+        self.n_playout = n_playout
+        self.worker_seeds_ = [int(s) for s in random_state.randint(0, 2 ** 31 - 1, size=n_workers)]
+        self.worker_playouts_ = self.split_playouts(n_playout)
+        self.last_search_ = None
+        self.budget_used_ = {"moves": 0, "playouts": 0, "time": 0., "stops": {}}
+        self.conns_ = []
+        self.workers_ = []
+        for k in range(n_workers):
+            parent_conn, child_conn = multiprocessing.Pipe()
+            # on fork the worker starts from a copy of mcts_cls and state_manager, nothing is pickled
+            p = multiprocessing.Process(target=_worker_loop,
+                                        args=(child_conn, mcts_cls, state_manager, self.worker_seeds_[k],
+                                              self.worker_playouts_[k], mcts_kwargs))
+            p.daemon = True
+            p.start()
+            child_conn.close()
+            self.conns_.append(parent_conn)
+            self.workers_.append(p)
+        # every worker reports whether it could build its tree
+        try:
+            self._collect("start")
+        except RuntimeError:
+            self.close()
+            raise
+
+    def split_playouts(self, n_playout):
+        # as even as possible, every worker does at least one playout so its root gets expanded
+        return [max(1, n_playout // self.n_workers + int(k < n_playout % self.n_workers))
+                for k in range(self.n_workers)]
+
+    def _broadcast(self, cmd, arg=None):
+        return self._scatter(cmd, [arg] * len(self.conns_))
+
+    def _scatter(self, cmd, args):
+        # send to every worker first so they run concurrently, then collect in worker order
+        for conn, arg in zip(self.conns_, args):
+            conn.send((cmd, arg))
+        return self._collect(cmd)
+
+    def _collect(self, cmd):
+        results = []
+        errors = []
+        for k, conn in enumerate(self.conns_):
+            status, r = conn.recv()
+            if status == "error":
+                errors.append("worker {}:\n{}".format(k, r))
+            results.append(r)
+        if len(errors) > 0:
+            raise RuntimeError("RootParallelMCTS {} failed\n{}".format(cmd, "\n".join(errors)))
+        return results
+
+    def search(self, state, n_playout=None, time_budget=None):
+        # every worker searches from state with its share of n_playout, time_budget is wall clock
+        # so each worker gets all of it, defaults are self.n_playout and the workers' own time_budget
+        # returns the accounting for this move like MCTS.search, kept in last_search_ and summed
+        # in budget_used_, playouts are summed over workers and stop is the workers' common reason
+        # ("mixed" if they disagree), per worker accounting is in "workers"
+        # sets self.act_visits_, [(action, summed n_visits)] in first seen order over workers
+        if n_playout is None:
+            n_playout = self.n_playout
+        start_time = time.time()
+        args = [(state, worker_playout, time_budget) for worker_playout in self.split_playouts(n_playout)]
+        results = self._scatter("search", args)
+        merged = {}
+        order = []
+        for act_visits, worker_stats in results:
+            for act, n_visits in act_visits:
+                if act not in merged:
+                    merged[act] = 0
+                    order.append(act)
+                merged[act] += n_visits
+        self.act_visits_ = [(act, merged[act]) for act in order]
+        worker_stats = [r[1] for r in results]
+        stops = set([ws["stop"] for ws in worker_stats])
+        stop = stops.pop() if len(stops) == 1 else "mixed"
+        n_done = sum([ws["playouts"] for ws in worker_stats])
+        stats = {"playouts": n_done,
+                 "time": time.time() - start_time,
+                 "stop": stop,
+                 "n_playout": n_playout,
+                 "time_budget": worker_stats[0]["time_budget"],
+                 "workers": worker_stats}
+        self.last_search_ = stats
+        self.budget_used_["moves"] += 1
+        self.budget_used_["playouts"] += n_done
+        self.budget_used_["time"] += stats["time"]
+        self.budget_used_["stops"][stop] = self.budget_used_["stops"].get(stop, 0) + 1
+        return stats
+
+    def root_visits(self, state, n_playout=None, time_budget=None):
+        # run every worker search from state, [(action, summed n_visits)] in first seen order over workers
+        self.search(state, n_playout, time_budget)
+        return self.act_visits_
+
+    def get_action_probs(self, state, temp=1E-3, n_playout=None, time_budget=None):
+        # low temp -> nearly argmax
+        act_visits = self.root_visits(state, n_playout, time_budget)
+        if len(act_visits) == 0:
+            return None, None
+        actions, visits = zip(*act_visits)
+        if len(actions) == 1:
+            # forced move, possibly decided before the child was visited
+            return actions, np.ones((1,))
+        action_probs = softmax(1. / temp * np.log(visits))
+        return actions, action_probs
+
+    def sample_action(self, state, temp=1E-3, add_noise=True,
+                      dirichlet_coeff1=0.25, dirichlet_coeff2=0.3, n_playout=None, time_budget=None):
+        vsz = len(self.state_manager.get_action_space())
+        act_probs = np.zeros((vsz,))
+        acts, probs = self.get_action_probs(state, temp, n_playout, time_budget)
+        if acts == None:
+            return acts, probs
+        act_probs[list(acts)] = probs
+        if add_noise:
+            act = self.random_state.choice(acts, p=(1. - dirichlet_coeff1) * probs + dirichlet_coeff1 * self.random_state.dirichlet(dirichlet_coeff2 * np.ones(len(probs))))
+        else:
+            act = self.random_state.choice(acts, p=probs)
+        return act, act_probs
+
+    def get_action(self, state, n_playout=None, time_budget=None):
+        vsz = len(self.state_manager.get_action_space())
+        act_probs = np.zeros((vsz,))
+        # temp doesn't matter for argmax
+        acts, probs = self.get_action_probs(state, temp=1., n_playout=n_playout, time_budget=time_budget)
+        if acts == None:
+            return acts, probs
+        act_probs[list(acts)] = probs
+        maxes = np.max(act_probs)
+        opts = np.where(act_probs == maxes)[0]
+        if len(opts) > 1:
+            # if 2 options are *exactly* equal, just choose 1 at random
+            self.random_state.shuffle(opts)
+        act = opts[0]
+        return act, act_probs
+
+    def update_tree_root(self, action):
+        self._broadcast("update_tree_root", action)
+
+    def reconstruct_tree(self):
+        self._broadcast("reconstruct_tree")
+
+    def reset_tree(self):
+        self._broadcast("reset_tree")
+
+    def memory_footprint(self):
+        # summed over workers
+        footprints = self._broadcast("memory_footprint")
+        return {"nodes": sum([f["nodes"] for f in footprints]),
+                "bytes": sum([f["bytes"] for f in footprints]),
+                "n_workers": self.n_workers}
+
+    def close(self):
+        for conn in self.conns_:
+            try:
+                conn.send(("close", None))
+            except (IOError, OSError):
+                # the worker already exited
+                pass
+            conn.close()
+        for p in self.workers_:
+            p.join()
+        self.conns_ = []
+        self.workers_ = []
@@ -0,0 +1,85 @@
+# Author: Kyle Kastner
+# License: BSD 3-Clause
+# transposition table for the MCTS variants, nodes reached by different paths to the same state share statistics
+# symlinked into base_mcts and puct_mcts like analysis.py
+# NetMCTS is not covered, its tree also walks illegal notes and the terminal value checks the whole path,
+# so no summary short of the full path decides a state's value
+# states are keyed by state_manager.hash_state(state), which the state manager must define
+# hash_state should summarize only what the future of a state depends on (step, last notes, rule window),
+# a hash of the full note history never repeats across paths and the table would never share a node
+# the base and puct managers key on the step and the last 3 steps of the upper voices: is_finished closes
+# the rule window of the previous step (the last 3 steps), while get_valid_actions and every later check
+# only see the last 2, so tree states with equal keys continue the same way
+# only the _score of a finished piece still depends on the earlier notes
+import sys
+from collections import OrderedDict
+
+
+class TranspositionTable(object):
+    def __init__(self, max_entries=100000):
+        # max_entries caps the table, least recently used entries are evicted first
+        # evicted nodes stay in the tree, they just stop being shared
+        self.max_entries = max_entries
+        # hash -> node, oldest use first
+        self.table_ = OrderedDict()
+        # id(node) -> hash, for every node in table_, so freed nodes can be dropped (see discard)
+        self.hashes_ = {}
+        self.hits_ = 0
+        self.misses_ = 0
+        self.evictions_ = 0
+        self.transpositions_ = 0
+
+    def lookup(self, h):
+        node = self.table_.pop(h, None)
+        if node is None:
+            self.misses_ += 1
+            return None
+        # reinsert as most recently used
+        self.table_[h] = node
+        self.hits_ += 1
+        return node
+
+    def store(self, h, node):
+        self.table_[h] = node
+        self.hashes_[id(node)] = h
+        while len(self.table_) > self.max_entries:
+            old_h, old = self.table_.popitem(last=False)
+            self.hashes_.pop(id(old), None)
+            self.evictions_ += 1
+
+    def discard(self, nodes):
+        # drop the entries of nodes freed from the tree, the table must not keep them alive
+        for node in nodes:
+            h = self.hashes_.pop(id(node), None)
+            if h is not None and self.table_.get(h) is node:
+                del self.table_[h]
+
+    def resolve(self, children, action, child, h):
+        # node to descend into for children[action] == child, whose state hashes to h
+        # a fresh child is swapped for the node already stored under h, so both parents share it
+        # the caller owns the node accounting, a returned node other than child means child was dropped
+        shared = self.lookup(h)
+        if shared is None:
+            self.store(h, child)
+            return child
+        if shared is child:
+            return child
+        if child.n_visits_ == 0 and child.children_ == {}:
+            children[action] = shared
+            self.transpositions_ += 1
+            return shared
+        # both nodes already have statistics of their own, keep them apart
+        return child
+
+    def clear(self):
+        self.table_ = OrderedDict()
+        self.hashes_ = {}
+
+    def stats(self):
+        return {"entries": len(self.table_),
+                "max_entries": self.max_entries,
+                "hits": self.hits_,
+                "misses": self.misses_,
+                "evictions": self.evictions_,
+                "transpositions": self.transpositions_,
+                "bytes": sys.getsizeof(self.table_) + sys.getsizeof(self.hashes_)}